@@ -0,0 +1,104 @@
+"""
+Typed columnar cache of the csv model outputs. The first read of a csv
+converts it to a float64 .npy sidecar (one contiguous row per column) under
+.cache/ next to it; later reads memory map the sidecar. The sidecar is
+converted again when the csv changes: its size and mtime are checked
+first, and its sha256 when only the mtime changed.
+"""
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = ".cache"
+HASH_BLOCK_SIZE = 1 << 20
+
+Columns = dict[str, np.ndarray]
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sidecar_paths(path: str) -> tuple[str, str]:
+    """
+    Paths of the .npy sidecar of a csv and of its metadata
+    """
+    directory, filename = os.path.split(path)
+    stem = os.path.join(directory, CACHE_DIR, filename)
+    return stem + ".npy", stem + ".json"
+
+
+def is_fresh(path: str, metadata_path: str, separator: str) -> bool:
+    if not os.path.exists(metadata_path):
+        return False
+    with open(metadata_path, "r") as f:
+        metadata = json.load(f)
+
+    stat = os.stat(path)
+    if metadata["separator"] != separator or metadata["size"] != stat.st_size:
+        return False
+    if metadata["mtime_ns"] == stat.st_mtime_ns:
+        return True
+
+    if metadata["sha256"] != file_hash(path):
+        return False
+    metadata["mtime_ns"] = stat.st_mtime_ns
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    return True
+
+
+def convert(path: str, separator: str):
+    """
+    Parses the csv once and writes its sidecar and metadata
+    """
+    npy_path, metadata_path = sidecar_paths(path)
+    os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+
+    stat = os.stat(path)
+    data_frame = pd.read_csv(path, sep=separator, decimal=".", dtype=np.float64)
+    values = np.ascontiguousarray(data_frame.to_numpy(dtype=np.float64).T)
+
+    # Written under a temporary name, so an interrupted conversion is never
+    # taken for a complete sidecar
+    tmp_path = npy_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, values)
+    os.replace(tmp_path, npy_path)
+
+    with open(metadata_path, "w") as f:
+        json.dump(
+            {
+                "columns": list(data_frame.columns),
+                "separator": separator,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_hash(path),
+            },
+            f,
+            indent=2,
+        )
+
+
+def load(path: str, separator: str = " ") -> Columns:
+    """
+    Columns of a csv as read only memory mapped arrays, converting it first
+    when its sidecar is missing or stale
+    """
+    npy_path, metadata_path = sidecar_paths(path)
+    if not (os.path.exists(npy_path) and is_fresh(path, metadata_path, separator)):
+        print(f"Converting {path} to {npy_path}")
+        convert(path, separator)
+
+    with open(metadata_path, "r") as f:
+        columns = json.load(f)["columns"]
+    values = np.load(npy_path, mmap_mode="r")
+    return {column: values[i] for i, column in enumerate(columns)}
@@ -0,0 +1,547 @@
+"""
+Reference simulator of the Hindmarsh-Rose model. Many parameter sets are
+integrated at once as arrays (fixed step RK4, or Dormand-Prince with an
+adaptive step per set), in chunks spread across a process pool. Every chunk
+streams its trajectories to its own parquet file, and the spikes and bursts
+of every set are summarized in summary.parquet.
+"""
+
+import os
+import argparse
+import itertools
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+PARAMETERS = ["I", "a", "b", "c", "d", "r", "s", "xr"]
+INITIAL = ["x0", "y0", "z0"]
+STATE = ["x", "y", "z"]
+
+TRAJECTORIES_DIR = "trajectories"
+SUMMARY_NAME = "summary.parquet"
+# Output samples integrated (and written) at once by every chunk
+SAMPLES_PER_BLOCK = 10_000
+
+# Dormand-Prince 5(4) tableau (the model is autonomous, so no c column)
+DP_A = [
+    np.array(row)
+    for row in [
+        [],
+        [1 / 5],
+        [3 / 40, 9 / 40],
+        [44 / 45, -56 / 15, 32 / 9],
+        [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+        [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+        [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+    ]
+]
+DP_B = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0])
+DP_B_LOW = np.array(
+    [5179 / 57600, 0, 7571 / 16695, 393 / 640, -92097 / 339200, 187 / 2100, 1 / 40]
+)
+DP_ERROR = DP_B - DP_B_LOW
+# A set whose adaptive step falls under this fraction of the span, or that
+# needs more than MAX_STEPS steps to cover it, has diverged and is dropped
+MIN_STEP_FRACTION = 1e-10
+MAX_STEPS = 100_000
+
+
+@dataclass
+class HRParams:
+    """
+    Parameters of the RTHybrid Hindmarsh-Rose model used in the rtxi circuits
+    """
+
+    I: float = 3.0
+    a: float = 1.0
+    b: float = 3.0
+    c: float = 1.0
+    d: float = 5.0
+    r: float = 0.0021
+    s: float = 4.0
+    xr: float = -1.6
+    x0: float = -0.712841
+    y0: float = -1.93688
+    z0: float = 3.16568
+
+
+@dataclass
+class Integration:
+    duration: float = 2000.0
+    output_dt: float = 0.1
+    # Time integrated before the first output sample
+    transient: float = 0.0
+    method: str = "rk4"
+    dt: float = 0.01
+    rtol: float = 1e-6
+    atol: float = 1e-9
+    # Upward crossings of x over this value are spikes
+    spike_threshold: float = 0.0
+    # Spikes further apart than this are in different bursts
+    burst_gap: float = 50.0
+
+
+def derivatives(
+    state: np.ndarray, params: dict[str, np.ndarray], out: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Derivatives of the (3, sets) state array, written on out when given
+    """
+    x, y, z = state
+    out = np.empty_like(state) if out is None else out
+    x2 = x * x
+    np.multiply(params["b"] - params["a"] * x, x2, out=out[0])
+    out[0] += y - z + params["I"]
+    np.subtract(params["c"] - params["d"] * x2, y, out=out[1])
+    np.multiply(params["s"], x - params["xr"], out=out[2])
+    out[2] -= z
+    out[2] *= params["r"]
+    return out
+
+
+def rk4_advance(
+    state: np.ndarray, span: float, params: dict[str, np.ndarray], dt: float
+) -> np.ndarray:
+    """
+    Advances every set by span in RK4 steps of about dt, reusing the
+    buffers of the stages
+    """
+    steps = max(1, int(round(span / dt)))
+    step = span / steps
+    k1, k2, k3, k4 = (np.empty_like(state) for _ in range(4))
+    stage = np.empty_like(state)
+    state = state.copy()
+    for _ in range(steps):
+        derivatives(state, params, k1)
+        np.multiply(k1, step / 2, out=stage)
+        stage += state
+        derivatives(stage, params, k2)
+        np.multiply(k2, step / 2, out=stage)
+        stage += state
+        derivatives(stage, params, k3)
+        np.multiply(k3, step, out=stage)
+        stage += state
+        derivatives(stage, params, k4)
+        k2 += k3
+        k2 *= 2
+        k1 += k2
+        k1 += k4
+        k1 *= step / 6
+        state += k1
+    return state
+
+
+def dopri_advance(
+    state: np.ndarray,
+    span: float,
+    params: dict[str, np.ndarray],
+    h: np.ndarray,
+    rtol: float,
+    atol: float,
+    failed: np.ndarray,
+) -> np.ndarray:
+    """
+    Advances every set by span with its own adaptive step h (updated in
+    place). Sets that already arrived take zero length steps. Sets that
+    diverge are marked in failed (also in place) and left as NaN.
+    """
+    t = np.zeros(state.shape[1])
+    k = np.empty((7,) + state.shape)
+    # Stages as rows, so every combination of them is a single matmul
+    rows = k.reshape(7, -1)
+    stage = np.empty_like(state)
+    derivatives(state, params, k[0])
+    for _ in range(MAX_STEPS):
+        remaining = span - t
+        active = (remaining > 1e-12 * span) & ~failed
+        if not active.any():
+            return state
+        step = np.where(active, np.minimum(h, remaining), 0.0)
+
+        for i in range(1, 7):
+            np.multiply((DP_A[i] @ rows[:i]).reshape(state.shape), step, out=stage)
+            stage += state
+            derivatives(stage, params, k[i])
+        # The last stage is evaluated at the 5th order solution
+        high = stage
+        error_estimate = (DP_ERROR @ rows).reshape(state.shape) * step
+
+        scale = atol + rtol * np.maximum(np.abs(state), np.abs(high))
+        error = np.sqrt(np.mean((error_estimate / scale) ** 2, axis=0))
+        # A blown up stage gives a non finite error, rejected to shrink h
+        finite = np.isfinite(error) & np.isfinite(high).all(axis=0)
+        accept = active & finite & (error <= 1)
+
+        if accept.all():
+            state = high.copy()
+            # First same as last: the derivatives at the new state are known
+            k[0] = k[6]
+        else:
+            state = np.where(accept, high, state)
+            k[0] = np.where(accept, k[6], k[0])
+        t = np.where(accept, t + step, t)
+        with np.errstate(invalid="ignore"):
+            factor = np.clip(0.9 * np.maximum(error, 1e-10) ** -0.2, 0.2, 5.0)
+        factor = np.where(finite, factor, 0.2)
+        # A step shortened to land on the output time does not shrink h
+        clipped = accept & (step < h)
+        h[:] = np.where(active & ~clipped, step * factor, h)
+
+        diverged = active & (h < MIN_STEP_FRACTION * span)
+        if diverged.any():
+            failed |= diverged
+            state = np.where(diverged, np.nan, state)
+
+    # Sets still not arrived after MAX_STEPS steps
+    remaining = span - t
+    stuck = (remaining > 1e-12 * span) & ~failed
+    failed |= stuck
+    return np.where(stuck, np.nan, state)
+
+
+def integrate(
+    params: dict[str, np.ndarray], initial: np.ndarray, integration: Integration
+) -> Iterator[np.ndarray]:
+    """
+    Blocks of (samples, 3, sets) output samples of every set. The same
+    buffer is filled for every block, copy what has to outlive it. A set
+    that diverges is NaN from then on.
+    """
+    state = initial.copy()
+    h = np.full(state.shape[1], integration.dt)
+    failed = np.zeros(state.shape[1], dtype=np.bool_)
+
+    def advance(state: np.ndarray, span: float) -> np.ndarray:
+        if integration.method == "rk4":
+            return rk4_advance(state, span, params, integration.dt)
+        return dopri_advance(
+            state, span, params, h, integration.rtol, integration.atol, failed
+        )
+
+    if integration.transient > 0:
+        state = advance(state, integration.transient)
+
+    samples = int(round(integration.duration / integration.output_dt)) + 1
+    block = np.empty((min(samples, SAMPLES_PER_BLOCK),) + state.shape)
+    filled = 0
+    for sample in range(samples):
+        if sample:
+            state = advance(state, integration.output_dt)
+        block[filled] = state
+        filled += 1
+        if filled == block.shape[0] or sample == samples - 1:
+            yield block[:filled]
+            filled = 0
+
+
+def spike_times(
+    previous: np.ndarray, x: np.ndarray, start: float, output_dt: float, threshold
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sets and times (linearly interpolated) of the upward crossings of
+    threshold in the (samples, sets) block x, previous being the sample
+    before the block (NaN at the start)
+    """
+    x = np.concatenate([previous[None, :], x])
+    before, after = x[:-1], x[1:]
+    samples, sets = np.nonzero((before < threshold) & (after >= threshold))
+    fraction = (threshold - before[samples, sets]) / (
+        after[samples, sets] - before[samples, sets]
+    )
+    return sets, start + (samples - 1 + fraction) * output_dt
+
+
+def burst_summary(
+    sets: np.ndarray, times: np.ndarray, set_count: int, burst_gap: float
+) -> dict[str, np.ndarray]:
+    """
+    Spike and burst statistics of every set. Only the bursts between the
+    first and the last interburst gap are complete, so only those count.
+    """
+    order = np.lexsort((times, sets))
+    sets, times = sets[order], times[order]
+
+    spikes = np.bincount(sets, minlength=set_count)
+    same_set = sets[1:] == sets[:-1]
+    isi = np.diff(times)
+    gap = same_set & (isi > burst_gap)
+
+    # Bursts go from the spike after a gap to the spike before the next gap
+    starts = np.flatnonzero(gap) + 1
+    next_gap = np.concatenate([starts[1:] - 1, [len(times)]])
+    complete = (next_gap < len(times)) & (
+        sets[np.minimum(next_gap, len(times) - 1)] == sets[starts]
+    )
+    starts, ends = starts[complete], next_gap[complete]
+    burst_sets = sets[starts]
+    durations = times[ends] - times[starts]
+    burst_spikes = ends - starts + 1
+
+    bursts = np.bincount(burst_sets, minlength=set_count)
+
+    def mean(values: np.ndarray) -> np.ndarray:
+        return np.bincount(burst_sets, weights=values, minlength=set_count) / bursts
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        periods = np.diff(times[starts])
+        consecutive = burst_sets[1:] == burst_sets[:-1]
+        period_count = np.bincount(burst_sets[1:][consecutive], minlength=set_count)
+        period = (
+            np.bincount(
+                burst_sets[1:][consecutive],
+                weights=periods[consecutive],
+                minlength=set_count,
+            )
+            / period_count
+        )
+        intra_isi = same_set & ~gap
+        isi_count = np.bincount(sets[1:][intra_isi], minlength=set_count)
+        mean_isi = (
+            np.bincount(
+                sets[1:][intra_isi], weights=isi[intra_isi], minlength=set_count
+            )
+            / isi_count
+        )
+
+        return {
+            "spikes": spikes,
+            "bursts": bursts,
+            "burst_duration": mean(durations),
+            "burst_duration_std": np.sqrt(
+                np.maximum(mean(durations**2) - mean(durations) ** 2, 0)
+            ),
+            "burst_period": period,
+            "spikes_per_burst": mean(burst_spikes.astype(np.float64)),
+            "intraburst_isi": mean_isi,
+        }
+
+
+def simulate_chunk(
+    first_set: int,
+    sets: dict[str, np.ndarray],
+    integration: Integration,
+    output: str | None,
+) -> dict[str, np.ndarray]:
+    """
+    Integrates a chunk of parameter sets, streaming its trajectories to
+    output (when given), and returns the summary of every set
+    """
+    params = {name: sets[name] for name in PARAMETERS}
+    initial = np.stack([sets[name] for name in INITIAL])
+    set_count = initial.shape[1]
+    set_ids = np.arange(first_set, first_set + set_count, dtype=np.int64)
+
+    schema = pa.schema(
+        [("set", pa.int64()), ("time", pa.float64())]
+        + [(name, pa.float64()) for name in STATE]
+    )
+    writer = pq.ParquetWriter(output, schema) if output is not None else None
+
+    spike_sets, spike_time_blocks = [], []
+    previous = np.full(set_count, np.nan)
+    start = 0
+    try:
+        for block in integrate(params, initial, integration):
+            samples = block.shape[0]
+            found_sets, found_times = spike_times(
+                previous,
+                block[:, 0, :],
+                start * integration.output_dt,
+                integration.output_dt,
+                integration.spike_threshold,
+            )
+            spike_sets.append(found_sets)
+            spike_time_blocks.append(found_times)
+            # The block buffer is overwritten by the next one
+            previous = block[-1, 0, :].copy()
+
+            if writer is not None:
+                # Ordered by set and then time, so every set is a contiguous
+                # range of rows of the block
+                time = (start + np.arange(samples)) * integration.output_dt
+                columns = {
+                    "set": np.repeat(set_ids, samples),
+                    "time": np.tile(time, set_count),
+                }
+                for i, name in enumerate(STATE):
+                    columns[name] = block[:, i, :].T.ravel()
+                writer.write_table(pa.table(columns, schema=schema))
+            start += samples
+    finally:
+        if writer is not None:
+            writer.close()
+
+    summary = burst_summary(
+        np.concatenate(spike_sets),
+        np.concatenate(spike_time_blocks),
+        set_count,
+        integration.burst_gap,
+    )
+    # Diverged sets end as NaN (or overflow with RK4), their statistics only
+    # cover the samples before
+    summary["failed"] = ~np.isfinite(previous)
+    return {"set": set_ids} | sets | summary
+
+
+def parse_sweep(value: str) -> tuple[str, np.ndarray]:
+    """
+    name=start:stop:count (evenly spaced, both included) or name=v1,v2,...
+    """
+    name, _, values = value.partition("=")
+    if name not in PARAMETERS + INITIAL:
+        raise argparse.ArgumentTypeError(f"unknown parameter {name}")
+    if ":" in values:
+        start, stop, count = values.split(":")
+        return name, np.linspace(float(start), float(stop), int(count))
+    return name, np.array([float(v) for v in values.split(",")])
+
+
+def parameter_grid(
+    base: HRParams, sweeps: list[tuple[str, np.ndarray]]
+) -> dict[str, np.ndarray]:
+    """
+    Every combination of the swept values, the rest taken from base
+    """
+    names = [name for name, _ in sweeps]
+    combinations = list(itertools.product(*(values for _, values in sweeps)))
+    grid = np.array(combinations, dtype=np.float64).reshape(
+        len(combinations), len(names)
+    )
+    return {
+        name: (
+            grid[:, names.index(name)]
+            if name in names
+            else np.full(len(grid), value, dtype=np.float64)
+        )
+        for name, value in asdict(base).items()
+    }
+
+
+def main(
+    output_dir: str,
+    base: HRParams,
+    sweeps: list[tuple[str, np.ndarray]],
+    integration: Integration,
+    chunk_sets: int,
+    jobs: int,
+    trajectories: bool,
+):
+    grid = parameter_grid(base, sweeps)
+    total = len(grid["I"])
+    trajectories_dir = os.path.join(output_dir, TRAJECTORIES_DIR)
+    os.makedirs(trajectories_dir if trajectories else output_dir, exist_ok=True)
+
+    tasks = []
+    for first in range(0, total, chunk_sets):
+        sets = {
+            name: values[first : first + chunk_sets] for name, values in grid.items()
+        }
+        output = (
+            os.path.join(trajectories_dir, f"part-{first // chunk_sets:05d}.parquet")
+            if trajectories
+            else None
+        )
+        tasks.append((first, sets, integration, output))
+    print(f"Simulating {total} parameter sets in {len(tasks)} chunks")
+
+    summaries = []
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+            futures = [pool.submit(simulate_chunk, *task) for task in tasks]
+            for future in as_completed(futures):
+                summaries.append(future.result())
+                print(f"{len(summaries)}/{len(tasks)} chunks done")
+    else:
+        for task in tasks:
+            summaries.append(simulate_chunk(*task))
+            print(f"{len(summaries)}/{len(tasks)} chunks done")
+
+    summary = pa.concat_tables(pa.table(summary) for summary in summaries)
+    summary = summary.sort_by("set")
+    summary_path = os.path.join(output_dir, SUMMARY_NAME)
+    pq.write_table(summary, summary_path)
+    print(f"Summary written on {summary_path}")
+    failed = pc.sum(summary["failed"]).as_py() or 0
+    if failed:
+        print(f"{failed} parameter sets diverged, flagged as failed in the summary")
+    if trajectories:
+        print(f"Trajectories written under {trajectories_dir}")
+
+
+if __name__ == "__main__":
+    params = HRParams()
+    integration = Integration()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--out", type=str, default="simulations/hr")
+    for name, value in asdict(params).items():
+        parser.add_argument(f"--{name}", type=float, default=value)
+    parser.add_argument(
+        "--sweep",
+        type=parse_sweep,
+        action="append",
+        default=[],
+        help="Swept parameter, name=start:stop:count or name=v1,v2,... "
+        "(repeat it for a grid of several parameters)",
+    )
+    parser.add_argument("--duration", type=float, default=integration.duration)
+    parser.add_argument(
+        "--output-dt",
+        type=float,
+        default=integration.output_dt,
+        help="Interval of the output samples",
+    )
+    parser.add_argument("--transient", type=float, default=integration.transient)
+    parser.add_argument(
+        "--method", choices=["rk4", "dopri5"], default=integration.method
+    )
+    parser.add_argument(
+        "--dt",
+        type=float,
+        default=integration.dt,
+        help="RK4 step (initial step with dopri5)",
+    )
+    parser.add_argument("--rtol", type=float, default=integration.rtol)
+    parser.add_argument("--atol", type=float, default=integration.atol)
+    parser.add_argument(
+        "--spike-threshold", type=float, default=integration.spike_threshold
+    )
+    parser.add_argument("--burst-gap", type=float, default=integration.burst_gap)
+    parser.add_argument(
+        "--chunk-sets",
+        type=int,
+        default=1024,
+        help="Parameter sets integrated together by every process",
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--summary-only",
+        action="store_true",
+        help="Only write the summary, not the trajectories",
+    )
+
+    args = parser.parse_args()
+
+    main(
+        args.out,
+        HRParams(**{name: getattr(args, name) for name in asdict(params)}),
+        args.sweep,
+        Integration(
+            args.duration,
+            args.output_dt,
+            args.transient,
+            args.method,
+            args.dt,
+            args.rtol,
+            args.atol,
+            args.spike_threshold,
+            args.burst_gap,
+        ),
+        args.chunk_sets,
+        args.jobs,
+        not args.summary_only,
+    )
@@ -1,40 +1,109 @@
 import os
 import argparse
-import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 
+import csv_cache
+import decimation
+from decimation import plot_line
+from render import FigureCache, FigureSpec, render
 
-def plot_model_data(directory: str, filename: str, name_model: str, separator: str):
-    if not os.path.exists("graphs/execution_" + name_model + "/"):
-        os.makedirs("graphs/execution_" + name_model + "/")
-
-    print("ploting " + filename)
-    data_frame = pd.read_csv(directory + filename, sep=separator, decimal=".")
-    data_frame = data_frame[["x", "time"]]
 
+def draw_model(output_file: str, time: np.ndarray, x: np.ndarray, name: str):
     plt.figure(figsize=(12, 6))
 
-    plt.plot(data_frame["time"], data_frame["x"])
-    # plt.xlim((data_frame["time"].min(), data_frame["time"].max()))
+    plot_line(time, x)
+    # plt.xlim((time.min(), time.max()))
     # plt.ylim(top=5)
 
     plt.margins(0)
-    name = filename.split(".")[0]
 
     plt.xlabel("time (s)")
     plt.ylabel("voltage (mV)")
     plt.title(name)
 
-    plt.savefig("graphs/execution_" + name_model + "/" + name + ".png")
+    plt.savefig(output_file)
     plt.close()
 
 
+def plot_model_data(
+    directory: str,
+    filename: str,
+    name_model: str,
+    separator: str,
+    time_from: float | None = None,
+    time_to: float | None = None,
+) -> FigureSpec:
+    if not os.path.exists("graphs/execution_" + name_model + "/"):
+        os.makedirs("graphs/execution_" + name_model + "/")
+
+    print("ploting " + filename)
+    name = filename.split(".")[0]
+    columns = csv_cache.load(directory + filename, separator)
+    time, x = columns["time"], columns["x"]
+
+    # Only the pages of the memory mapped sidecar in the window are read
+    if time_from is not None or time_to is not None:
+        start = 0 if time_from is None else np.searchsorted(time, time_from, "left")
+        stop = time.size if time_to is None else np.searchsorted(time, time_to, "left")
+        name += f"-{time_from if time_from is not None else time[0]:g}"
+        name += f"-{time_to if time_to is not None else time[-1]:g}"
+        time, x = time[start:stop], x[start:stop]
+
+    return FigureSpec(
+        draw_model,
+        "graphs/execution_" + name_model + "/" + name + ".png",
+        (time, x, name),
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--directory", type=str, default="data/")
-    parser.add_argument("-f", "--filename", type=str, default="", required=True)
+    parser.add_argument(
+        "-f", "--filename", type=str, nargs="+", required=True, help="csv files"
+    )
     parser.add_argument("-s", "--separator", type=str, default=" ")
-    args = parser.parse_args()
-    plot_model_data(
-        args.directory, args.filename, args.filename.split(".")[0], args.separator
+    parser.add_argument("--no-decimate", action="store_true")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of figures rendered in parallel",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render the figures even when their data did not change",
+    )
+    parser.add_argument(
+        "--from", dest="time_from", type=float, help="Start of the time range (s)"
+    )
+    parser.add_argument(
+        "--to", dest="time_to", type=float, help="End of the time range (s)"
+    )
+    args = parser.parse_args()
+    decimation.set_enabled(not args.no_decimate)
+
+    specs = [
+        plot_model_data(
+            args.directory,
+            filename,
+            filename.split(".")[0],
+            args.separator,
+            args.time_from,
+            args.time_to,
+        )
+        for filename in args.filename
+    ]
+    cache = FigureCache(args.force)
+    for output_file in render(
+        specs,
+        args.jobs,
+        initializer=decimation.set_enabled,
+        initargs=(decimation.enabled,),
+        cache=cache,
+    ):
+        print(f"Saved plot to {output_file}")
+    print(f"Figures: {cache.report()}")
@@ -0,0 +1,345 @@
+"""
+Renders figures in a pool of processes with the Agg backend. Every figure
+is described by a FigureSpec: a module level function that draws and saves
+one figure, and its arguments. Large arrays in the arguments are handed to
+the workers through shared memory instead of being pickled. Figures whose
+data, recipe and library versions did not change since they were saved are
+skipped.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import inspect
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from importlib import metadata
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Arrays smaller than this are cheaper to pickle
+SHARE_THRESHOLD = 1 << 16
+
+CACHE_NAME = ".figures.json"
+HASH_BLOCK_SIZE = 1 << 20
+# Libraries whose version is part of the key of every figure
+LIBRARIES = ("matplotlib", "numpy", "pandas", "seaborn")
+
+
+@dataclass
+class FigureSpec:
+    """
+    recipe(output, *args, **kwargs) draws the figure and saves it on output.
+    inputs are the files the recipe reads by itself, if any.
+    """
+
+    recipe: Callable[..., None]
+    output: str
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    inputs: tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+def library_versions() -> dict[str, str]:
+    versions = {}
+    for library in LIBRARIES:
+        try:
+            versions[library] = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            pass
+    return versions
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def local_sources(module) -> list[str]:
+    """
+    Source files of module and of the modules of its directory that it
+    uses, directly or through one another
+    """
+    directory = os.path.dirname(os.path.abspath(module.__file__))
+    sources = set()
+    pending = [module]
+    while pending:
+        current = pending.pop()
+        path = os.path.abspath(getattr(current, "__file__", None) or "")
+        if os.path.dirname(path) != directory or path in sources:
+            continue
+        sources.add(path)
+        for value in vars(current).values():
+            name = value.__name__ if inspect.ismodule(value) else None
+            name = name or getattr(value, "__module__", None)
+            if isinstance(name, str) and name in sys.modules:
+                pending.append(sys.modules[name])
+    return sorted(sources)
+
+
+class FigureCache:
+    """
+    Key of every saved figure, in a manifest next to it. The key hashes the
+    data given to the recipe (or the files it reads), the sources of the
+    module of the recipe and of the script modules it uses, its parameters,
+    and the library versions. A figure is fresh when its output exists and
+    its key did not change.
+    """
+
+    def __init__(self, force: bool = False):
+        self.force = force
+        self.manifests: dict[str, dict[str, str]] = {}
+        self.versions = library_versions()
+        self.digests: dict[int, str] = {}
+        self.sources: dict[str, str] = {}
+        self.rendered = 0
+        self.skipped = 0
+
+    def manifest(self, output: str) -> dict[str, str]:
+        directory = os.path.dirname(output) or "."
+        if directory not in self.manifests:
+            path = os.path.join(directory, CACHE_NAME)
+            entries = {}
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    entries = json.load(f)
+            self.manifests[directory] = entries
+        return self.manifests[directory]
+
+    def update(self, digest, value):
+        """
+        Feeds value to digest, arrays and frames by their content. The
+        digest of an array given to several figures is computed once.
+        """
+        if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+            if id(value) not in self.digests:
+                array_digest = hashlib.sha256()
+                array_digest.update(f"{value.dtype.str}{value.shape}".encode())
+                array_digest.update(np.ascontiguousarray(value).data)
+                self.digests[id(value)] = array_digest.hexdigest()
+            digest.update(self.digests[id(value)].encode())
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            names = value.columns if isinstance(value, pd.DataFrame) else value.name
+            digest.update(repr(names).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().data)
+        elif isinstance(value, (tuple, list)):
+            digest.update(f"{type(value).__name__}{len(value)}".encode())
+            for item in value:
+                self.update(digest, item)
+        elif isinstance(value, dict):
+            digest.update(f"dict{len(value)}".encode())
+            for key, item in value.items():
+                self.update(digest, key)
+                self.update(digest, item)
+        elif callable(value):
+            digest.update(f"{value.__module__}.{value.__qualname__}".encode())
+        else:
+            digest.update(repr(value).encode())
+
+    def source_digest(self, recipe: Callable) -> str:
+        """
+        Digest of the code of a recipe and of the script modules it uses, so
+        a change in a helper of another module also renders the figure again
+        """
+        module = inspect.getmodule(recipe)
+        if module is None or getattr(module, "__file__", None) is None:
+            return hashlib.sha256(inspect.getsource(recipe).encode()).hexdigest()
+        if module.__name__ not in self.sources:
+            digest = hashlib.sha256()
+            for path in local_sources(module):
+                digest.update(file_hash(path).encode())
+            self.sources[module.__name__] = digest.hexdigest()
+        return self.sources[module.__name__]
+
+    def key(self, spec: FigureSpec, context: tuple = ()) -> str:
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self.versions, sort_keys=True).encode())
+        digest.update(self.source_digest(spec.recipe).encode())
+        digest.update(spec.recipe.__qualname__.encode())
+        self.update(digest, (spec.args, spec.kwargs, context))
+        for path in spec.inputs:
+            digest.update(file_hash(path).encode())
+        return digest.hexdigest()
+
+    def is_fresh(self, spec: FigureSpec, key: str) -> bool:
+        fresh = (
+            not self.force
+            and os.path.exists(spec.output)
+            and self.manifest(spec.output).get(os.path.basename(spec.output)) == key
+        )
+        if fresh:
+            self.skipped += 1
+        return fresh
+
+    def record(self, output: str, key: str):
+        self.manifest(output)[os.path.basename(output)] = key
+        self.rendered += 1
+
+    def save(self):
+        for directory, entries in self.manifests.items():
+            with open(os.path.join(directory, CACHE_NAME), "w") as f:
+                json.dump(entries, f, indent=2, sort_keys=True)
+
+    def report(self) -> str:
+        return f"{self.rendered} rendered, {self.skipped} skipped"
+
+
+# Shared arrays by id of the array they copy
+Blocks = dict[int, tuple[shared_memory.SharedMemory, SharedArray]]
+
+
+def share(value, blocks: Blocks):
+    """
+    Copies the large arrays found in value (or in its tuples, lists and
+    dicts) to shared memory, replacing them by their SharedArray. An array
+    used by several figures is copied once.
+    """
+    if isinstance(value, np.ndarray):
+        if value.nbytes < SHARE_THRESHOLD or value.dtype.hasobject:
+            return value
+        if id(value) not in blocks:
+            block = shared_memory.SharedMemory(create=True, size=value.nbytes)
+            np.ndarray(value.shape, value.dtype, buffer=block.buf)[...] = value
+            blocks[id(value)] = (
+                block,
+                SharedArray(block.name, value.shape, value.dtype.str),
+            )
+        return blocks[id(value)][1]
+    if isinstance(value, (tuple, list)):
+        return type(value)(share(item, blocks) for item in value)
+    if isinstance(value, dict):
+        return {key: share(item, blocks) for key, item in value.items()}
+    return value
+
+
+def attach(value, blocks: list[shared_memory.SharedMemory]):
+    """
+    Inverse of share: views of the shared arrays
+    """
+    if isinstance(value, SharedArray):
+        block = shared_memory.SharedMemory(name=value.name)
+        blocks.append(block)
+        return np.ndarray(value.shape, np.dtype(value.dtype), buffer=block.buf)
+    if isinstance(value, (tuple, list)):
+        return type(value)(attach(item, blocks) for item in value)
+    if isinstance(value, dict):
+        return {key: attach(item, blocks) for key, item in value.items()}
+    return value
+
+
+def init_worker(initializer: Callable | None, initargs: tuple):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def render_timed(spec: FigureSpec) -> tuple[str, float]:
+    start = time.perf_counter()
+    spec.recipe(spec.output, *spec.args, **spec.kwargs)
+    return spec.output, time.perf_counter() - start
+
+
+def render_shared(spec: FigureSpec) -> tuple[str, float]:
+    blocks = []
+    try:
+        return render_timed(
+            FigureSpec(
+                spec.recipe,
+                spec.output,
+                attach(spec.args, blocks),
+                attach(spec.kwargs, blocks),
+            )
+        )
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def render(
+    specs: Iterable[FigureSpec],
+    jobs: int = 1,
+    initializer: Callable | None = None,
+    initargs: tuple = (),
+    cache: FigureCache | None = None,
+    timings: dict[str, float] | None = None,
+) -> Iterator[str]:
+    """
+    Renders every figure, yielding their outputs as they are saved. With one
+    job the figures are drawn in this process. With a cache, the figures
+    that are still fresh are skipped. The seconds every figure took to
+    render are stored in timings by output, before it is yielded.
+    """
+    specs = list(specs)
+    keys = {}
+    if cache is not None:
+        context = (initializer, initargs)
+        keys = {spec.output: cache.key(spec, context) for spec in specs}
+        # Array digests are keyed by id, only valid while the specs are alive
+        cache.digests.clear()
+        specs = [spec for spec in specs if not cache.is_fresh(spec, keys[spec.output])]
+
+    try:
+        for output, elapsed in render_specs(specs, jobs, initializer, initargs):
+            if cache is not None:
+                cache.record(output, keys[output])
+            if timings is not None:
+                timings[output] = elapsed
+            yield output
+    finally:
+        if cache is not None:
+            cache.save()
+
+
+def render_specs(
+    specs: list[FigureSpec],
+    jobs: int,
+    initializer: Callable | None,
+    initargs: tuple,
+) -> Iterator[tuple[str, float]]:
+    if jobs <= 1 or len(specs) <= 1:
+        for spec in specs:
+            yield render_timed(spec)
+        return
+
+    blocks = {}
+    try:
+        shared = [
+            FigureSpec(
+                spec.recipe,
+                spec.output,
+                share(spec.args, blocks),
+                share(spec.kwargs, blocks),
+            )
+            for spec in specs
+        ]
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(specs)),
+            initializer=init_worker,
+            initargs=(initializer, initargs),
+        ) as pool:
+            futures = [pool.submit(render_shared, spec) for spec in shared]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        for block, _ in blocks.values():
+            block.close()
+            block.unlink()
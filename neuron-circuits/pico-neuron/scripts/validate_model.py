@@ -0,0 +1,301 @@
+"""
+Validates a Hindmarsh-Rose output of the Pico against a high precision
+reference: the same model is integrated again in float64 with adaptive
+Dormand-Prince from the first row of the csv, on the same time grid. The
+pointwise error, the drift of the spike times and the divergence of the
+interspike interval distributions are computed block by block, so long
+runs do not need the whole reference in memory.
+"""
+
+import os
+import json
+import argparse
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+
+import csv_cache
+from hr_simulator import STATE, HRParams, Integration, integrate, spike_times
+
+# Deviation from a uniform grid of the csv times (in steps), from rounding
+STEP_TOLERANCE = 0.5
+ISI_BINS = 50
+
+
+@dataclass
+class ErrorStats:
+    """
+    Pointwise error of one state variable, accumulated block by block
+    """
+
+    samples: int = 0
+    squares: float = 0.0
+    maximum: float = 0.0
+    # Time at which the error first went over the tolerance
+    divergence: float | None = None
+
+    def update(self, error: np.ndarray, time: np.ndarray, tolerance: float):
+        error = np.abs(error)
+        self.samples += error.size
+        self.squares += float(np.dot(error, error))
+        self.maximum = max(self.maximum, float(error.max(initial=0)))
+        if self.divergence is None:
+            over = np.flatnonzero(error > tolerance)
+            if over.size:
+                self.divergence = float(time[over[0]])
+
+    def report(self) -> dict:
+        return {
+            "rmse": np.sqrt(self.squares / self.samples) if self.samples else np.nan,
+            "max_error": self.maximum,
+            "divergence_time": self.divergence,
+        }
+
+
+@dataclass
+class SpikeTrain:
+    """
+    Spike times of a series given block by block
+    """
+
+    threshold: float
+    previous: np.ndarray = field(default_factory=lambda: np.full(1, np.nan))
+    times: list[np.ndarray] = field(default_factory=list)
+
+    def update(self, x: np.ndarray, start: float, step: float):
+        _, found = spike_times(self.previous, x[:, None], start, step, self.threshold)
+        self.times.append(found)
+        # x may be a view of a block buffer that is reused
+        self.previous = x[-1:].copy()
+
+    def spikes(self) -> np.ndarray:
+        return np.concatenate(self.times) if self.times else np.array([])
+
+
+def spike_drift(device: np.ndarray, reference: np.ndarray) -> dict:
+    """
+    Drift of every device spike from the nearest reference spike. A spike
+    is unmatched when that one is further than half the reference ISI.
+    """
+    if device.size == 0 or reference.size == 0:
+        return {
+            "device_spikes": int(device.size),
+            "reference_spikes": int(reference.size),
+        }
+
+    right = np.minimum(np.searchsorted(reference, device), reference.size - 1)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(
+        np.abs(reference[left] - device) <= np.abs(reference[right] - device),
+        left,
+        right,
+    )
+    drift = device - reference[nearest]
+    half_isi = np.median(np.diff(reference)) / 2 if reference.size > 1 else np.inf
+    matched = np.abs(drift) <= half_isi
+
+    return {
+        "device_spikes": int(device.size),
+        "reference_spikes": int(reference.size),
+        "unmatched_spikes": int((~matched).sum()),
+        "drift_mean": float(drift[matched].mean()) if matched.any() else np.nan,
+        "drift_max": float(np.abs(drift[matched]).max()) if matched.any() else np.nan,
+        "drift_last": float(drift[matched][-1]) if matched.any() else np.nan,
+    }
+
+
+def isi_divergence(device: np.ndarray, reference: np.ndarray) -> dict:
+    """
+    Kolmogorov-Smirnov statistic and Jensen-Shannon divergence (bits)
+    between the interspike interval distributions
+    """
+    device_isi, reference_isi = np.diff(device), np.diff(reference)
+    if device_isi.size == 0 or reference_isi.size == 0:
+        return {"isi_ks": np.nan, "isi_js": np.nan}
+
+    values = np.concatenate([device_isi, reference_isi])
+    device_cdf = np.searchsorted(np.sort(device_isi), values, side="right")
+    reference_cdf = np.searchsorted(np.sort(reference_isi), values, side="right")
+    ks = np.abs(device_cdf / device_isi.size - reference_cdf / reference_isi.size)
+
+    # Log spaced bins, since bursting ISIs span orders of magnitude
+    low, high = values.min(), values.max()
+    edges = np.geomspace(low, high * (1 + 1e-9), ISI_BINS + 1) if low > 0 else ISI_BINS
+    p = np.histogram(device_isi, edges)[0] / device_isi.size
+    q = np.histogram(reference_isi, edges)[0] / reference_isi.size
+    m = (p + q) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        js = 0.5 * np.nansum(np.where(p > 0, p * np.log2(p / m), 0)) + 0.5 * np.nansum(
+            np.where(q > 0, q * np.log2(q / m), 0)
+        )
+
+    return {"isi_ks": float(ks.max()), "isi_js": float(js)}
+
+
+def uniform_step(time: np.ndarray, block_size: int = 1_000_000) -> float | None:
+    """
+    Step of the time column when every sample is within STEP_TOLERANCE
+    steps of a uniform grid (the device may write it in low precision)
+    """
+    if time.size < 2:
+        return None
+    step = (float(time[-1]) - float(time[0])) / (time.size - 1)
+    for start in range(0, time.size, block_size):
+        grid = float(time[0]) + step * np.arange(
+            start, min(start + block_size, time.size)
+        )
+        deviation = np.abs(np.asarray(time[start : start + block_size]) - grid).max()
+        if step <= 0 or deviation > STEP_TOLERANCE * step:
+            return None
+    return step
+
+
+def validate(
+    path: str,
+    separator: str,
+    params: HRParams,
+    time_scale: float,
+    tolerance: float,
+    spike_threshold: float,
+    rtol: float,
+    atol: float,
+) -> dict:
+    columns = csv_cache.load(path, separator)
+    time = columns["time"]
+    variables = [name for name in STATE if name in columns]
+
+    step = uniform_step(time)
+    if step is None:
+        raise ValueError(f"{path} does not have uniform time steps")
+
+    # The reference starts from the first row of the csv
+    initial = asdict(params)
+    for name in variables:
+        initial[f"{name}0"] = float(columns[name][0])
+    model = {name: np.array([value]) for name, value in initial.items()}
+    state = np.array([[model[f"{name}0"][0]] for name in STATE])
+
+    integration = Integration(
+        duration=(time.size - 1) * step * time_scale,
+        output_dt=step * time_scale,
+        method="dopri5",
+        dt=step * time_scale,
+        rtol=rtol,
+        atol=atol,
+    )
+
+    errors = {name: ErrorStats() for name in variables}
+    device_spikes = SpikeTrain(spike_threshold)
+    reference_spikes = SpikeTrain(spike_threshold)
+    start = 0
+    diverged_at = None
+    for block in integrate(model, state, integration):
+        stop = min(start + block.shape[0], time.size)
+        block = block[: stop - start]
+        # A diverged reference is NaN from then on, only the samples before
+        # it are compared
+        finite = np.isfinite(block[:, :, 0]).all(axis=1)
+        if not finite.all():
+            stop = start + int(np.argmin(finite))
+            block = block[: stop - start]
+            diverged_at = float(time[stop])
+        block_time = np.asarray(time[start:stop])
+        for i, name in enumerate(STATE):
+            if name in errors:
+                device = np.asarray(columns[name][start:stop], dtype=np.float64)
+                errors[name].update(device - block[:, i, 0], block_time, tolerance)
+
+        # Spikes in csv time units for both series
+        device_spikes.update(
+            np.asarray(columns["x"][start:stop], dtype=np.float64),
+            float(time[0]) + start * step,
+            step,
+        )
+        reference_spikes.update(block[:, 0, 0], float(time[0]) + start * step, step)
+        start = stop
+        if diverged_at is not None:
+            break
+
+    device, reference = device_spikes.spikes(), reference_spikes.spikes()
+    report = {
+        "file": path,
+        "samples": int(time.size),
+        "step": step,
+        "reference_diverged_at": diverged_at,
+    }
+    for name, stats in errors.items():
+        report |= {f"{name}_{key}": value for key, value in stats.report().items()}
+    return report | spike_drift(device, reference) | isi_divergence(device, reference)
+
+
+def main(
+    directory: str,
+    filenames: list[str],
+    separator: str,
+    params: HRParams,
+    time_scale: float,
+    tolerance: float,
+    spike_threshold: float,
+    rtol: float,
+    atol: float,
+    output: str | None,
+):
+    reports = []
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        print(f"Validating {path}")
+        report = validate(
+            path, separator, params, time_scale, tolerance, spike_threshold, rtol, atol
+        )
+        for key, value in report.items():
+            if key != "file":
+                print(f"  {key}: {value}")
+        reports.append(report)
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"Validation written on {output}")
+
+
+if __name__ == "__main__":
+    params = HRParams()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--directory", type=str, default="data/")
+    parser.add_argument(
+        "-f", "--filename", type=str, nargs="+", required=True, help="csv files"
+    )
+    parser.add_argument("-s", "--separator", type=str, default=" ")
+    for name, value in asdict(params).items():
+        parser.add_argument(f"--{name}", type=float, default=value)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="Model time units per unit of the time column",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Pointwise error reported as the divergence time",
+    )
+    parser.add_argument("--spike-threshold", type=float, default=0.0)
+    parser.add_argument("--rtol", type=float, default=1e-10)
+    parser.add_argument("--atol", type=float, default=1e-12)
+    parser.add_argument("-o", "--out", type=str, help="JSON file for the reports")
+
+    args = parser.parse_args()
+
+    main(
+        args.directory,
+        args.filename,
+        args.separator,
+        HRParams(**{name: getattr(args, name) for name in asdict(params)}),
+        args.time_scale,
+        args.tolerance,
+        args.spike_threshold,
+        args.rtol,
+        args.atol,
+        args.out,
+    )
@@ -0,0 +1,298 @@
+"""
+Script to detect the spikes and bursts of the live and model neurons of the
+converted trials, and the phase lag between their bursts
+"""
+
+import os
+import argparse
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import windowed_reader
+
+NEURONS = ["live_neuron", "model_neuron"]
+CHUNK_SIZE = 1_000_000
+NANO_TO_SECONDS = 1e9
+EVENTS_DIR = "events"
+
+UNKNOWN = -1
+
+
+@dataclass
+class Thresholds:
+    """
+    Hysteresis thresholds, as fractions of the range of each neuron. A spike
+    (or burst) starts when the signal rises over high and ends when it falls
+    under low.
+    """
+
+    spike_high: float = 0.7
+    spike_low: float = 0.4
+    burst_high: float = 0.5
+    burst_low: float = 0.15
+    # Bursts closer than this (s) are joined, so a deep interspike dip does
+    # not split a burst
+    min_gap: float = 0.1
+
+
+def channel_range(path: str, column: str) -> tuple[float, float]:
+    """
+    Minimum and maximum of a column, from the parquet statistics when every
+    row group has them
+    """
+    if not windowed_reader.is_feather(path):
+        metadata = pq.ParquetFile(path).metadata
+        index = metadata.schema.to_arrow_schema().get_field_index(column)
+        statistics = [
+            metadata.row_group(i).column(index).statistics
+            for i in range(metadata.num_row_groups)
+        ]
+        if statistics and all(s is not None and s.has_min_max for s in statistics):
+            return min(s.min for s in statistics), max(s.max for s in statistics)
+
+    minimum, maximum = np.inf, -np.inf
+    for batch in windowed_reader.iter_batches(path, [column], CHUNK_SIZE):
+        result = pc.min_max(batch.column(0))
+        if result["min"].is_valid:
+            minimum = min(minimum, result["min"].as_py())
+            maximum = max(maximum, result["max"].as_py())
+    return minimum, maximum
+
+
+def hysteresis(values: np.ndarray, high: float, low: float, state: int) -> np.ndarray:
+    """
+    State (1 over, 0 under, UNKNOWN) of every sample, holding the last one
+    between the thresholds and across NaN. state is the state before values.
+    """
+    marks = np.full(values.size, UNKNOWN, dtype=np.int8)
+    marks[values >= high] = 1
+    marks[values <= low] = 0
+
+    last = np.where(marks != UNKNOWN, np.arange(values.size), -1)
+    np.maximum.accumulate(last, out=last)
+    return np.where(last >= 0, marks[np.maximum(last, 0)], state).astype(np.int8)
+
+
+def transitions(states: np.ndarray, state: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Indexes of the rises (0 to 1) and falls (1 to 0) of the states
+    """
+    previous = np.concatenate([[state], states[:-1]])
+    known = (previous != UNKNOWN) & (states != UNKNOWN)
+    rises = np.flatnonzero(known & (previous == 0) & (states == 1))
+    falls = np.flatnonzero(known & (previous == 1) & (states == 0))
+    return rises, falls
+
+
+@dataclass
+class NeuronDetector:
+    """
+    Spike and burst detection of one neuron, fed chunk by chunk. The
+    hysteresis states and the open burst are carried between chunks.
+    """
+
+    name: str
+    spike_high: float
+    spike_low: float
+    burst_high: float
+    burst_low: float
+    min_gap: float = 0.0
+    spike_state: int = UNKNOWN
+    burst_state: int = UNKNOWN
+    open_burst: int | None = None
+    spikes: list[np.ndarray] = field(default_factory=list)
+    starts: list[int] = field(default_factory=list)
+    ends: list[int] = field(default_factory=list)
+
+    def update(self, time: np.ndarray, values: np.ndarray):
+        if values.size == 0:
+            return
+
+        states = hysteresis(values, self.spike_high, self.spike_low, self.spike_state)
+        rises, _ = transitions(states, self.spike_state)
+        self.spikes.append(time[rises])
+        self.spike_state = int(states[-1])
+
+        states = hysteresis(values, self.burst_high, self.burst_low, self.burst_state)
+        rises, falls = transitions(states, self.burst_state)
+        self.burst_state = int(states[-1])
+
+        # Rises and falls alternate, so only the first fall can close a burst
+        # opened in a previous chunk
+        if falls.size and (rises.size == 0 or falls[0] < rises[0]):
+            if self.open_burst is not None:
+                self.starts.append(self.open_burst)
+                self.ends.append(int(time[falls[0]]))
+            self.open_burst = None
+            falls = falls[1:]
+
+        self.starts.extend(time[rises[: falls.size]].tolist())
+        self.ends.extend(time[falls].tolist())
+        if rises.size > falls.size:
+            self.open_burst = int(time[rises[-1]])
+
+    def spike_times(self) -> np.ndarray:
+        if not self.spikes:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(self.spikes).astype(np.int64)
+
+    def bursts(self) -> pd.DataFrame:
+        """
+        Complete bursts (the one still open at the end is dropped) with their
+        duration, period and number of spikes
+        """
+        starts = np.asarray(self.starts, dtype=np.int64)
+        ends = np.asarray(self.ends, dtype=np.int64)
+
+        # A silent or disconnected channel has no complete bursts
+        if starts.size:
+            separated = (starts[1:] - ends[:-1]) >= self.min_gap * NANO_TO_SECONDS
+            starts = starts[np.concatenate([[True], separated])]
+            ends = ends[np.concatenate([separated, [True]])]
+        spikes = self.spike_times()
+
+        period = np.full(starts.size, np.nan)
+        period[:-1] = np.diff(starts) / NANO_TO_SECONDS
+        return pd.DataFrame(
+            {
+                "neuron": self.name,
+                "burst": np.arange(starts.size),
+                "start": starts,
+                "end": ends,
+                "duration": (ends - starts) / NANO_TO_SECONDS,
+                "period": period,
+                "spikes": np.searchsorted(spikes, ends, side="right")
+                - np.searchsorted(spikes, starts, side="left"),
+            }
+        )
+
+
+def phase_lags(
+    bursts: pd.DataFrame, other: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lag (s) from every burst to the nearest burst start of the other neuron,
+    and that lag as a fraction of the burst period, in [-0.5, 0.5)
+    """
+    starts = bursts["start"].to_numpy()
+    other_starts = other["start"].to_numpy()
+    if starts.size == 0 or other_starts.size == 0:
+        return np.full(starts.size, np.nan), np.full(starts.size, np.nan)
+
+    right = np.minimum(np.searchsorted(other_starts, starts), other_starts.size - 1)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(
+        np.abs(other_starts[left] - starts) <= np.abs(other_starts[right] - starts),
+        left,
+        right,
+    )
+    lag = (other_starts[nearest] - starts) / NANO_TO_SECONDS
+    phase = (lag / bursts["period"].to_numpy() + 0.5) % 1 - 0.5
+    return lag, phase
+
+
+def detect(
+    path: str, thresholds: Thresholds, chunk_size: int = CHUNK_SIZE
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Bursts of both neurons with the phase lag between them, and every spike
+    """
+    detectors = []
+    for neuron in NEURONS:
+        minimum, maximum = channel_range(path, neuron)
+        amplitude = maximum - minimum
+        detectors.append(
+            NeuronDetector(
+                neuron,
+                minimum + thresholds.spike_high * amplitude,
+                minimum + thresholds.spike_low * amplitude,
+                minimum + thresholds.burst_high * amplitude,
+                minimum + thresholds.burst_low * amplitude,
+                thresholds.min_gap,
+            )
+        )
+
+    columns = ["time"] + NEURONS
+    for batch in windowed_reader.iter_batches(path, columns, chunk_size):
+        time = batch.column(0).to_numpy()
+        for i, detector in enumerate(detectors, start=1):
+            values = batch.column(i).to_numpy(zero_copy_only=False)
+            detector.update(time, values)
+
+    live, model = (detector.bursts() for detector in detectors)
+    live["lag"], live["phase"] = phase_lags(live, model)
+    model["lag"], model["phase"] = phase_lags(model, live)
+    bursts = pd.concat([live, model], ignore_index=True)
+
+    spikes = pd.concat(
+        [
+            pd.DataFrame({"neuron": detector.name, "time": detector.spike_times()})
+            for detector in detectors
+        ],
+        ignore_index=True,
+    )
+    return bursts, spikes
+
+
+def main(directory: str, thresholds: Thresholds, chunk_size: int):
+    events_dir = os.path.join(directory, EVENTS_DIR)
+    os.makedirs(events_dir, exist_ok=True)
+
+    for name, path in windowed_reader.trial_files(directory).items():
+        bursts, spikes = detect(path, thresholds, chunk_size)
+
+        bursts_path = os.path.join(events_dir, f"{name}-bursts.parquet")
+        spikes_path = os.path.join(events_dir, f"{name}-spikes.parquet")
+        bursts.to_parquet(bursts_path, index=False)
+        spikes.to_parquet(spikes_path, index=False)
+
+        print(f"Events of {name} written on {bursts_path} and {spikes_path}")
+        for neuron in NEURONS:
+            neuron_bursts = bursts[bursts["neuron"] == neuron]
+            print(
+                f"  {neuron}: {len(neuron_bursts)} bursts, "
+                f"period {neuron_bursts['period'].mean():.3f} s, "
+                f"duration {neuron_bursts['duration'].mean():.3f} s, "
+                f"phase {neuron_bursts['phase'].mean():.3f}"
+            )
+
+
+if __name__ == "__main__":
+    defaults = Thresholds()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--directory",
+        type=str,
+        required=True,
+        help="Directory with the converted trials (processed-data/...)",
+    )
+    parser.add_argument("--spike-high", type=float, default=defaults.spike_high)
+    parser.add_argument("--spike-low", type=float, default=defaults.spike_low)
+    parser.add_argument("--burst-high", type=float, default=defaults.burst_high)
+    parser.add_argument("--burst-low", type=float, default=defaults.burst_low)
+    parser.add_argument(
+        "--min-gap",
+        type=float,
+        default=defaults.min_gap,
+        help="Bursts separated by less than this (s) are joined",
+    )
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    args = parser.parse_args()
+
+    main(
+        args.directory,
+        Thresholds(
+            args.spike_high,
+            args.spike_low,
+            args.burst_high,
+            args.burst_low,
+            args.min_gap,
+        ),
+        args.chunk_size,
+    )
@@ -2,116 +2,318 @@
 Script to generate a parquet from a h5 file for a synaptic iteration recorded on rtxi
 """
 
-import pandas as pd
 import os
+import time
 import argparse
-import h5py
-from pandas.core.arrays.interval import Union
+import tomllib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from collections.abc import Iterator
 
-def read_field_as_df(group: h5py.File, name: str) -> pd.DataFrame:
-    dataset = group[name]
-    arr = dataset[:]
+import h5py
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-    if arr.dtype.names:
-        # Dataset estructurado: convertir por campos
-        df = pd.DataFrame({name: arr[name] for name in arr.dtype.names})
-    else:
-        # Dataset simple
-        df = pd.DataFrame(arr, columns=["value"])
+import rtxi_reader
+from alignment import align_stream, span, take
+from source_manifest import SourceManifest
+from windowed_reader import FEATHER_SUFFIX, feather_writer
 
-    return df
+MANIFEST_NAME = "_manifest.json"
+CONFIG_NAME = "conversion.toml"
+CHUNK_SIZE = 1_000_000
+ROW_GROUP_SIZE = 65_536
+DEFAULT_PARAMS = {
+    "neuron_1_offset": 0.0,
+    "neuron_2_offset": 0.0,
+    "neuron_1_scale": 1.0,
+    "neuron_2_scale": 1.0,
+}
 
 
-def name_traduction(name: str, last_name: Union[str, None]) -> str:
-    if "PCI" in name or "wave" in name:
-        return "live_neuron"
-    else:
-        if last_name is None:
-            return "model_neuron"
-        elif last_name == "model_neuron":
-            return "model_neuron_2"
+def scaled(values: np.ndarray, scale: float, offset: float) -> pa.Array:
+    values = values.astype(np.float64, copy=False)
+    if scale != 1.0:
+        values *= scale
+    if offset != 0.0:
+        values += offset
+    return pa.array(values)
 
-    return "model_neuron"
 
+def read_hdf_chunks(
+    filename: str,
+    neuron_1_offset: float,
+    neuron_2_offset: float,
+    neuron_1_scale: float,
+    neuron_2_scale: float,
+    reports: list | None = None,
+    chunk_size: int = CHUNK_SIZE,
+    trial: str | None = None,
+) -> Iterator[pa.Table]:
+    """
+    Yields the live and model neuron channels of a trial of the file (the
+    first one by default) as Arrow tables, aligned on their time column and
+    with the scale and offset applied. A sample missing in one channel
+    leaves it empty on that row. The alignment reports are appended to
+    reports.
+    """
+    scales = [neuron_1_scale, neuron_2_scale]
+    offsets = [neuron_1_offset, neuron_2_offset]
+    roles = ["live_neuron", "model_neuron"]
+
+    index = rtxi_reader.index_file(filename)
+    channels = [index.channel(role, trial) for role in roles]
 
-def read_hdf_as_dict(filename: str) -> dict:
     with h5py.File(filename, "r") as f:
-        group = f["Trial1/Synchronous Data"]
-        dfs = {}
-        last_name = None
+        windows, channel_reports = align_stream(
+            [rtxi_reader.time_reader(f, channel) for channel in channels],
+            [channel.length for channel in channels],
+            roles,
+            chunk_size,
+        )
+        if reports is not None:
+            reports.extend(channel_reports)
 
-        for element in group:
-            df = read_field_as_df(group, str(element))
-            name = name_traduction(element, last_name)
-            dfs[name] = df.copy()
-            last_name = name
+        for window in windows:
+            columns = {"time": pa.array(window.time)}
+            for role, channel, indexes, scale, offset in zip(
+                roles, channels, window.indexes, scales, offsets
+            ):
+                start, stop = span(indexes)
+                values = rtxi_reader.read_field(f, channel, "value", start, stop)
+                columns[role] = scaled(take(values, indexes, start), scale, offset)
 
-    return dfs
+            yield pa.table(columns)
 
 
-def main(
-    directory: str,
-    neuron_1_offset: float,
-    neuron_2_offset: float,
-    neuron_1_scale: float,
-    neuron_2_scale: float,
-):
-    files = os.listdir(directory)
+def load_config(path: str) -> dict[str, dict]:
+    """
+    Scale and offset of every circuit directory, as tables of conversion.toml
+    """
+    with open(path, "rb") as f:
+        return tomllib.load(f)
 
-    hdf_files = [f for f in files if f.endswith(".h5")]
 
-    df: pd.DataFrame = pd.DataFrame(
-        {
-            "x": [],
-            "time": [],
-        }
+def find_directories(root: str = ".") -> list[str]:
+    """
+    Circuit directories with at least one h5 file
+    """
+    return sorted(
+        entry.name
+        for entry in os.scandir(root)
+        if entry.is_dir() and any(f.endswith(".h5") for f in os.listdir(entry.path))
     )
+
+
+def directory_params(config: dict) -> dict:
+    params = dict(DEFAULT_PARAMS)
+    unknown = set(config) - set(params)
+    if unknown:
+        raise ValueError(f"Unknown conversion parameters: {sorted(unknown)}")
+    params.update({key: float(value) for key, value in config.items()})
+    return params
+
+
+def trial_outputs(source: str, data_dir: str) -> dict[str, str]:
+    """
+    Parquet file of every trial of a h5 file: <file>.parquet if it has a
+    single trial, <file>-<trial>.parquet for each one otherwise
+    """
+    trials = rtxi_reader.index_file(source).trial_names()
+    stem = os.path.join(data_dir, os.path.splitext(os.path.basename(source))[0])
+    if len(trials) == 1:
+        return {trials[0]: stem + ".parquet"}
+    return {trial: f"{stem}-{trial}.parquet" for trial in trials}
+
+
+def write_trial(tables: Iterator[pa.Table], output: str, feather: bool) -> int:
+    """
+    Writes the tables of a trial (also to a Feather copy next to the parquet
+    file if feather is set), returning the number of samples
+    """
+    # A copy left by an earlier conversion would be read instead of the
+    # new parquet file
+    if not feather and os.path.exists(feather_path(output)):
+        os.remove(feather_path(output))
+
+    samples = 0
+    writers = []
+    for table in tables:
+        if not writers:
+            writers.append(pq.ParquetWriter(output, table.schema))
+            if feather:
+                writers.append(feather_writer(feather_path(output), table.schema))
+        writers[0].write_table(table, row_group_size=ROW_GROUP_SIZE)
+        for writer in writers[1:]:
+            writer.write_table(table)
+        samples += table.num_rows
+    for writer in writers:
+        writer.close()
+    return samples
+
+
+def convert(
+    source: str, outputs: dict[str, str], params: dict, feather: bool = False
+) -> tuple[int, int, float, str]:
+    """
+    Converts every trial of one h5 file to its output, returning the size
+    of the file in bytes, the number of samples, the seconds it took and the
+    alignment report
+    """
+    start = time.perf_counter()
+
+    samples = 0
+    lines = []
+    for trial, output in outputs.items():
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        reports = []
+        tables = read_hdf_chunks(source, **params, reports=reports, trial=trial)
+        samples += write_trial(tables, output, feather)
+        indent = "  "
+        if len(outputs) > 1:
+            lines.append(f"  {trial}:")
+            indent = "    "
+        lines.extend(f"{indent}{channel_report}" for channel_report in reports)
+
+    return (
+        os.path.getsize(source),
+        samples,
+        time.perf_counter() - start,
+        "\n".join(lines),
+    )
+
+
+def throughput(size: int, samples: int, elapsed: float) -> str:
+    elapsed = max(elapsed, 1e-9)
+    return (
+        f"{size / 1e6:.1f} MB, {samples} samples in {elapsed:.2f} s "
+        f"({size / 1e6 / elapsed:.1f} MB/s, {samples / elapsed:.0f} samples/s)"
+    )
+
+
+def feather_path(output: str) -> str:
+    return os.path.splitext(output)[0] + FEATHER_SUFFIX
+
+
+def main(
+    directories: dict[str, dict],
+    force: bool = False,
+    jobs: int = 1,
+    feather: bool = False,
+):
+    """
+    Converts the h5 files of every directory, each one with its own scale and
+    offset, using up to jobs processes
+    """
     data_dir = "processed-data"
 
     if not os.path.exists(data_dir):
         os.mkdir(data_dir)
 
-    for file in hdf_files:
-        hdf_file_dict: dict = read_hdf_as_dict(os.path.join(directory, file))
+    manifests = {}
+    tasks = []
+    for directory, params in directories.items():
+        manifest_params = {**params, "feather": True} if feather else params
+        full_data_dir = os.path.join(data_dir, directory)
+        manifest = SourceManifest(os.path.join(full_data_dir, MANIFEST_NAME), force)
+        manifests[directory] = manifest
 
-        min_len: int = min([len(hdf_file_dict[key]) for key in hdf_file_dict.keys()])
+        hdf_files = sorted(f for f in os.listdir(directory) if f.endswith(".h5"))
+        for file in hdf_files:
+            source = os.path.join(directory, file)
+            outputs = trial_outputs(source, full_data_dir)
+            if manifest.is_fresh(source, list(outputs.values()), manifest_params):
+                print("Data already merged on " + ", ".join(outputs.values()))
+                continue
+            tasks.append((directory, source, outputs, params, manifest_params))
 
-        df: pd.DataFrame = pd.DataFrame(
-            {
-                "time": hdf_file_dict["live_neuron"]["time"][:min_len],
-                "live_neuron": hdf_file_dict["live_neuron"]["value"][:min_len].apply(
-                    lambda x: x * neuron_1_scale + neuron_1_offset
-                ),
-                "model_neuron": hdf_file_dict["model_neuron"]["value"][:min_len].apply(
-                    lambda x: x * neuron_2_scale + neuron_2_offset
-                ),
-            }
+    start = time.perf_counter()
+    total_size = 0
+    total_samples = 0
+
+    def done(task, result):
+        nonlocal total_size, total_samples
+        directory, source, outputs, _, manifest_params = task
+        manifests[directory].record(source, list(outputs.values()), manifest_params)
+        total_size += result[0]
+        total_samples += result[1]
+        print(
+            f"Data merged on {', '.join(outputs.values())}: {throughput(*result[:3])}"
         )
+        print(result[3])
 
-        full_data_dir = os.path.join(data_dir, directory)
-        if not os.path.exists(full_data_dir):
-            os.mkdir(full_data_dir)
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(convert, *task[1:4], feather): task for task in tasks
+            }
+            for future in as_completed(futures):
+                done(futures[future], future.result())
+    else:
+        for task in tasks:
+            done(task, convert(*task[1:4], feather))
 
-        full_data_path = os.path.join(full_data_dir, file.replace(".h5", ".parquet"))
-        df.to_parquet(full_data_path, index=False)
-        print("Data merged on " + full_data_path)
+    for directory, manifest in manifests.items():
+        manifest.save()
+        print(f"Sources of {directory}: {manifest.report()}")
+
+    if tasks:
+        elapsed = time.perf_counter() - start
+        print(f"Total: {throughput(total_size, total_samples, elapsed)}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--directory", type=str, required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-d", "--directory", type=str)
+    source.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        help="Convert every circuit directory, with the parameters of --config",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        default=CONFIG_NAME,
+        help="TOML file with the scale and offset of every directory",
+    )
     parser.add_argument("-n1o", "--neuron-1-offset", type=float, default=0.0)
     parser.add_argument("-n2o", "--neuron-2-offset", type=float, default=0.0)
     parser.add_argument("-n1s", "--neuron-1-scale", type=float, default=1.0)
     parser.add_argument("-n2s", "--neuron-2-scale", type=float, default=1.0)
+    parser.add_argument("-f", "--force", action="store_true")
+    parser.add_argument(
+        "--feather",
+        action="store_true",
+        help="Also write a memory mappable Feather copy of every trial",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of h5 files converted in parallel",
+    )
 
     args = parser.parse_args()
 
-    main(
-        args.directory,
-        args.neuron_1_offset,
-        args.neuron_2_offset,
-        args.neuron_1_scale,
-        args.neuron_2_scale,
-    )
+    if args.all:
+        config = load_config(args.config) if os.path.exists(args.config) else {}
+        directories = {
+            directory: directory_params(config.get(directory, {}))
+            for directory in find_directories(".")
+        }
+    else:
+        directories = {
+            os.path.normpath(args.directory): {
+                "neuron_1_offset": args.neuron_1_offset,
+                "neuron_2_offset": args.neuron_2_offset,
+                "neuron_1_scale": args.neuron_1_scale,
+                "neuron_2_scale": args.neuron_2_scale,
+            }
+        }
+
+    main(directories, args.force, args.jobs, args.feather)
@@ -1,65 +1,113 @@
 import os
 import argparse
-import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 
+import decimation
+import text_recording
+from decimation import plot_line
+from render import FigureCache, FigureSpec, render
 
-def plot_model_data(directory: str, name_model: str, separator: str):
-    if not os.path.exists("graphs/execution_" + name_model + "/"):
-        os.makedirs("graphs/execution_" + name_model + "/")
-
-    print("ploting " + name_model)
+ZOOMED_LEN = 5000
 
-    files = os.listdir(directory)
 
-    files = [file for file in files if not file.endswith(".h5")]
-
-    for file in files:
-        data_frame = pd.read_csv(
-            directory + file, sep=separator, decimal=".", names=["time", "x"]
-        )
-        data_frame = data_frame[["x", "time"]]
+def draw_model(output_file: str, time: np.ndarray, x: np.ndarray, name: str):
+    plt.figure(figsize=(12, 6))
 
-        plt.figure(figsize=(12, 6))
+    plot_line(time, x)
+    # plt.xlim((time.min(), time.max()))
+    # plt.ylim(top=5)
 
-        plt.plot(data_frame["time"], data_frame["x"])
-        # plt.xlim((data_frame["time"].min(), data_frame["time"].max()))
-        # plt.ylim(top=5)
-        #
-        name = file.split(".")[0] + "_complete"
+    plt.xlabel("time (s)")
+    plt.ylabel("voltage (mV)")
+    plt.title(name)
 
-        plt.xlabel("time (s)")
-        plt.ylabel("voltage (mV)")
-        plt.title(name)
+    plt.savefig(output_file)
+    plt.close()
 
-        plt.savefig("graphs/execution_" + name_model + "/" + name + ".png")
-        plt.close()
 
-    for file in files:
-        data_frame = pd.read_csv(
-            directory + file, sep=separator, decimal=".", names=["time", "x"]
-        )
-        data_frame = data_frame[["x", "time"]][data_frame["x"].size - 5000 :]
+def plot_model_data(
+    directory: str,
+    name_model: str,
+    separator: str,
+    jobs: int = 1,
+    force: bool = False,
+    zoomed_only: bool = False,
+):
+    if not os.path.exists("graphs/execution_" + name_model + "/"):
+        os.makedirs("graphs/execution_" + name_model + "/")
 
-        plt.figure(figsize=(12, 6))
+    print("ploting " + name_model)
 
-        plt.plot(data_frame["time"], data_frame["x"])
-        # plt.xlim((data_frame["time"].min(), data_frame["time"].max()))
-        # plt.ylim(top=5)
-        #
-        name = file.split(".")[0] + "_zoomed"
+    files = sorted(os.listdir(directory))
 
-        plt.xlabel("time (s)")
-        plt.ylabel("voltage (mV)")
-        plt.title(name)
+    files = [file for file in files if not file.endswith(".h5")]
 
-        plt.savefig("graphs/execution_" + name_model + "/" + name + ".png")
-        plt.close()
+    # Every recording is parsed once, and both views are taken from it. With
+    # zoomed_only only the last rows are parsed.
+    specs = []
+    for file in files:
+        path = directory + file
+        if zoomed_only:
+            complete = None
+            zoomed = text_recording.read_recording_tail(path, ZOOMED_LEN, separator)
+        else:
+            complete = text_recording.read_recording(path, separator)
+            zoomed = complete[max(0, len(complete) - ZOOMED_LEN) :]
+
+        for data_frame, suffix in ((complete, "_complete"), (zoomed, "_zoomed")):
+            if data_frame is None:
+                continue
+            name = file.split(".")[0] + suffix
+            specs.append(
+                FigureSpec(
+                    draw_model,
+                    "graphs/execution_" + name_model + "/" + name + ".png",
+                    (data_frame["time"].to_numpy(), data_frame["x"].to_numpy(), name),
+                )
+            )
+
+    cache = FigureCache(force)
+    for output_file in render(
+        specs,
+        jobs,
+        initializer=decimation.set_enabled,
+        initargs=(decimation.enabled,),
+        cache=cache,
+    ):
+        print(f"Saved plot to {output_file}")
+    print(f"Figures: {cache.report()}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--directory", type=str, required=True)
     parser.add_argument("-s", "--separator", type=str, default=" ")
+    parser.add_argument("--no-decimate", action="store_true")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of figures rendered in parallel",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render the figures even when their data did not change",
+    )
+    parser.add_argument(
+        "--zoomed-only",
+        action="store_true",
+        help=f"Only plot the last {ZOOMED_LEN} rows, reading them from the end",
+    )
     args = parser.parse_args()
-    plot_model_data(args.directory, args.directory.replace("/", ""), args.separator)
+    decimation.set_enabled(not args.no_decimate)
+    plot_model_data(
+        args.directory,
+        args.directory.replace("/", ""),
+        args.separator,
+        args.jobs,
+        args.force,
+        args.zoomed_only,
+    )
@@ -4,72 +4,173 @@ This script plots the end of the synaptic interaction of a parquet file
 
 import os
 import argparse
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+import decimation
+import windowed_reader
+from decimation import plot_line
+from render import FigureCache, FigureSpec, render
 
-def process_and_plot_parquets(directory: str, start: bool = False):
+MAX_LEN = 30000
+REQUIRED_COLUMNS = ["time", "live_neuron", "model_neuron"]
+
+# ("tail", rows), ("head", rows) or ("range", from, to)
+Window = tuple
+
+
+def read_window(file_path: str, window: Window) -> pd.DataFrame:
+    """
+    Reads only the rows of the window, not the whole file
+    """
+    kind = window[0]
+    if kind == "head":
+        table = windowed_reader.read_head(file_path, window[1], REQUIRED_COLUMNS)
+    elif kind == "tail":
+        table = windowed_reader.read_tail(file_path, window[1], REQUIRED_COLUMNS)
+    else:
+        table = windowed_reader.read_time_range(
+            file_path, window[1], window[2], REQUIRED_COLUMNS
+        )
+    return table.to_pandas()
+
+
+def window_suffix(window: Window) -> str:
+    if window[0] == "head":
+        return "-initial"
+    if window[0] == "range":
+        return f"-{window[1]:.0f}-{window[2]:.0f}"
+    return ""
+
+
+def draw_trial(
+    output_file: str,
+    time: np.ndarray,
+    live_neuron: np.ndarray,
+    model_neuron: np.ndarray,
+    name: str,
+):
+    plt.figure(figsize=(14, 6))
+    plot_line(time, live_neuron, label="Live Neuron")
+    plot_line(time, model_neuron, label="Model Neuron")
+    plt.xlabel("Time Iteration")
+    plt.ylabel("Neuron Value (V)")
+    plt.title(f"Neuron Activity: {name}")
+    plt.legend()
+    plt.margins(0)
+    plt.tight_layout()
+    plt.savefig(output_file)
+    plt.close()
+
+
+def trial_figures(
+    directory: str, window: Window = ("tail", MAX_LEN)
+) -> list[FigureSpec]:
+    """
+    Figures of the window of every trial of the directory
+    """
     name_dir = directory.split("/")[1]
     graph_dir = os.path.join("graphs", os.path.basename(os.path.normpath(name_dir)))
     os.makedirs(graph_dir, exist_ok=True)
-    max_len = 30000
-
-    for file_name in os.listdir(directory):
-        if file_name.endswith(".parquet"):
-            file_path = os.path.join(directory, file_name)
-            try:
-                df = pd.read_parquet(file_path)
-
-                # Check required columns
-                if not all(
-                    col in df.columns for col in ["time", "live_neuron", "model_neuron"]
-                ):
-                    print(f"Skipping {file_name}: missing required columns")
-                    continue
-
-                if not start:
-                    df = df.iloc[len(df) - max_len : len(df)]
-                else:
-                    df = df.iloc[:max_len]
-
-                plt.figure(figsize=(14, 6))
-                plt.plot(df["time"], df["live_neuron"], label="Live Neuron")
-                plt.plot(df["time"], df["model_neuron"], label="Model Neuron")
-                plt.xlabel("Time Iteration")
-                plt.ylabel("Neuron Value (V)")
-                plt.title(f"Neuron Activity: {file_name.split('.')[0]}")
-                plt.legend()
-                plt.margins(0)
-                plt.tight_layout()
-
-                if not start:
-                    output_file = os.path.join(
-                        graph_dir, f"{name_dir}-{os.path.splitext(file_name)[0]}.png"
-                    )
-                else:
-                    output_file = os.path.join(
-                        graph_dir,
-                        f"{name_dir}-{os.path.splitext(file_name)[0]}-initial.png",
-                    )
-
-                plt.savefig(output_file)
-                plt.close()
-                print(f"Saved plot for {file_name} to {output_file}")
-            except Exception as e:
-                print(f"Error processing {file_name}: {e}")
-
-
-def main(directory: str, start: bool):
-    process_and_plot_parquets(directory)
-    if start:
-        process_and_plot_parquets(directory, start)
+
+    specs = []
+    for name, file_path in windowed_reader.trial_files(directory).items():
+        file_name = os.path.basename(file_path)
+        try:
+            # Check required columns
+            columns = windowed_reader.column_names(file_path)
+            if not all(col in columns for col in REQUIRED_COLUMNS):
+                print(f"Skipping {file_name}: missing required columns")
+                continue
+
+            df = read_window(file_path, window)
+        except Exception as e:
+            print(f"Error processing {file_name}: {e}")
+            continue
+
+        output_file = os.path.join(
+            graph_dir, f"{name_dir}-{name}{window_suffix(window)}.png"
+        )
+        specs.append(
+            FigureSpec(
+                draw_trial,
+                output_file,
+                tuple(df[column].to_numpy() for column in REQUIRED_COLUMNS) + (name,),
+            )
+        )
+    return specs
+
+
+def main(
+    directory: str,
+    start: bool,
+    head: int | None = None,
+    tail: int | None = None,
+    time_from: float | None = None,
+    time_to: float | None = None,
+    jobs: int = 1,
+    force: bool = False,
+):
+    specs = []
+    if time_from is not None or time_to is not None:
+        time_from = -float("inf") if time_from is None else time_from
+        time_to = float("inf") if time_to is None else time_to
+        specs += trial_figures(directory, ("range", time_from, time_to))
+    else:
+        if head is None or tail is not None:
+            specs += trial_figures(directory, ("tail", tail or MAX_LEN))
+        if head is not None or start:
+            specs += trial_figures(directory, ("head", head or MAX_LEN))
+
+    cache = FigureCache(force)
+    for output_file in render(
+        specs,
+        jobs,
+        initializer=decimation.set_enabled,
+        initargs=(decimation.enabled,),
+        cache=cache,
+    ):
+        print(f"Saved plot to {output_file}")
+    print(f"Figures: {cache.report()}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--directory", type=str, required=True)
     parser.add_argument("-s", "--start", action="store_true")
+    parser.add_argument("--head", type=int, help="Plot the first rows")
+    parser.add_argument("--tail", type=int, help="Plot the last rows")
+    parser.add_argument(
+        "--from", dest="time_from", type=float, help="Start of the time range"
+    )
+    parser.add_argument(
+        "--to", dest="time_to", type=float, help="End of the time range"
+    )
+    parser.add_argument("--no-decimate", action="store_true")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of figures rendered in parallel",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render the figures even when their data did not change",
+    )
 
     args = parser.parse_args()
+    decimation.set_enabled(not args.no_decimate)
 
-    main(args.directory, args.start)
+    main(
+        args.directory,
+        args.start,
+        args.head,
+        args.tail,
+        args.time_from,
+        args.time_to,
+        args.jobs,
+        args.force,
+    )
@@ -0,0 +1,155 @@
+"""
+Index of the channels recorded in RTXI h5 files. Every file is walked once
+per process (only its metadata) and the role, dtype and length of every
+channel of every trial are kept in a registry, so the scripts open only the
+datasets they need.
+"""
+
+import os
+import re
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import h5py
+import numpy as np
+
+DATA_GROUP = "Synchronous Data"
+TRIAL_PATTERN = re.compile(r"^Trial(\d+)$")
+
+RT_BENCHMARKS_PATTERN = re.compile(r"RT Benchmarks OUTPUT (\d+) Recording Component")
+RT_BENCHMARKS_OUTPUTS = {0: "duration", 1: "time_step", 2: "latency", 6: "jitter"}
+LIVE_NEURON_MARKERS = ("PCI", "wave")
+
+
+@dataclass(frozen=True)
+class Channel:
+    trial: str
+    name: str
+    role: str | None
+    dtype: str
+    fields: tuple[str, ...]
+    length: int
+
+    @property
+    def path(self) -> str:
+        return f"{self.trial}/{DATA_GROUP}/{self.name}"
+
+
+@dataclass
+class RtxiIndex:
+    filename: str
+    trials: dict[str, dict[str, Channel]] = field(default_factory=dict)
+
+    def trial_names(self) -> list[str]:
+        return list(self.trials)
+
+    def channels(self, trial: str | None = None) -> dict[str, Channel]:
+        """
+        Channels of a trial (the first one by default) by role
+        """
+        if not self.trials:
+            raise KeyError(f"No trials in {self.filename}")
+        return self.trials[trial or next(iter(self.trials))]
+
+    def channel(self, role: str, trial: str | None = None) -> Channel:
+        channels = self.channels(trial)
+        if role not in channels:
+            raise KeyError(f"No {role} channel in {self.filename} ({list(channels)})")
+        return channels[role]
+
+
+def channel_roles(names: list[str]) -> dict[str, str | None]:
+    """
+    Role of every channel of a trial, from its name:
+    - RT Benchmarks outputs: duration, time_step, latency and jitter
+    - DAQ channels ("PCI" or "wave"): live_neuron
+    - Any other channel: model_neuron, model_neuron_2... in order
+    """
+    roles = {}
+    models = 0
+
+    for name in names:
+        match = RT_BENCHMARKS_PATTERN.search(name)
+        if match:
+            roles[name] = RT_BENCHMARKS_OUTPUTS.get(int(match.group(1)))
+        elif any(marker in name for marker in LIVE_NEURON_MARKERS):
+            roles[name] = "live_neuron"
+        else:
+            models += 1
+            roles[name] = "model_neuron" if models == 1 else f"model_neuron_{models}"
+
+    return roles
+
+
+def build_index(filename: str) -> RtxiIndex:
+    index = RtxiIndex(filename)
+
+    with h5py.File(filename, "r") as f:
+        trials = sorted(
+            (int(match.group(1)), name)
+            for name in f
+            if (match := TRIAL_PATTERN.match(name)) and DATA_GROUP in f[name]
+        )
+
+        for _, trial in trials:
+            group = f[trial][DATA_GROUP]
+            names = list(group)
+            channels = {}
+            for name, role in channel_roles(names).items():
+                dataset = group[name]
+                channel = Channel(
+                    trial=trial,
+                    name=name,
+                    role=role,
+                    dtype=str(dataset.dtype),
+                    fields=tuple(dataset.dtype.names or ()),
+                    length=dataset.shape[0],
+                )
+                channels[role or name] = channel
+            index.trials[trial] = channels
+
+    return index
+
+
+_registry: dict[tuple[str, int, int], RtxiIndex] = {}
+
+
+def index_file(filename: str) -> RtxiIndex:
+    """
+    Index of a file, walked again only if its size or mtime changed
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    if key not in _registry:
+        _registry[key] = build_index(filename)
+    return _registry[key]
+
+
+def read_field(
+    f: h5py.File,
+    channel: Channel,
+    field: str,
+    start: int = 0,
+    stop: int | None = None,
+) -> np.ndarray:
+    """
+    Reads only one field of a slice of a channel
+    """
+    dataset = f[channel.path]
+    stop = channel.length if stop is None else stop
+
+    if channel.fields:
+        # Dataset estructurado: leer solo el campo pedido
+        return dataset.fields(field)[start:stop]
+
+    # Dataset simple: solo tiene valores, nunca se devuelven como tiempos
+    if field != "value":
+        raise KeyError(f"{channel.path} has no {field} field, only values")
+    return dataset[start:stop]
+
+
+def time_reader(f: h5py.File, channel: Channel) -> Callable[[int, int], np.ndarray]:
+    """
+    Reader of slices of the time field of a channel, as alignment expects
+    """
+    return lambda start, stop: read_field(f, channel, "time", start, stop)
@@ -0,0 +1,94 @@
+"""
+Manifest of the source files already converted, used to skip the ones that
+did not change since the last run
+"""
+
+import os
+import json
+import hashlib
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SourceManifest:
+    """
+    Maps every source file to the output (or list of outputs) generated
+    from it, together with the size, mtime and sha256 of the source and the
+    conversion parameters. A source is fresh when its outputs exist and the
+    parameters match, and either its size and mtime are unchanged or its
+    content hash is.
+    """
+
+    def __init__(self, path: str, force: bool = False):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+        if not force and os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def is_fresh(
+        self, source: str, output: str | list[str], params: dict | None = None
+    ) -> bool:
+        entry = self.entries.get(source)
+        outputs = [output] if isinstance(output, str) else output
+        fresh = (
+            entry is not None
+            and entry["output"] == output
+            and entry.get("params") == params
+            and all(os.path.exists(path) for path in outputs)
+            and self._same_content(source, entry)
+        )
+
+        if fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return fresh
+
+    def _same_content(self, source: str, entry: dict) -> bool:
+        stat = os.stat(source)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+
+        if file_hash(source) != entry["sha256"]:
+            return False
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def record(self, source: str, output: str | list[str], params: dict | None = None):
+        stat = os.stat(source)
+        self.entries[source] = {
+            "output": output,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_hash(source),
+            "params": params,
+        }
+
+    def prune(self, sources: list[str]) -> list[str | list[str]]:
+        """
+        Forgets the sources that no longer exist, returning their outputs
+        """
+        removed = [source for source in self.entries if source not in sources]
+        return [self.entries.pop(source)["output"] for source in removed]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+
+    def report(self) -> str:
+        return f"{self.hits} cached, {self.misses} converted"
@@ -0,0 +1,302 @@
+"""
+Script to measure how synchronized the live and model neurons of the
+converted trials are, over sliding windows: FFT cross-correlation, phase
+locking value of the Hilbert phases and histograms of lags and phase
+differences
+"""
+
+import os
+import argparse
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import windowed_reader
+
+NEURONS = ["live_neuron", "model_neuron"]
+CHUNK_SIZE = 1_000_000
+NANO_TO_SECONDS = 1e9
+SYNC_DIR = "sync"
+PHASE_BINS = 36
+LAG_BINS = 40
+
+
+@dataclass
+class WindowParams:
+    window: float = 10.0  # s
+    step: float = 5.0  # s
+    max_lag: float = 2.0  # s
+    # Band of the slow (burst) oscillation used for the Hilbert phase (Hz)
+    low_cut: float = 0.05
+    high_cut: float = 5.0
+
+
+def sample_period(path: str) -> float:
+    """
+    Median sampling period of a trial (s), from its first rows
+    """
+    time = windowed_reader.read_head(path, 10_000, ["time"])["time"].to_numpy()
+    return float(np.median(np.diff(time))) / NANO_TO_SECONDS
+
+
+def fill_missing(values: np.ndarray) -> tuple[np.ndarray, float]:
+    """
+    Replaces the missing samples by the mean of the window, returning the
+    fraction that was missing
+    """
+    missing = np.isnan(values)
+    fraction = float(missing.mean())
+    if fraction == 0 or fraction == 1:
+        return values, fraction
+    values = values.copy()
+    values[missing] = values[~missing].mean()
+    return values, fraction
+
+
+def analytic_signal(values: np.ndarray, period: float, params: WindowParams):
+    """
+    Analytic signal of values restricted to the band [low_cut, high_cut]
+    """
+    spectrum = np.fft.fft(values)
+    frequencies = np.fft.fftfreq(values.size, period)
+    band = (np.abs(frequencies) >= params.low_cut) & (
+        np.abs(frequencies) <= params.high_cut
+    )
+    spectrum[~band] = 0
+    # Hilbert transform: drop the negative frequencies, double the positive
+    spectrum[frequencies < 0] = 0
+    spectrum[frequencies > 0] *= 2
+    return np.fft.ifft(spectrum)
+
+
+def downsample(values: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Mean of every factor samples (the last incomplete block is dropped)
+    """
+    if factor == 1:
+        return values
+    blocks = values.size // factor
+    return values[: blocks * factor].reshape(blocks, factor).mean(axis=1)
+
+
+def window_metrics(
+    start: int, live: np.ndarray, model: np.ndarray, period: float, params: WindowParams
+) -> dict:
+    live, live_missing = fill_missing(live)
+    model, model_missing = fill_missing(model)
+    size = live.size
+
+    row = {
+        "start": start,
+        "end": start + int(size * period * NANO_TO_SECONDS),
+        "missing": max(live_missing, model_missing),
+    }
+    live_std, model_std = live.std(), model.std()
+    if not (live_std > 0 and model_std > 0):
+        return row | {
+            "corr_zero": np.nan,
+            "corr_peak": np.nan,
+            "lag_peak": np.nan,
+            "plv": np.nan,
+            "phase_diff": np.nan,
+            "phase_hist": np.zeros(PHASE_BINS, dtype=np.int64),
+        }
+
+    # Normalized cross-correlation through the FFT, zero padded so it is not
+    # circular, limited to +-max_lag
+    a = (live - live.mean()) / live_std
+    b = (model - model.mean()) / model_std
+    n = 1 << int(np.ceil(np.log2(2 * size - 1)))
+    correlation = np.fft.irfft(np.fft.rfft(b, n) * np.conj(np.fft.rfft(a, n)), n)
+    max_lag = min(size - 1, int(params.max_lag / period))
+    lags = np.arange(-max_lag, max_lag + 1)
+    correlation = correlation[lags] / size
+
+    peak = int(np.argmax(correlation))
+    row["corr_zero"] = float(correlation[max_lag])
+    row["corr_peak"] = float(correlation[peak])
+    row["lag_peak"] = float(lags[peak] * period)
+
+    # The phases only need the slow band, so they are computed on the window
+    # averaged down to ~20 samples per period of high_cut
+    factor = max(1, int(1 / (20 * params.high_cut * period)))
+    slow_live, slow_model = downsample(live, factor), downsample(model, factor)
+    phase_diff = np.angle(
+        analytic_signal(slow_live, period * factor, params)
+    ) - np.angle(analytic_signal(slow_model, period * factor, params))
+    mean_vector = np.exp(1j * phase_diff).mean()
+    row["plv"] = float(np.abs(mean_vector))
+    row["phase_diff"] = float(np.angle(mean_vector))
+    wrapped = np.angle(np.exp(1j * phase_diff))
+    row["phase_hist"] = np.histogram(wrapped, PHASE_BINS, (-np.pi, np.pi))[0]
+    return row
+
+
+def sliding_windows(
+    path: str, size: int, step: int
+) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Windows of size samples every step samples, keeping in memory only the
+    current chunk and the part of the previous one still needed
+    """
+    time = np.array([], dtype=np.int64)
+    live = np.array([], dtype=np.float64)
+    model = np.array([], dtype=np.float64)
+    # With step > size the next window can start past the end of the chunk,
+    # those samples are skipped at the start of the next ones
+    skip = 0
+
+    columns = ["time"] + NEURONS
+    for batch in windowed_reader.iter_batches(path, columns, CHUNK_SIZE):
+        time = np.concatenate([time, batch.column(0).to_numpy()])
+        live = np.concatenate([live, batch.column(1).to_numpy(zero_copy_only=False)])
+        model = np.concatenate([model, batch.column(2).to_numpy(zero_copy_only=False)])
+        skipped = min(skip, time.size)
+        time, live, model = time[skipped:], live[skipped:], model[skipped:]
+        skip -= skipped
+
+        first = 0
+        while first + size <= time.size:
+            end = first + size
+            yield int(time[first]), live[first:end], model[first:end]
+            first += step
+        kept = min(first, time.size)
+        skip += first - kept
+        time, live, model = time[kept:], live[kept:], model[kept:]
+
+
+def trial_metrics(
+    path: str, params: WindowParams, pool: ProcessPoolExecutor | None, jobs: int = 1
+) -> pd.DataFrame:
+    period = sample_period(path)
+    size = max(2, int(round(params.window / period)))
+    step = max(1, int(round(params.step / period)))
+
+    rows = []
+    windows = sliding_windows(path, size, step)
+    if pool is None:
+        for start, live, model in windows:
+            rows.append(window_metrics(start, live, model, period, params))
+    else:
+        # At most two windows per worker waiting, so memory stays bounded
+        pending = deque()
+        for start, live, model in windows:
+            pending.append(
+                pool.submit(window_metrics, start, live, model, period, params)
+            )
+            if len(pending) >= 2 * jobs:
+                rows.append(pending.popleft().result())
+        rows.extend(future.result() for future in pending)
+
+    return pd.DataFrame(rows)
+
+
+def histograms(windows: pd.DataFrame, params: WindowParams) -> pd.DataFrame:
+    phase_edges = np.linspace(-np.pi, np.pi, PHASE_BINS + 1)
+    phase_counts = (
+        np.sum(np.stack(windows["phase_hist"]), axis=0)
+        if len(windows)
+        else np.zeros(PHASE_BINS, dtype=np.int64)
+    )
+    lag_edges = np.linspace(-params.max_lag, params.max_lag, LAG_BINS + 1)
+    lag_counts, _ = np.histogram(windows["lag_peak"].dropna(), lag_edges)
+
+    return pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "kind": kind,
+                    "bin_start": edges[:-1],
+                    "bin_end": edges[1:],
+                    "count": counts,
+                }
+            )
+            for kind, edges, counts in (
+                ("phase_diff", phase_edges, phase_counts),
+                ("lag_peak", lag_edges, lag_counts),
+            )
+        ],
+        ignore_index=True,
+    )
+
+
+def summary(name: str, windows: pd.DataFrame) -> dict:
+    valid = windows.dropna(subset=["plv"])
+    mean_vector = (valid["plv"] * np.exp(1j * valid["phase_diff"])).mean()
+    return {
+        "trial": name,
+        "windows": len(windows),
+        "plv_mean": valid["plv"].mean(),
+        "plv_min": valid["plv"].min(),
+        "phase_diff_mean": float(np.angle(mean_vector)) if len(valid) else np.nan,
+        "corr_zero_mean": valid["corr_zero"].mean(),
+        "corr_peak_mean": valid["corr_peak"].mean(),
+        "lag_peak_median": valid["lag_peak"].median(),
+        "lag_peak_iqr": valid["lag_peak"].quantile(0.75)
+        - valid["lag_peak"].quantile(0.25),
+        "missing_mean": windows["missing"].mean(),
+    }
+
+
+def main(directory: str, params: WindowParams, jobs: int):
+    sync_dir = os.path.join(directory, SYNC_DIR)
+    os.makedirs(sync_dir, exist_ok=True)
+
+    pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    summaries = []
+    try:
+        for name, path in windowed_reader.trial_files(directory).items():
+            windows = trial_metrics(path, params, pool, jobs)
+            if windows.empty:
+                print(f"Skipping {name}: shorter than a window")
+                continue
+
+            windows_path = os.path.join(sync_dir, f"{name}-windows.parquet")
+            histograms_path = os.path.join(sync_dir, f"{name}-histograms.parquet")
+            windows.drop(columns="phase_hist").to_parquet(windows_path, index=False)
+            histograms(windows, params).to_parquet(histograms_path, index=False)
+            summaries.append(summary(name, windows))
+            print(f"Synchronization of {name} written on {windows_path}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    summary_path = os.path.join(sync_dir, "summary.csv")
+    pd.DataFrame(summaries).to_csv(summary_path, index=False)
+    print(f"Summary written on {summary_path}")
+
+
+if __name__ == "__main__":
+    defaults = WindowParams()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--directory",
+        type=str,
+        required=True,
+        help="Directory with the converted trials (processed-data/...)",
+    )
+    parser.add_argument("-w", "--window", type=float, default=defaults.window)
+    parser.add_argument("-s", "--step", type=float, default=defaults.step)
+    parser.add_argument("--max-lag", type=float, default=defaults.max_lag)
+    parser.add_argument("--low-cut", type=float, default=defaults.low_cut)
+    parser.add_argument("--high-cut", type=float, default=defaults.high_cut)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of windows processed in parallel",
+    )
+
+    args = parser.parse_args()
+
+    main(
+        args.directory,
+        WindowParams(args.window, args.step, args.max_lag, args.low_cut, args.high_cut),
+        args.jobs,
+    )
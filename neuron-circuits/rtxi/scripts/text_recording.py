@@ -0,0 +1,115 @@
+"""
+Reads two column (time, value) text recordings, such as the model outputs
+and the .asc exports of the recorded cells, with the pyarrow CSV reader and
+explicit float64 types. The last rows of a recording can be read seeking
+from the end of the file, without parsing the rest.
+"""
+
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+COLUMNS = ["time", "x"]
+TAIL_BLOCK_SIZE = 1 << 16
+# Lines looked at for a header before the first numeric one
+HEADER_LINES = 64
+
+
+def is_numeric_line(line: bytes, separator: str) -> bool:
+    fields = line.split() if separator.isspace() else line.split(separator.encode())
+    if len(fields) < len(COLUMNS):
+        return False
+    try:
+        for field in fields[: len(COLUMNS)]:
+            float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def header_rows(path: str, separator: str) -> int:
+    """
+    Number of lines before the first data line (titles, units, comments)
+    """
+    with open(path, "rb") as f:
+        for i, line in enumerate(f):
+            if i >= HEADER_LINES or is_numeric_line(line, separator):
+                return i
+    return 0
+
+
+def parse(source, separator: str, skip_rows: int = 0) -> pd.DataFrame:
+    """
+    Parses the (time, x) columns of source, a path or a binary file. Rows
+    padded with several spaces or tabs are parsed as whitespace separated.
+    """
+    try:
+        table = pa_csv.read_csv(
+            source,
+            read_options=pa_csv.ReadOptions(column_names=COLUMNS, skip_rows=skip_rows),
+            parse_options=pa_csv.ParseOptions(delimiter=separator),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={column: pa.float64() for column in COLUMNS}
+            ),
+        )
+        return table.to_pandas()
+    except pa.ArrowInvalid:
+        if not separator.isspace():
+            raise
+
+    if not isinstance(source, str):
+        source.seek(0)
+    return pd.read_csv(
+        source,
+        sep=r"\s+",
+        names=COLUMNS,
+        usecols=[0, 1],
+        skiprows=skip_rows,
+        dtype={column: np.float64 for column in COLUMNS},
+    )
+
+
+def read_recording(path: str, separator: str = " ") -> pd.DataFrame:
+    """
+    Whole recording as float64 time and x columns
+    """
+    return parse(path, separator, header_rows(path, separator))
+
+
+def tail_lines(path: str, rows: int) -> list[bytes]:
+    """
+    Last rows lines of the file, reading blocks backwards from its end until
+    they contain enough line breaks
+    """
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        blocks = []
+        breaks = 0
+        # One more break than rows, for the line cut at the block start (and
+        # one for the break that ends the file)
+        while position > 0 and breaks <= rows + 1:
+            read_size = min(TAIL_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            blocks.append(f.read(read_size))
+            breaks += blocks[-1].count(b"\n")
+
+    data = b"".join(reversed(blocks))
+    return data.rstrip(b"\r\n").split(b"\n")[-rows:]
+
+
+def read_recording_tail(path: str, rows: int, separator: str = " ") -> pd.DataFrame:
+    """
+    Last rows of a recording, parsing only them. When the recording is
+    shorter, its header lines are dropped.
+    """
+    lines = tail_lines(path, rows) if rows > 0 else []
+    while lines and not is_numeric_line(lines[0], separator):
+        lines.pop(0)
+    if not lines:
+        return pd.DataFrame({column: np.array([], np.float64) for column in COLUMNS})
+    return parse(io.BytesIO(b"\n".join(lines) + b"\n"), separator)
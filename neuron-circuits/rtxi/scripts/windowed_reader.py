@@ -0,0 +1,184 @@
+"""
+Reads windows of a converted trial (the first or last rows, or a time
+range) without loading the whole file. Parquet files are read only in the
+row groups that overlap the window, using their row counts and time
+statistics. Arrow IPC (Feather V2) files are memory mapped and sliced, so
+only the pages of the window are touched.
+"""
+
+import os
+from collections.abc import Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+PARQUET_SUFFIX = ".parquet"
+FEATHER_SUFFIX = ".arrow"
+TIME_COLUMN = "time"
+
+
+def trial_files(directory: str) -> dict[str, str]:
+    """
+    Converted trials of a directory by name, preferring the Feather copy
+    when there is one not older than the parquet file
+    """
+    files = {}
+    for file_name in sorted(os.listdir(directory)):
+        name, suffix = os.path.splitext(file_name)
+        if suffix in (PARQUET_SUFFIX, FEATHER_SUFFIX):
+            files.setdefault(name, {})[suffix] = os.path.join(directory, file_name)
+
+    trials = {}
+    for name, paths in files.items():
+        parquet, copy = paths.get(PARQUET_SUFFIX), paths.get(FEATHER_SUFFIX)
+        if copy and parquet and os.path.getmtime(copy) < os.path.getmtime(parquet):
+            copy = None
+        trials[name] = copy or parquet
+    return trials
+
+
+def is_feather(path: str) -> bool:
+    return path.endswith(FEATHER_SUFFIX)
+
+
+def open_feather(path: str) -> pa.Table:
+    """
+    Zero copy view of an uncompressed Feather file
+    """
+    return feather.read_table(path, memory_map=True)
+
+
+def column_names(path: str) -> list[str]:
+    if is_feather(path):
+        return open_feather(path).column_names
+    return pq.read_schema(path).names
+
+
+def num_rows(path: str) -> int:
+    if is_feather(path):
+        return open_feather(path).num_rows
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def read_rows(
+    path: str, start: int, stop: int, columns: list[str] | None = None
+) -> pa.Table:
+    """
+    Rows [start, stop) of a trial
+    """
+    if is_feather(path):
+        table = open_feather(path)
+        if columns is not None:
+            table = table.select(columns)
+        return table.slice(start, max(0, stop - start))
+
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    row_groups = []
+    first_row = None
+    offset = 0
+    for i in range(metadata.num_row_groups):
+        rows = metadata.row_group(i).num_rows
+        if offset < stop and offset + rows > start:
+            row_groups.append(i)
+            first_row = offset if first_row is None else first_row
+        offset += rows
+
+    if not row_groups:
+        return parquet_file.schema_arrow.empty_table().select(
+            columns or parquet_file.schema_arrow.names
+        )
+
+    table = parquet_file.read_row_groups(row_groups, columns=columns)
+    return table.slice(start - first_row, stop - start)
+
+
+def read_head(path: str, rows: int, columns: list[str] | None = None) -> pa.Table:
+    return read_rows(path, 0, rows, columns)
+
+
+def read_tail(path: str, rows: int, columns: list[str] | None = None) -> pa.Table:
+    total = num_rows(path)
+    return read_rows(path, max(0, total - rows), total, columns)
+
+
+def time_row_groups(parquet_file: pq.ParquetFile, t0: float, t1: float) -> list[int]:
+    """
+    Row groups whose time statistics overlap [t0, t1). Row groups without
+    statistics are always read.
+    """
+    metadata = parquet_file.metadata
+    time_index = parquet_file.schema_arrow.get_field_index(TIME_COLUMN)
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        statistics = metadata.row_group(i).column(time_index).statistics
+        if statistics is None or not statistics.has_min_max:
+            row_groups.append(i)
+        elif statistics.max >= t0 and statistics.min < t1:
+            row_groups.append(i)
+    return row_groups
+
+
+def sorted_position(values: pa.ChunkedArray, value: float) -> int:
+    """
+    First position with values >= value, looking only at the chunks up to it
+    """
+    offset = 0
+    for chunk in values.chunks:
+        chunk_values = chunk.to_numpy(zero_copy_only=False)
+        if chunk_values.size and chunk_values[-1] >= value:
+            return offset + int(np.searchsorted(chunk_values, value, side="left"))
+        offset += len(chunk)
+    return offset
+
+
+def read_time_range(
+    path: str, t0: float, t1: float, columns: list[str] | None = None
+) -> pa.Table:
+    """
+    Rows with t0 <= time < t1 of a trial ordered by time
+    """
+    wanted = None if columns is None else list(dict.fromkeys([TIME_COLUMN] + columns))
+
+    if is_feather(path):
+        table = open_feather(path)
+        if wanted is not None:
+            table = table.select(wanted)
+        start = sorted_position(table[TIME_COLUMN], t0)
+        stop = sorted_position(table[TIME_COLUMN], t1)
+        table = table.slice(start, max(0, stop - start))
+    else:
+        parquet_file = pq.ParquetFile(path)
+        row_groups = time_row_groups(parquet_file, t0, t1)
+        table = parquet_file.read_row_groups(row_groups, columns=wanted)
+        time = table[TIME_COLUMN]
+        table = table.filter(pc.and_(pc.greater_equal(time, t0), pc.less(time, t1)))
+
+    return table if columns is None else table.select(columns)
+
+
+def feather_writer(path: str, schema: pa.Schema) -> pa.ipc.RecordBatchFileWriter:
+    """
+    Writer of an uncompressed Feather V2 (Arrow IPC) file, so it can be
+    memory mapped without decoding
+    """
+    return pa.ipc.new_file(path, schema)
+
+
+def iter_batches(
+    path: str, columns: list[str] | None = None, batch_size: int = 1_000_000
+) -> Iterator[pa.RecordBatch]:
+    """
+    Streams a whole trial in batches of at most batch_size rows
+    """
+    if is_feather(path):
+        table = open_feather(path)
+        if columns is not None:
+            table = table.select(columns)
+        yield from table.to_batches(max_chunksize=batch_size)
+        return
+
+    yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns)
@@ -1,6 +1,8 @@
 #!/bin/bash
 
 # This script creates a latency histogram from cyclictest output.
+# cyclictest-plot.py reads the raw output directly, set SEGREGATE=1 to also
+# split it into the histogram and per core histogramN files.
 
 DATADIR=cyclictest-data
 MAXCORES=maxcores
@@ -11,6 +13,8 @@ DATADIRMAX=$DATADIR/$MAXCORES
 DATADIRONE=$DATADIR/$ONECORE
 DATADIRISOCORE=$DATADIR/$ISOLATED
 
+SEGREGATE=${SEGREGATE:-0}
+
 if [[ $EUID -ne 0 ]]; then
   echo "This script must be run as root to set real-time scheduling."
   exit 1
@@ -91,11 +95,15 @@ run_test "all CPUs" "$DATADIRMAX" "--duration=10m --mlockall --smp --priority=90
 # Run with one CPU
 one_cpu=2
 run_test "one CPU" "$DATADIRONE" "--duration=10m --mlockall --priority=90 -i100 -h100 -q -a $one_cpu"
+echo "$one_cpu" >"$DATADIRONE/cpus"
 
 # Run with one isolated CPU
 isolated_cpu=5
 run_test_isolated "isolated CPU" "$DATADIRISOCORE" "--duration=10m --mlockall --priority=90 -i100 -h100 -q -a $isolated_cpu" $isolated_cpu
+echo "$isolated_cpu" >"$DATADIRISOCORE/cpus"
 
-segregate_output "$DATADIRMAX" "$all_cores"
-segregate_output_singlecore "$DATADIRONE" $one_cpu
-segregate_output_singlecore "$DATADIRISOCORE" $isolated_cpu
+if [[ $SEGREGATE -eq 1 ]]; then
+  segregate_output "$DATADIRMAX" "$all_cores"
+  segregate_output_singlecore "$DATADIRONE" $one_cpu
+  segregate_output_singlecore "$DATADIRISOCORE" $isolated_cpu
+fi
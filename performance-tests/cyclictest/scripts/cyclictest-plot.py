@@ -1,47 +1,89 @@
 """
-This script plots the two histograms of cyclic test
+This script plots the histograms of cyclic test
 """
 
 import pandas as pd
 import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator, FormatStrFormatter, LogLocator
 import seaborn as sns
 import os
 import glob
+import time
+import argparse
+
+import weighted_histogram as wh
+from cyclictest_output import read_output, core_labels
+from render import FigureCache, FigureSpec, render
 
 FIGSIZE = (12, 7)
 BIN_COUNT = 22
 EDGE_LINEWIDTH = 0.5
 ALPHA = 0.6
 
+DATA_DIR = "cyclictest-data"
+GRAPHS_DIR = "graphs"
+OUTPUT_NAMES = {
+    "maxcores": "cyclictest-max-cores.png",
+    "onecore": "cyclictest-one-core.png",
+    "isocore": "cyclictest-isolated-core.png",
+}
+
+
+def load_histograms(histogram_dir: str) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """
+    Per core (latency, count) pairs, read from the raw cyclictest `output`
+    file, or from the histogramN files when there is no `output`
+    """
+    output_file = os.path.join(histogram_dir, "output")
+    if os.path.exists(output_file):
+        output = read_output(output_file)
+        labels = core_labels(histogram_dir, output.core_count)
+        return {label: output.core(i) for i, label in enumerate(labels)}
+
+    hist_files = sorted(
+        glob.glob(os.path.join(histogram_dir, "histogram[0-9]*")),
+        key=lambda path: int(os.path.basename(path)[len("histogram") :]),
+    )
+
+    core_histograms = {}
+    for path in hist_files:
+        df = pd.read_csv(path, sep="\t", header=None, names=["latency_us", "count"])
+        core_histograms[f"CPU{os.path.basename(path)[len('histogram') :]}"] = (
+            df["latency_us"].to_numpy(dtype=np.float64),
+            df["count"].to_numpy(dtype=np.int64),
+        )
 
-def plot_histogram(histogram_dir: str, output_file: str):
+    return core_histograms
+
+
+def plot_histogram(output_file: str, histogram_dir: str):
     sns.set_theme(style="whitegrid", font_scale=1.2)
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-    hist_files = sorted(glob.glob(os.path.join(histogram_dir, "histogram[0-9]*")))
-
-    core_samples = {}
-    for i, path in enumerate(hist_files):
-        df = pd.read_csv(path, sep="\t", header=None, names=["latency_us", "count"])
-        samples = np.repeat(df["latency_us"].values, df["count"].astype(int).values)
-        core_samples[f"CPU{path.split('histogram')[1]}"] = samples
+    core_histograms = load_histograms(histogram_dir)
 
-    all_samples = np.concatenate(list(core_samples.values()))
-    bins = np.histogram_bin_edges(all_samples, bins=BIN_COUNT)
+    all_latencies, all_counts = wh.merge(list(core_histograms.values()))
+    bins = wh.bin_edges(all_latencies, all_counts, BIN_COUNT)
 
     fig, ax = plt.subplots(figsize=FIGSIZE)
 
-    colors = sns.color_palette("viridis", len(core_samples))
+    colors = sns.color_palette("viridis", len(core_histograms))
 
-    for idx, (core, samples) in enumerate(core_samples.items()):
+    for idx, (core, (latencies, counts)) in enumerate(core_histograms.items()):
+        mean = wh.weighted_mean(latencies, counts)
+        std = wh.weighted_std(latencies, counts)
         ax.hist(
-            samples,
+            latencies,
             bins=bins,
+            weights=counts,
             log=True,
             alpha=ALPHA,
-            label=f"{core} (μ={np.mean(samples):.2f}, σ={np.std(samples):.2f})",
+            label=f"{core} (μ={mean:.2f}, σ={std:.2f})",
             edgecolor="white",
             linewidth=EDGE_LINEWIDTH,
             color=colors[idx],
@@ -57,9 +99,14 @@ def plot_histogram(histogram_dir: str, output_file: str):
     ax.xaxis.set_major_locator(MaxNLocator(nbins=10))
     ax.xaxis.set_major_formatter(FormatStrFormatter("%.2f"))
 
-    mean_val = np.mean(all_samples)
-    std_val = np.std(all_samples)
-    stats_text = f"Mean: {mean_val:.2f} μs\nStd.Dev: {std_val:.2f} μs"
+    mean_val = wh.weighted_mean(all_latencies, all_counts)
+    std_val = wh.weighted_std(all_latencies, all_counts)
+    p99, p999 = wh.weighted_percentile(all_latencies, all_counts, [99, 99.9])
+    max_val = wh.weighted_max(all_latencies, all_counts)
+    stats_text = (
+        f"Mean: {mean_val:.2f} μs\nStd.Dev: {std_val:.2f} μs\n"
+        f"P99: {p99:.0f} μs\nP99.9: {p999:.0f} μs\nMax: {max_val:.0f} μs"
+    )
     ax.text(
         0.98,
         0.95,
@@ -76,10 +123,71 @@ def plot_histogram(histogram_dir: str, output_file: str):
     fig.savefig(output_file, dpi=300)
     plt.close(fig)
 
-    print(f"Cyclictest plot saved to: {output_file}")
+
+def output_file_for(scenario_dir: str, graphs_dir: str) -> str:
+    name = os.path.basename(os.path.normpath(scenario_dir))
+    return os.path.join(graphs_dir, OUTPUT_NAMES.get(name, f"cyclictest-{name}.png"))
+
+
+def discover_scenarios(data_dir: str) -> list[str]:
+    return sorted(
+        os.path.join(data_dir, entry)
+        for entry in os.listdir(data_dir)
+        if os.path.isdir(os.path.join(data_dir, entry))
+    )
+
+
+def scenario_files(scenario_dir: str) -> tuple[str, ...]:
+    return tuple(
+        path
+        for path in sorted(glob.glob(os.path.join(scenario_dir, "*")))
+        if os.path.isfile(path)
+    )
+
+
+def main(scenarios: list[str], graphs_dir: str, jobs: int, force: bool = False):
+    if not scenarios:
+        scenarios = discover_scenarios(DATA_DIR)
+    if not scenarios:
+        print("No scenarios to plot")
+        return
+
+    start = time.perf_counter()
+    # Every worker reads its own scenario, so only paths are sent to them
+    specs = [
+        FigureSpec(
+            plot_histogram,
+            output_file_for(scenario, graphs_dir),
+            (scenario,),
+            inputs=scenario_files(scenario),
+        )
+        for scenario in scenarios
+    ]
+    scenario_of = {spec.output: scenario for spec, scenario in zip(specs, scenarios)}
+    cache = FigureCache(force)
+    timings = {}
+    for output_file in render(specs, jobs, cache=cache, timings=timings):
+        print(f"Cyclictest plot saved to: {output_file}")
+        print(f"{scenario_of[output_file]}: {timings[output_file]:.2f} s")
+    print(f"Figures: {cache.report()}")
+
+    print(f"{len(scenarios)} scenarios in {time.perf_counter() - start:.2f} s")
 
 
 if __name__ == "__main__":
-    plot_histogram("cyclictest-data/maxcores/", "graphs/cyclictest-max-cores.png")
-    plot_histogram("cyclictest-data/onecore/", "graphs/cyclictest-one-core.png")
-    plot_histogram("cyclictest-data/isocore/", "graphs/cyclictest-isolated-core.png")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help=f"Scenario directories, every subdirectory of {DATA_DIR}/ by default",
+    )
+    parser.add_argument("-o", "--out", type=str, default=GRAPHS_DIR)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render the figures even when their data did not change",
+    )
+    args = parser.parse_args()
+
+    main(args.scenarios, args.out, args.jobs, args.force)
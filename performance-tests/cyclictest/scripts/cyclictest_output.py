@@ -0,0 +1,95 @@
+"""
+Reader for the raw output of cyclictest run with -h (histogram) and -q
+"""
+
+import os
+import glob
+from dataclasses import dataclass, field
+
+import numpy as np
+
+SUMMARY_PREFIXES = {
+    "# Total:": "total",
+    "# Min Latencies:": "min_latencies",
+    "# Avg Latencies:": "avg_latencies",
+    "# Max Latencies:": "max_latencies",
+    "# Histogram Overflows:": "overflows",
+}
+
+
+@dataclass
+class CyclictestOutput:
+    """
+    Histogram of a cyclictest run: one row per latency bucket (μs) and one
+    column per measurement thread, plus the summary lines printed at the end.
+    """
+
+    latencies: np.ndarray
+    counts: np.ndarray
+    summary: dict[str, np.ndarray] = field(default_factory=dict)
+
+    @property
+    def core_count(self) -> int:
+        return self.counts.shape[1]
+
+    def core(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (latency, count) pairs of one column of the histogram
+        """
+        return self.latencies, self.counts[:, index]
+
+
+def read_output(path: str) -> CyclictestOutput:
+    """
+    Parses a cyclictest output file in a single pass
+    """
+    rows = []
+    summary = {}
+
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("#"):
+                for prefix, key in SUMMARY_PREFIXES.items():
+                    if line.startswith(prefix):
+                        values = line[len(prefix) :].split()
+                        summary[key] = np.array(values, dtype=np.int64)
+                        break
+            elif line.strip():
+                rows.append(line)
+
+    if not rows:
+        return CyclictestOutput(
+            np.array([], dtype=np.float64), np.zeros((0, 0), dtype=np.int64), summary
+        )
+
+    columns = len(rows[0].split())
+    table = np.array(" ".join(rows).split(), dtype=np.int64).reshape(len(rows), columns)
+
+    return CyclictestOutput(
+        latencies=table[:, 0].astype(np.float64),
+        counts=np.ascontiguousarray(table[:, 1:]),
+        summary=summary,
+    )
+
+
+def core_labels(directory: str, core_count: int) -> list[str]:
+    """
+    CPU labels for the histogram columns: taken from the optional `cpus` file
+    written by cyclictest-execute.bash, then from the suffixes of the legacy
+    histogramN files, and otherwise numbered from 1.
+    """
+    cpus_file = os.path.join(directory, "cpus")
+    if os.path.exists(cpus_file):
+        with open(cpus_file, "r") as f:
+            cpus = f.read().split()
+        if len(cpus) == core_count:
+            return [f"CPU{cpu}" for cpu in cpus]
+
+    hist_files = glob.glob(os.path.join(directory, "histogram[0-9]*"))
+    suffixes = sorted(
+        int(os.path.basename(path)[len("histogram") :]) for path in hist_files
+    )
+    if len(suffixes) == core_count:
+        return [f"CPU{suffix}" for suffix in suffixes]
+
+    return [f"CPU{i + 1}" for i in range(core_count)]
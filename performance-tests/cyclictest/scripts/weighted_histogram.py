@@ -0,0 +1,108 @@
+"""
+Statistics over cyclictest histograms kept as (latency, count) pairs
+"""
+
+import numpy as np
+
+
+def _nonzero(latencies: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    latencies = np.asarray(latencies, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.int64)
+    mask = counts > 0
+    return latencies[mask], counts[mask]
+
+
+def weighted_mean(latencies: np.ndarray, counts: np.ndarray) -> float:
+    """
+    Mean of the samples described by the histogram
+    """
+    latencies, counts = _nonzero(latencies, counts)
+    if counts.size == 0:
+        return float("nan")
+    return float(np.average(latencies, weights=counts))
+
+
+def weighted_std(latencies: np.ndarray, counts: np.ndarray) -> float:
+    """
+    Population standard deviation (same as np.std on the expanded samples)
+    """
+    latencies, counts = _nonzero(latencies, counts)
+    if counts.size == 0:
+        return float("nan")
+    mean = np.average(latencies, weights=counts)
+    return float(np.sqrt(np.average((latencies - mean) ** 2, weights=counts)))
+
+
+def weighted_max(latencies: np.ndarray, counts: np.ndarray) -> float:
+    """
+    Highest latency with at least one sample
+    """
+    latencies, _ = _nonzero(latencies, counts)
+    return float(latencies.max()) if latencies.size else float("nan")
+
+
+def weighted_min(latencies: np.ndarray, counts: np.ndarray) -> float:
+    """
+    Lowest latency with at least one sample
+    """
+    latencies, _ = _nonzero(latencies, counts)
+    return float(latencies.min()) if latencies.size else float("nan")
+
+
+def weighted_percentile(
+    latencies: np.ndarray, counts: np.ndarray, percentiles
+) -> np.ndarray:
+    """
+    Percentiles (0-100) of the expanded samples, using the "lower" rule: the
+    result is always one of the histogram latencies.
+    """
+    latencies, counts = _nonzero(latencies, counts)
+    percentiles = np.atleast_1d(np.asarray(percentiles, dtype=np.float64))
+    if counts.size == 0:
+        return np.full(percentiles.shape, np.nan)
+
+    order = np.argsort(latencies, kind="stable")
+    latencies = latencies[order]
+    cumulative = np.cumsum(counts[order])
+    total = cumulative[-1]
+
+    ranks = np.floor(percentiles / 100 * (total - 1)).astype(np.int64)
+    return latencies[np.searchsorted(cumulative, ranks, side="right")]
+
+
+def bin_edges(latencies: np.ndarray, counts: np.ndarray, bins: int) -> np.ndarray:
+    """
+    Same edges np.histogram_bin_edges would give for the expanded samples
+    """
+    latencies, _ = _nonzero(latencies, counts)
+    return np.histogram_bin_edges(latencies, bins=bins)
+
+
+def rebin(
+    latencies: np.ndarray, counts: np.ndarray, edges: np.ndarray
+) -> np.ndarray:
+    """
+    Counts of the histogram redistributed over the given edges
+    """
+    rebinned, _ = np.histogram(
+        np.asarray(latencies, dtype=np.float64),
+        bins=edges,
+        weights=np.asarray(counts, dtype=np.int64),
+    )
+    return rebinned.astype(np.int64)
+
+
+def merge(histograms: list[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sum several histograms into one (latency, count) pair
+    """
+    if not histograms:
+        return np.array([], dtype=np.float64), np.array([], dtype=np.int64)
+
+    all_latencies = np.concatenate([np.asarray(lat) for lat, _ in histograms])
+    all_counts = np.concatenate(
+        [np.asarray(cnt, dtype=np.int64) for _, cnt in histograms]
+    )
+    latencies, inverse = np.unique(all_latencies, return_inverse=True)
+    counts = np.bincount(inverse, weights=all_counts, minlength=latencies.size)
+    return latencies.astype(np.float64), counts.astype(np.int64)
@@ -0,0 +1,330 @@
+"""
+Alignment of the channels of a recording on their time column. Every sample
+of every channel is kept: samples without a counterpart in the other
+channels get their own row, with the missing channels left empty.
+"""
+
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+
+import numpy as np
+
+MISSING = -1
+GAP_FACTOR = 1.5
+
+# Reads the times of the samples [start, stop) of a channel
+TimeReader = Callable[[int, int], np.ndarray]
+
+
+@dataclass
+class ChannelReport:
+    """
+    samples: samples of the channel
+    unmatched: samples without a counterpart within the tolerance
+    missing: aligned rows without a sample of the channel
+    overruns: samples before the start or after the end of the reference
+    gaps: jumps in time longer than GAP_FACTOR periods
+    missed_periods: periods lost in those gaps
+    """
+
+    name: str
+    samples: int = 0
+    period: float = 0.0
+    unmatched: int = 0
+    missing: int = 0
+    overruns: int = 0
+    gaps: int = 0
+    missed_periods: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.samples} samples, {self.gaps} gaps "
+            f"({self.missed_periods} missed periods), {self.unmatched} unmatched, "
+            f"{self.missing} missing, {self.overruns} overruns"
+        )
+
+
+@dataclass
+class Alignment:
+    """
+    Rows of the aligned channels: the time of every row and, for every
+    channel, the index of its sample on that row (MISSING if it has none)
+    """
+
+    time: np.ndarray
+    indexes: list[np.ndarray]
+
+    def __len__(self) -> int:
+        return self.time.size
+
+
+def nominal_period(time: np.ndarray) -> float:
+    if time.size < 2:
+        return 0.0
+    return float(np.median(np.diff(time)))
+
+
+def nearest(timeline: np.ndarray, time: np.ndarray) -> np.ndarray:
+    """
+    Index of the nearest timeline entry to every time (both sorted)
+    """
+    right = np.searchsorted(timeline, time, side="left")
+    right = np.minimum(right, timeline.size - 1)
+    left = np.maximum(right - 1, 0)
+    closer_left = np.abs(time - timeline[left]) <= np.abs(timeline[right] - time)
+    return np.where(closer_left, left, right)
+
+
+def align_window(
+    times: list[np.ndarray], offsets: list[int], tolerance: float
+) -> tuple[Alignment, list[int]]:
+    """
+    Outer join of the channels of a window, matching every sample with the
+    nearest row within the tolerance. Returns the alignment (with indexes
+    shifted by offsets) and the unmatched samples of every channel.
+    """
+    timeline = times[0]
+    indexes = [np.arange(timeline.size, dtype=np.int64) + offsets[0]]
+    unmatched = [0]
+
+    for time, offset in zip(times[1:], offsets[1:]):
+        sample_indexes = np.arange(time.size, dtype=np.int64) + offset
+
+        if timeline.size and time.size:
+            rows = nearest(timeline, time)
+            matched = np.abs(time - timeline[rows]) <= tolerance
+            # Only the first sample of the channel on a row is matched. rows
+            # is sorted, so the repeated rows are next to each other among
+            # the matched samples
+            first = np.flatnonzero(matched)
+            matched[first[1:][rows[first[1:]] == rows[first[:-1]]]] = False
+        else:
+            rows = np.zeros(time.size, dtype=np.int64)
+            matched = np.zeros(time.size, dtype=np.bool_)
+        unmatched.append(int(time.size - np.count_nonzero(matched)))
+
+        extra = ~matched
+        if not extra.any():
+            column = np.full(timeline.size, MISSING, dtype=np.int64)
+            column[rows] = sample_indexes
+            indexes.append(column)
+            continue
+
+        merged = np.concatenate([timeline, time[extra]])
+        # Both parts are sorted, the stable sort merges them in linear time
+        order = np.argsort(merged, kind="stable")
+        position = np.empty_like(order)
+        position[order] = np.arange(order.size)
+        old_rows = position[: timeline.size]
+        new_rows = position[timeline.size :]
+
+        merged_indexes = []
+        for channel_indexes in indexes:
+            column = np.full(merged.size, MISSING, dtype=np.int64)
+            column[old_rows] = channel_indexes
+            merged_indexes.append(column)
+
+        column = np.full(merged.size, MISSING, dtype=np.int64)
+        column[old_rows[rows[matched]]] = sample_indexes[matched]
+        column[new_rows] = sample_indexes[extra]
+        merged_indexes.append(column)
+
+        timeline = merged[order]
+        indexes = merged_indexes
+
+    return Alignment(timeline, indexes), unmatched
+
+
+class TimeStream:
+    """
+    Time column of one channel, read block by block as the windows need it.
+    Only the samples not yet given to a window are kept.
+    """
+
+    def __init__(self, read: TimeReader, length: int, block_size: int):
+        self.read = read
+        self.length = length
+        self.block_size = block_size
+        # Index of the first sample of the buffer
+        self.position = 0
+        self.buffer = np.zeros(0, dtype=np.int64)
+        # Nominal period of the channel, from its first block
+        self.period = 0.0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.position + self.buffer.size >= self.length
+
+    def extend(self):
+        start = self.position + self.buffer.size
+        block = self.read(start, min(start + self.block_size, self.length))
+        block = block.astype(np.int64, copy=False)
+        if start == 0:
+            self.period = nominal_period(block)
+        self.buffer = np.concatenate([self.buffer, block])
+
+    def peek(self, count: int) -> np.ndarray:
+        """
+        Next count samples, fewer at the end of the channel
+        """
+        while self.buffer.size < count and not self.exhausted:
+            self.extend()
+        return self.buffer[:count]
+
+    def take(self, cut: int | None) -> tuple[int, np.ndarray]:
+        """
+        Index of the first sample and times of the samples up to cut
+        (included), or of all the remaining samples if cut is None
+        """
+        while not self.exhausted and (
+            cut is None or self.buffer.size == 0 or self.buffer[-1] <= cut
+        ):
+            self.extend()
+        stop = (
+            self.buffer.size
+            if cut is None
+            else int(np.searchsorted(self.buffer, cut, side="right"))
+        )
+        start, time = self.position, self.buffer[:stop]
+        self.position += stop
+        self.buffer = self.buffer[stop:]
+        return start, time
+
+
+def count_window(
+    report: ChannelReport,
+    time: np.ndarray,
+    previous: int | None,
+    period: float,
+    reference_range: tuple[int, int] | None,
+):
+    """
+    Adds the gaps and overruns of the samples of a window to the report,
+    previous being the last sample of the channel before the window
+    """
+    if period > 0 and time.size:
+        steps = np.diff(time, prepend=time[0] if previous is None else previous)
+        long_steps = steps[steps / period > GAP_FACTOR] / period
+        report.gaps += long_steps.size
+        report.missed_periods += int(np.rint(long_steps).sum()) - long_steps.size
+
+    if reference_range is not None:
+        first, last = reference_range
+        report.overruns += int(
+            np.count_nonzero(time < first) + np.count_nonzero(time > last)
+        )
+
+
+def align_stream(
+    readers: list[TimeReader],
+    lengths: list[int],
+    names: list[str],
+    chunk_size: int,
+    tolerance: float | None = None,
+) -> tuple[Iterator[Alignment], list[ChannelReport]]:
+    """
+    Aligns the channels on their sorted time columns, taking the first one
+    as reference, in windows of about chunk_size reference rows. The time
+    columns are read through readers, reader(start, stop) returning the
+    times of the samples [start, stop) of a channel, and only the slices of
+    the current window are kept in memory. The tolerance defaults to half
+    the period of the reference and the periods are taken from the first
+    chunk_size samples of every channel. The reports are filled as the
+    windows are consumed.
+    """
+    reports = [
+        ChannelReport(name, samples=length) for name, length in zip(names, lengths)
+    ]
+
+    def windows() -> Iterator[Alignment]:
+        streams = [
+            TimeStream(read, length, chunk_size)
+            for read, length in zip(readers, lengths)
+        ]
+        reference = streams[0]
+        reference_range = None
+        if reference.length:
+            first = int(reference.peek(1)[0])
+            last = int(readers[0](reference.length - 1, reference.length)[0])
+            reference_range = (first, last)
+        window_tolerance = tolerance
+        previous: list[int | None] = [None] * len(streams)
+
+        while True:
+            # Windows are cut halfway between two reference samples, so every
+            # sample falls in the same window as its nearest reference sample
+            head = reference.peek(chunk_size + 1)
+            if window_tolerance is None:
+                window_tolerance = reference.period / 2
+            cut = None
+            if head.size > chunk_size:
+                cut = int(
+                    head[chunk_size - 1]
+                    + (head[chunk_size] - head[chunk_size - 1]) // 2
+                )
+
+            starts, times = zip(*(stream.take(cut) for stream in streams))
+            alignment, unmatched = align_window(
+                list(times), list(starts), window_tolerance
+            )
+            for i, (report, stream, time) in enumerate(zip(reports, streams, times)):
+                report.period = stream.period
+                count_window(report, time, previous[i], stream.period, reference_range)
+                if time.size:
+                    previous[i] = int(time[-1])
+            for report, count, indexes in zip(reports, unmatched, alignment.indexes):
+                report.unmatched += count
+                report.missing += int(np.count_nonzero(indexes == MISSING))
+            yield alignment
+
+            if cut is None:
+                return
+
+    return windows(), reports
+
+
+def align_chunks(
+    times: list[np.ndarray],
+    names: list[str],
+    chunk_size: int,
+    tolerance: float | None = None,
+) -> tuple[Iterator[Alignment], list[ChannelReport]]:
+    """
+    align_stream of time columns already in memory
+    """
+    readers = [lambda start, stop, time=time: time[start:stop] for time in times]
+    return align_stream(
+        readers, [time.size for time in times], names, chunk_size, tolerance
+    )
+
+
+def align(
+    times: list[np.ndarray], names: list[str], tolerance: float | None = None
+) -> tuple[Alignment, list[ChannelReport]]:
+    """
+    Aligns the whole channels at once
+    """
+    size = max(1, max(time.size for time in times))
+    windows, reports = align_chunks(times, names, size, tolerance)
+    return next(windows), reports
+
+
+def take(values: np.ndarray, indexes: np.ndarray, start: int = 0) -> np.ndarray:
+    """
+    Values of a channel on every aligned row, NaN where it has no sample.
+    values holds the samples of the channel starting at index start.
+    """
+    result = np.full(indexes.size, np.nan, dtype=np.float64)
+    present = indexes != MISSING
+    result[present] = values[indexes[present] - start]
+    return result
+
+
+def span(indexes: np.ndarray) -> tuple[int, int]:
+    """
+    Range of sample indexes [start, stop) used by the rows of a window
+    """
+    present = indexes[indexes != MISSING]
+    if present.size == 0:
+        return 0, 0
+    return int(present.min()), int(present.max()) + 1
@@ -0,0 +1,70 @@
+"""
+Min/max decimation of long series before drawing them as lines
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+enabled = True
+
+
+def set_enabled(value: bool):
+    global enabled
+    enabled = value
+
+
+def buckets_for(figure=None) -> int:
+    """
+    One bucket per horizontal pixel of the figure
+    """
+    figure = figure if figure is not None else plt.gcf()
+    return max(1, int(figure.get_figwidth() * figure.dpi))
+
+
+def minmax_decimate(
+    x: np.ndarray, y: np.ndarray, buckets: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Keeps the minimum and the maximum of each bucket, in their original
+    order, so spikes and outliers are still drawn. Series that already fit
+    are returned unchanged.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    size = y.size
+    if size <= 2 * buckets:
+        return x, y
+
+    bucket_size = -(-size // buckets)
+    rows = -(-size // bucket_size)
+    padding = rows * bucket_size - size
+
+    low = np.concatenate([np.where(np.isnan(y), np.inf, y), np.full(padding, np.inf)])
+    high = np.concatenate(
+        [np.where(np.isnan(y), -np.inf, y), np.full(padding, -np.inf)]
+    )
+    low = low.reshape(rows, bucket_size)
+    high = high.reshape(rows, bucket_size)
+
+    offsets = np.arange(rows) * bucket_size
+    indexes = np.stack(
+        [offsets + low.argmin(axis=1), offsets + high.argmax(axis=1)], axis=1
+    )
+    indexes = np.sort(indexes, axis=1).ravel()
+
+    return x[indexes], y[indexes]
+
+
+def plot_line(x, y=None, figure=None, **kwargs):
+    """
+    plt.plot of a single series (or of its index against its values when only
+    y is given), decimated to the figure width unless decimation is disabled
+    """
+    if y is None:
+        y = x
+        x = x.index if hasattr(x, "index") else np.arange(len(x))
+
+    if enabled:
+        x, y = minmax_decimate(x, y, buckets_for(figure))
+
+    return plt.plot(x, y, **kwargs)
@@ -0,0 +1,249 @@
+"""
+Log-linear (HDR style) histograms of the RT Benchmarks measures. Values are
+counted in buckets whose width is a fixed fraction of their lower bound, so
+every percentile has a bounded relative error whatever the range of the
+data. Histograms of the same (priority, stress, measure) from different
+runs, hosts or days are combined by adding their counts, and are stored
+sparsely, a few kilobytes each.
+"""
+
+import os
+import csv
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Values are counted in units of 1 ns (the measures are in μs)
+UNIT = 1e-3
+# Below 2^SUB_BUCKET_BITS units every unit has its bucket, above it every
+# power of two is split in 2^(SUB_BUCKET_BITS - 1) buckets: a bucket is at
+# most 1 unit or 1/1024 of its values wide (~3 significant digits), and the
+# error of a percentile at most half of that
+SUB_BUCKET_BITS = 11
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS // 2
+# Over HALF_SUB_BUCKETS units, the bucket of a value is the exponent and the
+# first SUB_BUCKET_BITS - 1 bits of the mantissa of its float64, less the
+# exponent bias: a shift and a subtraction of its bits
+MANTISSA_SHIFT = 52 - (SUB_BUCKET_BITS - 1)
+BUCKET_OFFSET = (1022 + SUB_BUCKET_BITS - 1) * HALF_SUB_BUCKETS
+
+TAIL_PERCENTILES = (50, 99, 99.9, 99.99)
+
+
+def bucket_index(units: np.ndarray) -> np.ndarray:
+    """
+    Bucket of every non negative value, in units (not necessarily whole,
+    they are rounded down). The first SUB_BUCKETS units have a bucket each,
+    then every power of two is split in HALF_SUB_BUCKETS buckets.
+    """
+    units = units.astype(np.float64, copy=False)
+    high = (units.view(np.int64) >> MANTISSA_SHIFT) - BUCKET_OFFSET
+    return np.where(units < HALF_SUB_BUCKETS, units.astype(np.int64), high)
+
+
+def bucket_bounds(indexes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lower and upper bound (in μs) of every bucket
+    """
+    shift = np.maximum(indexes // HALF_SUB_BUCKETS - 1, 0)
+    lower = (indexes - shift * HALF_SUB_BUCKETS) << shift
+    return lower * UNIT, (lower + (1 << shift)) * UNIT
+
+
+@dataclass
+class LatencyHistogram:
+    """
+    Histogram of one measure. samples counts every value, the rest only the
+    positive ones, as the distribution plots do. The minimum, maximum and
+    sum are exact.
+    """
+
+    samples: int = 0
+    count: int = 0
+    total: float = 0.0
+    minimum: float = np.inf
+    maximum: float = -np.inf
+    counts: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+
+    def update(self, values: np.ndarray):
+        values = values[~np.isnan(values)]
+        self.samples += values.size
+
+        positive = values[values > 0]
+        if positive.size == 0:
+            return
+
+        self.count += positive.size
+        self.total += float(positive.sum())
+        self.minimum = min(self.minimum, float(positive.min()))
+        self.maximum = max(self.maximum, float(positive.max()))
+
+        self.add_counts(np.bincount(bucket_index(positive / UNIT)))
+
+    def add_counts(self, counts: np.ndarray):
+        if counts.size > self.counts.size:
+            counts = counts.copy()
+            counts[: self.counts.size] += self.counts
+            self.counts = counts
+        else:
+            self.counts[: counts.size] += counts
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        merged = LatencyHistogram(
+            samples=self.samples + other.samples,
+            count=self.count + other.count,
+            total=self.total + other.total,
+            minimum=min(self.minimum, other.minimum),
+            maximum=max(self.maximum, other.maximum),
+            counts=self.counts.copy(),
+        )
+        merged.add_counts(other.counts)
+        return merged
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else np.nan
+
+    def percentiles(self, percentiles=TAIL_PERCENTILES) -> np.ndarray:
+        """
+        Middle of the bucket of every percentile, within the exact minimum
+        and maximum
+        """
+        if self.count == 0:
+            return np.full(len(percentiles), np.nan)
+
+        cumulative = np.cumsum(self.counts)
+        ranks = np.asarray(percentiles, dtype=np.float64) / 100 * (self.count - 1)
+        indexes = np.searchsorted(cumulative, ranks, side="right")
+        lower, upper = bucket_bounds(indexes)
+        return np.clip((lower + upper) / 2, self.minimum, self.maximum)
+
+    def exceeds(self, threshold: float) -> float:
+        """
+        Estimated number of values over threshold. The values of the bucket
+        containing it are taken as evenly spread over the bucket, within the
+        exact minimum and maximum.
+        """
+        if self.count == 0 or threshold >= self.maximum:
+            return 0.0
+        if threshold < self.minimum:
+            return float(self.count)
+
+        used = np.flatnonzero(self.counts)
+        lower, upper = bucket_bounds(used)
+        lower = np.maximum(lower, self.minimum)
+        upper = np.minimum(upper, self.maximum)
+        width = upper - lower
+        over = np.where(
+            width > 0,
+            (upper - threshold) / np.where(width > 0, width, 1),
+            lower > threshold,
+        )
+        return float(self.counts[used] @ np.clip(over, 0, 1))
+
+    def to_dict(self) -> dict:
+        used = np.flatnonzero(self.counts)
+        return {
+            "samples": self.samples,
+            "count": self.count,
+            "total": self.total,
+            "minimum": self.minimum if self.count else None,
+            "maximum": self.maximum if self.count else None,
+            # Gaps between the used buckets are smaller numbers than the buckets
+            "buckets": np.diff(used, prepend=0).tolist(),
+            "counts": self.counts[used].tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, entry: dict) -> "LatencyHistogram":
+        used = np.cumsum(np.asarray(entry["buckets"], dtype=np.int64))
+        counts = np.zeros(used[-1] + 1 if used.size else 0, dtype=np.int64)
+        counts[used] = entry["counts"]
+        return cls(
+            samples=entry["samples"],
+            count=entry["count"],
+            total=entry["total"],
+            minimum=np.inf if entry["minimum"] is None else entry["minimum"],
+            maximum=-np.inf if entry["maximum"] is None else entry["maximum"],
+            counts=counts,
+        )
+
+
+Histograms = dict[tuple[int, bool, str], LatencyHistogram]
+
+
+def merge_histograms(histogram_sets: list[Histograms]) -> Histograms:
+    merged: Histograms = {}
+    for histograms in histogram_sets:
+        for key, histogram in histograms.items():
+            merged[key] = merged[key].merge(histogram) if key in merged else histogram
+    return dict(sorted(merged.items()))
+
+
+def save_histograms(histograms: Histograms, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    document = {
+        "unit": UNIT,
+        "sub_bucket_bits": SUB_BUCKET_BITS,
+        "histograms": [
+            {"priority": priority, "stress": stress, "measure": measure}
+            | histogram.to_dict()
+            for (priority, stress, measure), histogram in sorted(histograms.items())
+        ],
+    }
+    # Written aside and renamed, a reader never sees half a file
+    with open(path + ".tmp", "w") as f:
+        json.dump(document, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_histograms(path: str) -> Histograms:
+    with open(path, "r") as f:
+        document = json.load(f)
+    if document["unit"] != UNIT or document["sub_bucket_bits"] != SUB_BUCKET_BITS:
+        raise ValueError(
+            f"{path} was written with unit {document['unit']} and "
+            f"{document['sub_bucket_bits']} sub bucket bits, "
+            f"expected {UNIT} and {SUB_BUCKET_BITS}"
+        )
+    return {
+        (entry["priority"], entry["stress"], entry["measure"]): (
+            LatencyHistogram.from_dict(entry)
+        )
+        for entry in document["histograms"]
+    }
+
+
+def tail_rows(histograms: Histograms, percentiles=TAIL_PERCENTILES) -> list[dict]:
+    rows = []
+    for (priority, stress, measure), histogram in histograms.items():
+        row = {
+            "priority": priority,
+            "stress": stress,
+            "measure": measure,
+            "samples": histogram.samples,
+            "count": histogram.count,
+            "mean": histogram.mean,
+            "min": histogram.minimum if histogram.count else np.nan,
+        }
+        for percentile, value in zip(percentiles, histogram.percentiles(percentiles)):
+            row[f"p{percentile:g}"] = float(value)
+        row["max"] = histogram.maximum if histogram.count else np.nan
+        rows.append(row)
+    return rows
+
+
+def write_tails(histograms: Histograms, out_dir: str) -> str:
+    """
+    Writes the tail percentiles of every histogram as tails.csv
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rows = tail_rows(histograms)
+    path = os.path.join(out_dir, "tails.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
@@ -2,109 +2,352 @@
 Script to merge the data from the h5 files
 """
 
-import pandas as pd
 import os
+import shutil
+import argparse
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+
 import h5py
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+import rtxi_reader
+from alignment import align_stream, span, take
+from hdr_histogram import (
+    SUB_BUCKET_BITS,
+    UNIT,
+    LatencyHistogram,
+    load_histograms,
+    merge_histograms,
+    save_histograms,
+)
+from source_manifest import SourceManifest
 
-def read_field_as_df(group: h5py.File, name: str) -> pd.DataFrame:
-    dataset = group[name]
-    arr = dataset[:]
+MEASURES = ["duration", "time_step", "latency", "jitter"]
 
-    if arr.dtype.names:
-        # Dataset estructurado: convertir por campos
-        df = pd.DataFrame({name: arr[name] for name in arr.dtype.names})
-    else:
-        # Dataset simple
-        df = pd.DataFrame(arr, columns=["value"])
+SCHEMA = pa.schema(
+    [
+        ("priority", pa.int32()),
+        ("duration", pa.float64()),
+        ("time_step", pa.float64()),
+        ("latency", pa.float64()),
+        ("jitter", pa.float64()),
+        ("time", pa.int64()),
+        ("stress", pa.bool_()),
+    ]
+)
+
+PARTITION_COLUMNS = ["priority", "stress"]
+MANIFEST_NAME = "_manifest.json"
+HISTOGRAMS_NAME = "histograms.json"
+# Conversion parameters kept in the manifest, fragments converted with
+# other histogram buckets are converted again
+FRAGMENT_PARAMS = {"histogram_unit": UNIT, "histogram_bits": SUB_BUCKET_BITS}
 
-    return df
+NANO_TO_MICRO = 1000
+CHUNK_SIZE = 1_000_000
+ROW_GROUP_SIZE = 262_144
 
 
-def read_hdf_as_dict(filename: str) -> dict:
+def read_hdf_chunks(
+    filename: str, priority: int, stress: bool, chunk_size: int = CHUNK_SIZE
+) -> Iterator[pa.Table]:
+    """
+    Yields the RT Benchmarks measures of a h5 file in tables of about
+    chunk_size rows, already converted to μs. The measures are aligned on
+    their time column, so a sample missing in one of them leaves it empty
+    on that row instead of shifting the rest. The trials of the file are
+    read one after the other, and only the slices of the time columns of
+    the current window are held in memory.
+    """
+    index = rtxi_reader.index_file(filename)
+
     with h5py.File(filename, "r") as f:
-        group = f["Trial1/Synchronous Data"]
-        dfs = {}
-        df = read_field_as_df(group, "0 RT Benchmarks OUTPUT 0 Recording Component")
-        dfs["duration"] = df
+        for trial in index.trial_names():
+            channels = [index.channel(measure, trial) for measure in MEASURES]
+
+            windows, reports = align_stream(
+                [rtxi_reader.time_reader(f, channel) for channel in channels],
+                [channel.length for channel in channels],
+                MEASURES,
+                chunk_size,
+            )
+
+            for window in windows:
+                rows = len(window)
+                columns = {"priority": np.full(rows, priority, dtype=np.int32)}
+                for measure, channel, indexes in zip(
+                    MEASURES, channels, window.indexes
+                ):
+                    start, stop = span(indexes)
+                    values = rtxi_reader.read_field(
+                        f, channel, "value", start, stop
+                    ).astype(np.float64)
+                    values /= NANO_TO_MICRO
+                    columns[measure] = take(values, indexes, start)
+                columns["time"] = window.time
+                columns["stress"] = np.full(rows, stress, dtype=np.bool_)
+
+                yield pa.Table.from_pydict(columns, schema=SCHEMA)
+
+            print(
+                "\n".join(
+                    [f"Alignment of {filename} ({trial}):"]
+                    + [f"  {report}" for report in reports]
+                )
+            )
+
+
+def merge_by_time(sources: list[Iterator[pa.Table]]) -> Iterator[pa.Table]:
+    """
+    Merges tables streams that are ordered by time into a single stream
+    ordered by time, holding at most one chunk per source in memory
+    """
+    buffers = [next(source, None) for source in sources]
 
-        df = read_field_as_df(group, "0 RT Benchmarks OUTPUT 1 Recording Component")
-        dfs["time_step"] = df
+    while True:
+        active = [i for i, buffer in enumerate(buffers) if buffer is not None]
+        if not active:
+            return
 
-        df = read_field_as_df(group, "0 RT Benchmarks OUTPUT 2 Recording Component")
-        dfs["latency"] = df
+        cutoff = min(buffers[i]["time"][-1].as_py() for i in active)
 
-        df = read_field_as_df(group, "0 RT Benchmarks OUTPUT 6 Recording Component")
-        dfs["jitter"] = df
+        parts = []
+        for i in active:
+            times = buffers[i]["time"].to_numpy()
+            taken = int(np.searchsorted(times, cutoff, side="right"))
+            parts.append(buffers[i].slice(0, taken))
 
-    return dfs
+            if taken == buffers[i].num_rows:
+                buffers[i] = next(sources[i], None)
+            else:
+                buffers[i] = buffers[i].slice(taken)
 
+        merged = pa.concat_tables(parts)
+        if len(parts) > 1:
+            order = np.argsort(merged["time"].to_numpy(), kind="stable")
+            merged = merged.take(order)
+        yield merged
 
-def main():
-    files = os.listdir(".")
 
-    priority_folders = [f for f in files if f.startswith("priority")]
+def read_parquet_chunks(filename: str) -> Iterator[pa.Table]:
+    parquet_file = pq.ParquetFile(filename)
+    for batch in parquet_file.iter_batches(batch_size=CHUNK_SIZE):
+        yield pa.Table.from_batches([batch])
 
-    nano_to_micro = 1000
 
-    df: pd.DataFrame = pd.DataFrame(
+def histogram_path(fragment: str) -> str:
+    """
+    Histograms of a fragment, next to it. The leading underscore keeps them
+    out of the parquet dataset.
+    """
+    name = os.path.basename(fragment).replace(".parquet", ".hdr.json")
+    return os.path.join(os.path.dirname(fragment), "_" + name)
+
+
+def write_fragment(
+    source: str, fragment: str, priority: int, stress: bool, drop: list[str]
+) -> str:
+    """
+    Converts one h5 file into a parquet fragment ordered by time, and the
+    histograms of its measures. The whole fragment is only sorted in memory
+    when the recording is out of order.
+    """
+    schema = SCHEMA
+    for column in drop:
+        schema = schema.remove(schema.get_field_index(column))
+
+    histograms = {measure: LatencyHistogram() for measure in MEASURES}
+    ordered = True
+    last_time = None
+    with pq.ParquetWriter(fragment, schema, write_statistics=True) as writer:
+        for table in read_hdf_chunks(source, priority, stress):
+            for measure, histogram in histograms.items():
+                histogram.update(table[measure].to_numpy(zero_copy_only=False))
+            time = table["time"].to_numpy()
+            if np.any(np.diff(time) < 0) or (
+                last_time is not None and time[0] < last_time
+            ):
+                ordered = False
+            last_time = time[-1]
+            writer.write_table(table.drop_columns(drop), row_group_size=ROW_GROUP_SIZE)
+
+    if not ordered:
+        table = pq.read_table(fragment)
+        order = np.argsort(table["time"].to_numpy(), kind="stable")
+        pq.write_table(table.take(order), fragment, row_group_size=ROW_GROUP_SIZE)
+
+    save_histograms(
         {
-            "priority": [],
-            "duration": [],
-            "time_step": [],
-            "latency": [],
-            "jitter": [],
-        }
+            (priority, stress, measure): histogram
+            for measure, histogram in histograms.items()
+        },
+        histogram_path(fragment),
     )
-    for priority_folder in priority_folders:
-        files = os.listdir(priority_folder)
+    return fragment
 
-        for file in files:
+
+def find_sources(base_dir: str) -> list[tuple[str, int, bool]]:
+    """
+    (path, priority, stress) of every h5 file, ordered by priority
+    """
+    priority_folders = sorted(
+        (f for f in os.listdir(base_dir) if f.startswith("priority")),
+        key=lambda folder: int(folder.split("-")[1]),
+    )
+
+    sources = []
+    for priority_folder in priority_folders:
+        priority_num: int = int(priority_folder.split("-")[1])
+        folder = os.path.join(base_dir, priority_folder)
+        for file in sorted(os.listdir(folder)):
             if file.endswith(".h5"):
-                priority_num: int = int(priority_folder.split("-")[1])
-                hdf_file_dict: dict = read_hdf_as_dict(
-                    os.path.join(priority_folder, file)
+                sources.append(
+                    (os.path.join(folder, file), priority_num, "no" not in file)
                 )
 
-                min_len: int = min(
-                    len(hdf_file_dict["duration"]),
-                    len(hdf_file_dict["time_step"]),
-                    len(hdf_file_dict["latency"]),
-                    len(hdf_file_dict["jitter"]),
-                )
+    return sources
 
-                df_aux: pd.DataFrame = pd.DataFrame(
-                    {
-                        "priority": [priority_num] * min_len,
-                        "time": hdf_file_dict["duration"]["time"][:min_len],
-                        "duration": hdf_file_dict["duration"]["value"][:min_len].apply(
-                            lambda x: x / nano_to_micro
-                        ),
-                        "time_step": hdf_file_dict["time_step"]["value"][
-                            :min_len
-                        ].apply(lambda x: x / nano_to_micro),
-                        "latency": hdf_file_dict["latency"]["value"][:min_len].apply(
-                            lambda x: x / nano_to_micro
-                        ),
-                        "jitter": hdf_file_dict["jitter"]["value"][:min_len].apply(
-                            lambda x: x / nano_to_micro
-                        ),
-                        "stress": ["no" not in file] * min_len,
-                    }
-                )
-                df = pd.concat([df, df_aux], ignore_index=True)
 
-    df["priority"] = df["priority"].astype("int32")
-    df["time"] = df["time"].astype("int64")
+def fragment_path(
+    fragments_dir: str, source: str, priority: int, stress: bool, partitioned: bool
+) -> str:
+    name = os.path.basename(source).replace(".h5", ".parquet")
+    if partitioned:
+        directory = os.path.join(
+            fragments_dir, f"priority={priority}", f"stress={stress}"
+        )
+    else:
+        directory = os.path.join(fragments_dir, f"priority-{priority}")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def write_single_file(fragments: list[tuple[str, int]], output_path: str):
+    """
+    Merges the time ordered fragments of each priority into a single file
+    """
+    priorities = sorted({priority for _, priority in fragments})
+
+    with pq.ParquetWriter(output_path, SCHEMA, write_statistics=True) as writer:
+        pending = []
+        pending_rows = 0
+        for priority in priorities:
+            sources = [
+                read_parquet_chunks(fragment)
+                for fragment, fragment_priority in fragments
+                if fragment_priority == priority
+            ]
+            for table in merge_by_time(sources):
+                # The merged tables can be small, group them so row groups
+                # keep a similar size
+                pending.append(table)
+                pending_rows += table.num_rows
+                if pending_rows >= ROW_GROUP_SIZE:
+                    writer.write_table(
+                        pa.concat_tables(pending), row_group_size=ROW_GROUP_SIZE
+                    )
+                    pending = []
+                    pending_rows = 0
+
+        if pending:
+            writer.write_table(pa.concat_tables(pending), row_group_size=ROW_GROUP_SIZE)
 
-    df.sort_values(by=["priority", "time"], inplace=True)
+
+def main(jobs: int, layout: str, force: bool):
+    sources = find_sources(".")
 
     data_dir = "merged-data"
     if not os.path.exists(data_dir):
         os.mkdir(data_dir)
-    df.to_parquet(data_dir + "/data.parquet", index=False)
-    print("Data merged on " + data_dir + "/data.parquet")
+
+    partitioned = layout == "partitioned"
+    if partitioned:
+        fragments_dir = os.path.join(data_dir, "data")
+        drop = PARTITION_COLUMNS
+    else:
+        fragments_dir = os.path.join(data_dir, "fragments")
+        drop = []
+    if force:
+        shutil.rmtree(fragments_dir, ignore_errors=True)
+
+    manifest = SourceManifest(os.path.join(fragments_dir, MANIFEST_NAME), force)
+    removed = manifest.prune([source for source, _, _ in sources])
+    for fragment in removed:
+        for path in (fragment, histogram_path(fragment)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    fragments = []
+    tasks = []
+    for source, priority, stress in sources:
+        fragment = fragment_path(fragments_dir, source, priority, stress, partitioned)
+        fragments.append((fragment, priority))
+        # A fragment without its histograms is converted again
+        if not os.path.exists(histogram_path(fragment)):
+            manifest.entries.pop(source, None)
+        if not manifest.is_fresh(source, fragment, FRAGMENT_PARAMS):
+            tasks.append((source, fragment, priority, stress, drop))
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(write_fragment, *task) for task in tasks]
+            for task, future in zip(tasks, futures):
+                manifest.record(task[0], future.result(), FRAGMENT_PARAMS)
+    else:
+        for task in tasks:
+            manifest.record(task[0], write_fragment(*task), FRAGMENT_PARAMS)
+    manifest.save()
+    print(f"Sources: {manifest.report()}")
+
+    # The histograms of the whole dataset are the sum of the fragment ones
+    histograms_path = os.path.join(data_dir, HISTOGRAMS_NAME)
+    save_histograms(
+        merge_histograms(
+            [load_histograms(histogram_path(fragment)) for fragment, _ in fragments]
+        ),
+        histograms_path,
+    )
+    print("Histograms written on " + histograms_path)
+
+    if partitioned:
+        print("Data merged on " + fragments_dir)
+        return
+
+    output_path = data_dir + "/data.parquet"
+    if not tasks and not removed and os.path.exists(output_path):
+        print("Data already merged on " + output_path)
+        return
+
+    write_single_file(fragments, output_path)
+    print("Data merged on " + output_path)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of h5 files decoded in parallel",
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        type=str,
+        default="partitioned",
+        choices=["single", "partitioned"],
+        help="Dataset partitioned by priority and stress or single parquet file",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Convert every h5 file again, ignoring the cached fragments",
+    )
+    args = parser.parse_args()
+
+    main(args.jobs, args.layout, args.force)
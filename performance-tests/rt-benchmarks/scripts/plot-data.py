@@ -5,250 +5,450 @@ import argparse
 import seaborn as sns
 import numpy as np
 
-
-def plot_priorities(df: pd.DataFrame, graphs_dir: str):
+import decimation
+from decimation import plot_line
+from hdr_histogram import (
+    load_histograms,
+    merge_histograms,
+    save_histograms,
+    write_tails,
+)
+from render import FigureCache, FigureSpec, render
+from rt_compare import (
+    BLOCK_SIZE,
+    CONFIDENCE,
+    RESAMPLES,
+    STATISTICS,
+    compare_datasets,
+    write_comparison,
+)
+from rt_dataset import MEASURES, Groups, group_frames, group_priorities, read_frame
+from rt_stats import MeasureStats, Stats, compute_stats, stats_priorities, write_summary
+
+DEFAULT_DATA = "merged-data/data"
+DEFAULT_HISTOGRAMS = "merged-data/histograms.json"
+
+# Columns of every (priority, stress) group
+Columns = dict[tuple[int, bool], dict[str, np.ndarray]]
+
+MAXIMUMS = {
+    "duration": (
+        100,
+        120,
+    ),
+    "time_step": (100,),
+    "latency": (10,),
+    "jitter": (2,),
+}
+
+
+def priority_cutoffs(groups: Columns) -> dict[tuple[int, bool], int]:
     """
-    Plots all priorities general graphs with stress, without stress and with both
+    Number of rows of each group that fall within the first min_size samples
+    of its priority (ordered by time), min_size being the size of the
+    smallest priority
     """
-    min_size = min(
-        [
-            len(df[df["priority"] == priority])
-            for priority in sorted(df["priority"].unique())
+    priorities = group_priorities(groups)
+    times = {
+        priority: [
+            groups[key]["time"]
+            for key in ((priority, True), (priority, False))
+            if key in groups
         ]
+        for priority in priorities
+    }
+    min_size = min(sum(len(t) for t in times[priority]) for priority in priorities)
+
+    cutoffs = {}
+    for priority in priorities:
+        all_times = np.concatenate(times[priority])
+        last_time = np.partition(all_times, min_size - 1)[min_size - 1]
+        for stress_state in (True, False):
+            if (priority, stress_state) in groups:
+                group_times = groups[(priority, stress_state)]["time"]
+                cutoffs[(priority, stress_state)] = int(
+                    np.searchsorted(group_times, last_time, side="right")
+                )
+    return cutoffs
+
+
+def title_suffix(stress_state: bool) -> str:
+    return " (Stress)" if stress_state else " (No Stress)"
+
+
+def draw_lines(
+    output: str,
+    series: list[tuple[str, np.ndarray, int]],
+    title: str,
+    ylabel: str,
+    figsize: tuple[int, int],
+):
+    """
+    One line per (label, values, stop), drawing values[:stop] against their
+    position
+    """
+    plt.figure(figsize=figsize)
+    for label, values, stop in series:
+        plot_line(values[:stop], label=label)
+    plt.title(title)
+    plt.xlabel("Time (μs)")
+    plt.ylabel(ylabel)
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(output)
+    plt.close()
+
+
+def draw_exceeds(output: str, pivot: pd.DataFrame, measure: str, maximum: int):
+    ax = pivot.plot(kind="bar", figsize=(10, 6))
+    ax.set_title(f"Count of {measure} > {maximum} μs")
+    ax.set_xlabel("Priority")
+    ax.set_ylabel("Number of Exceeding Samples")
+    plt.xticks(rotation=0)
+    plt.grid(True, axis="y")
+    plt.legend(title="Stress")
+    plt.tight_layout()
+    plt.savefig(output)
+    plt.close()
+
+
+def draw_distribution(
+    output: str,
+    bins: np.ndarray,
+    weights: dict[str, np.ndarray],
+    measure: str,
+    priority: int,
+    mean_val: float,
+    std_val: float,
+):
+    plt.figure(figsize=(10, 6))
+
+    for label, label_weights in weights.items():
+        plt.hist(
+            bins[:-1],
+            bins=bins,
+            weights=label_weights,
+            log=True,
+            alpha=0.6,
+            label=label,
+            edgecolor="white",
+        )
+
+    plt.title(f"{measure.capitalize()} Distribution\nPriority {priority}")
+    plt.xlabel(f"{measure.capitalize()} (μs)")
+    plt.ylabel("Frequency (log scale)")
+    plt.legend()
+    plt.grid(False)
+
+    stats_text = f"Mean: {mean_val:.2f} μs\nStd.Dev: {std_val:.2f} μs"
+    plt.text(
+        0.98,
+        0.95,
+        stats_text,
+        transform=plt.gca().transAxes,
+        fontsize=10,
+        verticalalignment="top",
+        horizontalalignment="right",
+        bbox=dict(boxstyle="round", facecolor="white", alpha=0.8),
+    )
+
+    plt.tight_layout()
+    plt.savefig(output)
+    plt.close()
+
+
+def draw_forest(
+    output: str,
+    comparison: pd.DataFrame,
+    measure: str,
+    labels: tuple[str, str],
+    confidence: float,
+    threshold: float,
+):
+    """
+    One panel per statistic with the difference of every (priority, stress)
+    group and its confidence interval
+    """
+    fig, axes = plt.subplots(
+        1,
+        len(STATISTICS),
+        sharey=True,
+        figsize=(4 * len(STATISTICS), 2 + 0.4 * len(comparison) / len(STATISTICS)),
+    )
+    for ax, statistic in zip(axes, STATISTICS):
+        rows = comparison[comparison["statistic"] == statistic].reset_index(drop=True)
+        # The exceedance rate is shown in percentage points
+        scale = 100 if statistic == "exceedance" else 1
+        ax.errorbar(
+            rows["difference"] * scale,
+            rows.index,
+            xerr=[
+                (rows["difference"] - rows["low"]) * scale,
+                (rows["high"] - rows["difference"]) * scale,
+            ],
+            fmt="o",
+            capsize=3,
+        )
+        ax.axvline(0, color="grey", linestyle="--")
+        ax.set_yticks(
+            rows.index,
+            [
+                f"Priority {priority}{title_suffix(stress)}"
+                for priority, stress in zip(rows["priority"], rows["stress"])
+            ],
+        )
+        ax.set_title(
+            f"{statistic} > {threshold:g} μs"
+            if statistic == "exceedance"
+            else statistic
+        )
+        ax.set_xlabel(
+            "Difference (%)" if statistic == "exceedance" else "Difference (μs)"
+        )
+        ax.grid(True, axis="x")
+    axes[0].invert_yaxis()
+    fig.suptitle(
+        f"{measure.capitalize()}: {labels[1]} - {labels[0]} "
+        f"({confidence:.0%} bootstrap intervals)"
     )
-    for priority in sorted(df["priority"].unique()):
-        df_priority = df[df["priority"] == priority][:min_size]
+    fig.tight_layout()
+    fig.savefig(output)
+    plt.close(fig)
+
+
+def group_columns(groups: Groups) -> Columns:
+    """
+    Columns of every group as arrays, extracted once so the figures that
+    use them share the same arrays (and the same shared memory)
+    """
+    return {
+        key: {column: frame[column].to_numpy() for column in frame}
+        for key, frame in groups.items()
+    }
+
 
+def plot_priorities(groups: Columns, graphs_dir: str) -> list[FigureSpec]:
+    """
+    Figures of all priorities general graphs with stress and without stress
+    """
+    cutoffs = priority_cutoffs(groups)
+    labels = {
+        "duration": "Duration (μs)",
+        "time_step": "Time Step (μs)",
+        "latency": "Latency (μs)",
+        "jitter": "Jitter (μs)",
+    }
+
+    specs = []
+    for priority in group_priorities(groups):
         for stress_state, label_suffix in [
             (True, "-stress"),
             (False, "-no-stress"),
         ]:
-            if stress_state is not None:
-                df_filtered = df_priority[df_priority["stress"] == stress_state]
-            else:
-                df_filtered = df_priority
-
-            plt.figure(figsize=(12, 6))
-            plt.plot(df_filtered["duration"], label="Duration (μs)")
-            plt.plot(df_filtered["time_step"], label="Time Step (μs)")
-            plt.plot(df_filtered["latency"], label="Latency (μs)")
-            plt.plot(df_filtered["jitter"], label="Jitter (μs)")
-
-            title_suffix = (
-                " (Stress)"
-                if stress_state is True
-                else " (No Stress)"
-                if stress_state is False
-                else ""
-            )
-            plt.title(f"RT Measures for Priority {int(priority)}{title_suffix}")
-            plt.xlabel("Time (μs)")
-            plt.ylabel("Time (μs)")
-            plt.legend()
-            plt.grid(True)
-
+            key = (priority, stress_state)
+            if key not in groups:
+                continue
+            series = [
+                (label, groups[key][measure], cutoffs[key])
+                for measure, label in labels.items()
+            ]
             filename = f"priority-{int(priority)}{label_suffix}.png"
-            output_path = os.path.join(graphs_dir, filename)
-            plt.tight_layout()
-            plt.savefig(output_path)
-            plt.close()
-
-            print(f"Data ploted under {output_path}")
+            specs.append(
+                FigureSpec(
+                    draw_lines,
+                    os.path.join(graphs_dir, filename),
+                    (
+                        series,
+                        f"RT Measures for Priority {int(priority)}"
+                        f"{title_suffix(stress_state)}",
+                        "Time (μs)",
+                        (12, 6),
+                    ),
+                )
+            )
+    return specs
 
 
-def plot_measure(df: pd.DataFrame, measure: str, graphs_dir: str):
+def plot_measure(groups: Columns, measure: str, graphs_dir: str) -> list[FigureSpec]:
     """
-    Plot one measure across all priorities on the same graph.
-    Each line represents a different priority.
+    Figures of one measure across all priorities, one line per priority
     """
+    specs = []
     for stress_state, suffix in [
         (True, "-stress"),
         (False, "-no-stress"),
     ]:
-        df_filtered = df if stress_state is None else df[df["stress"] == stress_state]
+        priorities = [
+            priority
+            for priority in group_priorities(groups)
+            if (priority, stress_state) in groups
+        ]
+        if not priorities:
+            continue
 
         min_size = min(
-            [
-                len(df_filtered[df_filtered["priority"] == priority])
-                for priority in sorted(df_filtered["priority"].unique())
-            ]
+            len(groups[(priority, stress_state)][measure]) for priority in priorities
         )
-
-        plt.figure(figsize=(10, 5))
-
-        for priority in sorted(df_filtered["priority"].unique()):
-            df_priority = df_filtered[df_filtered["priority"] == priority][:min_size]
-            plt.plot(
-                df_priority[measure].reset_index(drop=True),
-                label=f"Priority {priority}",
+        series = [
+            (
+                f"Priority {priority}",
+                groups[(priority, stress_state)][measure],
+                min_size,
             )
-
-        title_suffix = (
-            " (Stress)"
-            if stress_state is True
-            else " (No Stress)"
-            if stress_state is False
-            else ""
-        )
-        plt.title(f"{measure.capitalize()} by Priority{title_suffix}")
-        plt.xlabel("Time (μs)")
-        plt.ylabel(f"{measure.capitalize()} (μs)")
-        plt.legend()
-        plt.grid(True)
+            for priority in priorities
+        ]
 
         filename = f"{measure}{suffix}.png"
-        output_path = os.path.join(graphs_dir, filename)
-        plt.tight_layout()
-        plt.savefig(output_path)
-        plt.close()
-        print(f"Data ploted under {output_path}")
+        specs.append(
+            FigureSpec(
+                draw_lines,
+                os.path.join(graphs_dir, filename),
+                (
+                    series,
+                    f"{measure.capitalize()} by Priority{title_suffix(stress_state)}",
+                    f"{measure.capitalize()} (μs)",
+                    (10, 5),
+                ),
+            )
+        )
+    return specs
 
 
-def plot_measures(df: pd.DataFrame, graphs_dir: str):
+def plot_measures(groups: Columns, graphs_dir: str) -> list[FigureSpec]:
     """
-    Load the dataset and plot each measure across all priorities.
+    Figures of each measure across all priorities.
     """
-
-    measures = ["duration", "time_step", "latency", "jitter"]
-    for measure in measures:
-        plot_measure(df, measure, graphs_dir)
+    return [
+        spec
+        for measure in MEASURES
+        for spec in plot_measure(groups, measure, graphs_dir)
+    ]
 
 
 def plot_measure_deviation_number(
-    df: pd.DataFrame, measure: str, maximum: int, graphs_dir: str
-):
+    stats: Stats, measure: str, maximum: int, graphs_dir: str
+) -> FigureSpec:
     """
-    Plot one measure histogram of the number of values that exceed the given maximum,
-    grouped by priority and stress state.
+    Histogram of the number of values of one measure that exceed the given
+    maximum, grouped by priority and stress state.
     """
-    os.makedirs(graphs_dir, exist_ok=True)
-
-    df_exceed = df[df[measure] > maximum]
-
-    counts = (
-        df_exceed.groupby(["priority", "stress"]).size().reset_index(name="exceeds")
+    counts = pd.Series(
+        {
+            key: group_stats[measure].exceeds.get(maximum, 0)
+            for key, group_stats in stats.items()
+        }
     )
+    counts.index.names = ["priority", "stress"]
 
-    pivot = counts.pivot(index="priority", columns="stress", values="exceeds").fillna(0)
+    pivot = counts.unstack("stress", fill_value=0)
     pivot = pivot.rename(columns={False: "No Stress", True: "Stress"})
 
-    ax = pivot.plot(kind="bar", figsize=(10, 6))
-    ax.set_title(f"Count of {measure} > {maximum} μs")
-    ax.set_xlabel("Priority")
-    ax.set_ylabel("Number of Exceeding Samples")
-    plt.xticks(rotation=0)
-    plt.grid(True, axis="y")
-    plt.legend(title="Stress")
-
     output_path = os.path.join(graphs_dir, f"{measure}-exceeds-{maximum}.png")
-    plt.tight_layout()
-    plt.savefig(output_path)
-    plt.close()
-    print(f"Data ploted under {output_path}")
+    return FigureSpec(draw_exceeds, output_path, (pivot, measure, maximum))
 
 
 def plot_measures_deviation_number(
-    df: pd.DataFrame, maximums: dict[str, tuple[int]], graphs_dir: str
-):
+    stats: Stats, maximums: dict[str, tuple[int]], graphs_dir: str
+) -> list[FigureSpec]:
     """
-    Plot histograms of how many values exceed the given maximum for each measure,
+    Histograms of how many values exceed the given maximum for each measure,
     grouped by priority and stress.
     """
-    os.makedirs(graphs_dir, exist_ok=True)
-
-    measures = ["duration", "time_step", "latency", "jitter"]
-
-    for measure in measures:
+    specs = []
+    for measure in MEASURES:
         max_values = maximums.get(measure)
 
         if max_values is None:
             max_values = (100,)
 
         for max_value in max_values:
-            plot_measure_deviation_number(df, measure, max_value, graphs_dir)
+            specs.append(
+                plot_measure_deviation_number(stats, measure, max_value, graphs_dir)
+            )
+    return specs
 
 
-def plot_measure_distribution(df: pd.DataFrame, measure: str, graphs_dir: str):
+def plot_measure_distribution(
+    stats: Stats, measure: str, graphs_dir: str
+) -> list[FigureSpec]:
     """
-    For a given measure, plot a combined histogram (bar-style) per priority,
+    For a given measure, a combined histogram (bar-style) per priority,
     showing both stress and no-stress data.
     """
-    os.makedirs(graphs_dir, exist_ok=True)
-
-    df = df.copy()
-    df[measure] = pd.to_numeric(df[measure], errors="coerce")
-    df = df.dropna(subset=[measure])
-    df = df[df[measure] > 0]
-
-    for priority in sorted(df["priority"].unique()):
-        df_priority = df[df["priority"] == priority]
-        stress_data = df_priority[df_priority["stress"] == True][measure]
-        no_stress_data = df_priority[df_priority["stress"] == False][measure]
-
-        all_values = pd.concat([stress_data, no_stress_data])
-        bins = np.histogram_bin_edges(all_values, bins=40)
-
-        plt.figure(figsize=(10, 6))
-
-        if not no_stress_data.empty:
-            plt.hist(
-                no_stress_data,
-                bins=bins,
-                log=True,
-                alpha=0.6,
-                label="No Stress",
-                edgecolor="white",
-            )
-        if not stress_data.empty:
-            plt.hist(
-                stress_data,
-                bins=bins,
-                log=True,
-                alpha=0.6,
-                label="Stress",
-                edgecolor="white",
-            )
-
-        plt.title(f"{measure.capitalize()} Distribution\nPriority {priority}")
-        plt.xlabel(f"{measure.capitalize()} (μs)")
-        plt.ylabel("Frequency (log scale)")
-        plt.legend()
-        plt.grid(False)
-
-        mean_val = all_values.mean()
-        std_val = all_values.std()
-        stats_text = f"Mean: {mean_val:.2f} μs\nStd.Dev: {std_val:.2f} μs"
-        plt.text(
-            0.98,
-            0.95,
-            stats_text,
-            transform=plt.gca().transAxes,
-            fontsize=10,
-            verticalalignment="top",
-            horizontalalignment="right",
-            bbox=dict(boxstyle="round", facecolor="white", alpha=0.8),
-        )
+    specs = []
+    for priority in stats_priorities(stats):
+        stress_data = stats.get((priority, True), {}).get(measure)
+        no_stress_data = stats.get((priority, False), {}).get(measure)
+
+        all_values = MeasureStats()
+        for data in (stress_data, no_stress_data):
+            if data is not None:
+                all_values = all_values.merge(data)
+        if all_values.count == 0:
+            continue
+        bins, _ = all_values.distribution()
+
+        weights = {}
+        if no_stress_data is not None and no_stress_data.count:
+            weights["No Stress"] = no_stress_data.rebin(bins)
+        if stress_data is not None and stress_data.count:
+            weights["Stress"] = stress_data.rebin(bins)
 
         filename = f"{measure}-distribution-priority-{priority}.png"
-        output_path = os.path.join(graphs_dir, filename)
-        plt.tight_layout()
-        plt.savefig(output_path)
-        plt.close()
-
-        print(f"Data ploted under {output_path}")
+        specs.append(
+            FigureSpec(
+                draw_distribution,
+                os.path.join(graphs_dir, filename),
+                (
+                    bins,
+                    weights,
+                    measure,
+                    priority,
+                    all_values.mean,
+                    all_values.std,
+                ),
+            )
+        )
+    return specs
 
 
-def plot_measures_distribution(df: pd.DataFrame, graphs_dir: str):
+def plot_measures_distribution(stats: Stats, graphs_dir: str) -> list[FigureSpec]:
     """
-    Plot histograms (log-scaled y-axis with stats) for all RT measures:
+    Histograms (log-scaled y-axis with stats) for all RT measures:
     duration, time_step, latency, jitter.
     """
-    os.makedirs(graphs_dir, exist_ok=True)
-
-    measures = ["duration", "time_step", "latency", "jitter"]
-
-    for measure in measures:
-        plot_measure_distribution(df, measure, graphs_dir)
+    return [
+        spec
+        for measure in MEASURES
+        for spec in plot_measure_distribution(stats, measure, graphs_dir)
+    ]
+
+
+def plot_comparison(
+    comparison: pd.DataFrame,
+    labels: tuple[str, str],
+    confidence: float,
+    thresholds: dict[str, float],
+    graphs_dir: str,
+) -> list[FigureSpec]:
+    """
+    Forest plot of the differences of every measure between both datasets
+    """
+    return [
+        FigureSpec(
+            draw_forest,
+            os.path.join(graphs_dir, f"{measure}-compare.png"),
+            (
+                rows.reset_index(drop=True),
+                measure,
+                labels,
+                confidence,
+                thresholds[measure],
+            ),
+        )
+        for measure, rows in comparison.groupby("measure", sort=False)
+    ]
 
 
 def main():
@@ -258,13 +458,13 @@ def main():
     pp_parser = subparsers.add_parser(
         "plot-priorities", help="Plot all measures per priority"
     )
-    pp_parser.add_argument("--data", type=str, default="merged-data/data.parquet")
+    pp_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
     pp_parser.add_argument("--out", type=str, default="graphs")
 
     pms_parser = subparsers.add_parser(
         "plot-measures", help="Plot each measure across all priorities"
     )
-    pms_parser.add_argument("--data", type=str, default="merged-data/data.parquet")
+    pms_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
     pms_parser.add_argument("--out", type=str, default="graphs")
 
     pm_parser = subparsers.add_parser(
@@ -277,14 +477,14 @@ def main():
         help="Name of the measure to plot",
         choices=["latency", "time_step", "duration", "jitter"],
     )
-    pm_parser.add_argument("--data", type=str, default="merged-data/data.parquet")
+    pm_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
     pm_parser.add_argument("--out", type=str, default="graphs")
 
     pmsd_parser = subparsers.add_parser(
         "plot-measures-deviation",
         help="Plot each measure deviation across all priorities",
     )
-    pmsd_parser.add_argument("--data", type=str, default="merged-data/data.parquet")
+    pmsd_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
     pmsd_parser.add_argument("--out", type=str, default="graphs")
 
     pmd_parser = subparsers.add_parser(
@@ -299,14 +499,14 @@ def main():
         choices=["latency", "time_step", "duration", "jitter"],
     )
     pmd_parser.add_argument("--maximum", type=int, help="Maximum value")
-    pmd_parser.add_argument("--data", type=str, default="merged-data/data.parquet")
+    pmd_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
     pmd_parser.add_argument("--out", type=str, default="graphs")
 
     pmsdis_parser = subparsers.add_parser(
         "plot-measures-distribution",
         help="Plot each measure deviation across all priorities",
     )
-    pmsdis_parser.add_argument("--data", type=str, default="merged-data/data.parquet")
+    pmsdis_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
     pmsdis_parser.add_argument("--out", type=str, default="graphs")
 
     pmdis_parser = subparsers.add_parser(
@@ -321,54 +521,205 @@ def main():
         choices=["latency", "time_step", "duration", "jitter"],
     )
     pmdis_parser.add_argument("--maximum", type=int, help="Maximum value")
-    pmdis_parser.add_argument("--data", type=str, default="merged-data/data.parquet")
+    pmdis_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
     pmdis_parser.add_argument("--out", type=str, default="graphs")
 
     a_parser = subparsers.add_parser("plot-all", help="Plot all")
-    a_parser.add_argument("--data", type=str, default="merged-data/data.parquet")
+    a_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
     a_parser.add_argument("--out", type=str, default="graphs")
 
+    s_parser = subparsers.add_parser(
+        "summary",
+        help="Write the statistics of every measure as summary.csv and summary.json",
+    )
+    s_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
+    s_parser.add_argument("--out", type=str, default="merged-data")
+
+    t_parser = subparsers.add_parser(
+        "tails",
+        help="Write the tail percentiles of every measure as tails.csv, from the "
+        "histograms written by merge-data.py",
+    )
+    t_parser.add_argument(
+        "--histograms",
+        type=str,
+        nargs="+",
+        default=[DEFAULT_HISTOGRAMS],
+        help="Histogram files, added together (runs, hosts or days)",
+    )
+    t_parser.add_argument(
+        "--merged", type=str, help="Also write the added histograms on this file"
+    )
+    t_parser.add_argument("--out", type=str, default="merged-data")
+
+    c_parser = subparsers.add_parser(
+        "compare",
+        help="Compare the mean, p99, p99.9 and exceedance rate of every measure "
+        "of two datasets, with bootstrap confidence intervals",
+    )
+    c_parser.add_argument("--data", type=str, default=DEFAULT_DATA)
+    c_parser.add_argument(
+        "--other", type=str, required=True, help="Dataset compared with --data"
+    )
+    c_parser.add_argument(
+        "--labels",
+        type=str,
+        nargs=2,
+        default=("A", "B"),
+        help="Names of --data and --other in the plots",
+    )
+    c_parser.add_argument(
+        "--resamples", type=int, default=RESAMPLES, help="Bootstrap resamples"
+    )
+    c_parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    c_parser.add_argument(
+        "--block-size",
+        type=int,
+        default=BLOCK_SIZE,
+        help="Consecutive samples resampled together",
+    )
+    c_parser.add_argument("--seed", type=int, default=0)
+    c_parser.add_argument("--out", type=str, default="graphs")
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument(
+            "--priorities",
+            type=int,
+            nargs="+",
+            help="Only read these priorities (all by default)",
+        )
+        subparser.add_argument(
+            "--no-decimate",
+            action="store_true",
+            help="Draw every sample of the line plots",
+        )
+        subparser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of figures rendered in parallel",
+        )
+        subparser.add_argument(
+            "--force",
+            action="store_true",
+            help="Render the figures even when their data did not change",
+        )
+
     args = parser.parse_args()
-    df: pd.DataFrame = pd.read_parquet(args.data)
     os.makedirs(args.out, exist_ok=True)
+    decimation.set_enabled(not args.no_decimate)
 
-    if args.command == "plot-priorities":
-        plot_priorities(df, args.out)
-    elif args.command == "plot-measures":
-        plot_measures(df, args.out)
-    elif args.command == "plot-measure":
-        plot_measure(df, args.measure, args.out)
-    elif args.command == "plot-measures-deviation":
-        maxs = {
-            "duration": (
-                100,
-                120,
-            ),
-            "time_step": (100,),
-            "latency": (10,),
-            "jitter": (2,),
-        }
-        plot_measures_deviation_number(df, maxs, args.out)
-    elif args.command == "plot-measure-deviation":
-        plot_measure_deviation_number(df, args.measure, args.maximum, args.out)
-    elif args.command == "plot-measures-distribution":
-        plot_measures_distribution(df, args.out)
-    elif args.command == "plot-measure-distribution":
-        plot_measure_distribution(df, args.measure, args.out)
-    elif args.command == "plot-all":
-        plot_priorities(df, args.out)
-        plot_measures(df, args.out)
-        maxs = {
-            "duration": (
-                100,
-                120,
-            ),
-            "time_step": (100,),
-            "latency": (10,),
-            "jitter": (2,),
-        }
-        plot_measures_deviation_number(df, maxs, args.out)
-        plot_measures_distribution(df, args.out)
+    # The tails only read the histograms, not the data
+    if args.command == "tails":
+        histograms = merge_histograms(
+            [load_histograms(path) for path in args.histograms]
+        )
+        if args.priorities:
+            histograms = {
+                key: histogram
+                for key, histogram in histograms.items()
+                if key[0] in args.priorities
+            }
+        if args.merged is not None:
+            save_histograms(histograms, args.merged)
+            print(f"Histograms written on {args.merged}")
+        print(f"Tails written on {write_tails(histograms, args.out)}")
+        return
+
+    if args.command == "compare":
+        # The exceedance rate is over the first maximum of every measure
+        thresholds = {measure: values[0] for measure, values in MAXIMUMS.items()}
+        comparison = pd.DataFrame(
+            compare_datasets(
+                args.data,
+                args.other,
+                MEASURES,
+                thresholds,
+                args.priorities,
+                args.jobs,
+                args.block_size,
+                args.resamples,
+                args.confidence,
+                args.seed,
+            )
+        )
+        print(f"Comparison written on {write_comparison(comparison, args.out)}")
+        if comparison.empty:
+            return
+        specs = plot_comparison(
+            comparison, tuple(args.labels), args.confidence, thresholds, args.out
+        )
+        cache = FigureCache(args.force)
+        for output_path in render(specs, args.jobs, cache=cache):
+            print(f"Data ploted under {output_path}")
+        print(f"Figures: {cache.report()}")
+        return
+
+    # Only the columns and partitions each command uses are read
+    if args.command in (
+        "plot-measure",
+        "plot-measure-deviation",
+        "plot-measure-distribution",
+    ):
+        measures = [args.measure]
+    else:
+        measures = MEASURES
+
+    maximums = MAXIMUMS
+    if args.command == "plot-measure-deviation" and args.maximum is not None:
+        maximums = {args.measure: (args.maximum,)}
+
+    # The line plots need the samples in order, split by (priority, stress)
+    # once and shared by every plot. Histograms, exceedances and the summary
+    # come from a single streaming pass over the data instead.
+    groups = None
+    if args.command in ("plot-priorities", "plot-measures", "plot-measure", "plot-all"):
+        with_time = args.command in ("plot-priorities", "plot-all")
+        columns = measures + (["time"] if with_time else [])
+        groups = group_columns(
+            group_frames(read_frame(args.data, columns, args.priorities))
+        )
+
+    stats = None
+    if args.command not in ("plot-priorities", "plot-measures", "plot-measure"):
+        stats = compute_stats(args.data, measures, maximums, args.priorities)
+
+    if args.command == "summary":
+        for path in write_summary(stats, args.out):
+            print(f"Summary written on {path}")
+        return
+
+    specs = []
+    if args.command in ("plot-priorities", "plot-all"):
+        specs += plot_priorities(groups, args.out)
+    if args.command in ("plot-measures", "plot-all"):
+        specs += plot_measures(groups, args.out)
+    if args.command == "plot-measure":
+        specs += plot_measure(groups, args.measure, args.out)
+    if args.command in ("plot-measures-deviation", "plot-all"):
+        specs += plot_measures_deviation_number(stats, maximums, args.out)
+    if args.command == "plot-measure-deviation":
+        for maximum in maximums[args.measure]:
+            specs.append(
+                plot_measure_deviation_number(stats, args.measure, maximum, args.out)
+            )
+    if args.command in ("plot-measures-distribution", "plot-all"):
+        specs += plot_measures_distribution(stats, args.out)
+    if args.command == "plot-measure-distribution":
+        specs += plot_measure_distribution(stats, args.measure, args.out)
+
+    # Every figure of the command is rendered by the same pool
+    cache = FigureCache(args.force)
+    for output_path in render(
+        specs,
+        args.jobs,
+        initializer=decimation.set_enabled,
+        initargs=(decimation.enabled,),
+        cache=cache,
+    ):
+        print(f"Data ploted under {output_path}")
+    print(f"Figures: {cache.report()}")
 
 
 if __name__ == "__main__":
@@ -1,65 +1,41 @@
 import os
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import h5py
 
+import rtxi_reader
+from render import FigureCache, FigureSpec, render
 
-def read_field_as_df(group: h5py.File, name: str) -> pd.DataFrame:
-    dataset = group[name]
-    arr = dataset[:]
-
-    if arr.dtype.names:
-        # Dataset estructurado: convertir por campos
-        df = pd.DataFrame({name: arr[name] for name in arr.dtype.names})
-    else:
-        # Dataset simple
-        df = pd.DataFrame(arr, columns=["value"])
-
-    return df
+MEASURES = ["duration", "time_step", "latency", "jitter"]
 
 
 def read_hdf_as_dict(filename: str) -> dict:
-    with h5py.File(filename, "r") as f:
-        group = f["Trial1/Synchronous Data"]
-        dfs = {}
-        df = read_field_as_df(group, "0 RT Benchmarks OUTPUT 0 Recording Component")
-        dfs["duration"] = df
-
-        df = read_field_as_df(group, "0 RT Benchmarks OUTPUT 1 Recording Component")
-        dfs["time_step"] = df
-
-        df = read_field_as_df(group, "0 RT Benchmarks OUTPUT 2 Recording Component")
-        dfs["latency"] = df
+    """
+    Reads only the value field of every RT Benchmarks measure, joining the
+    trials of the file
+    """
+    index = rtxi_reader.index_file(filename)
+    dfs = {}
 
-        df = read_field_as_df(group, "0 RT Benchmarks OUTPUT 6 Recording Component")
-        dfs["jitter"] = df
+    with h5py.File(filename, "r") as f:
+        for measure in MEASURES:
+            values = [
+                rtxi_reader.read_field(f, index.channel(measure, trial), "value")
+                for trial in index.trial_names()
+            ]
+            dfs[measure] = pd.DataFrame({"value": np.concatenate(values)})
 
     return dfs
 
 
-def plot_measure_distribution(
-    df: pd.DataFrame, measure: str, name: str, graphs_dir: str, extra_tag: str = ""
-):
-    """
-    For a given measure, plot a combined histogram (bar-style) per priority,
-    showing both stress and no-stress data.
-    """
-    os.makedirs(graphs_dir, exist_ok=True)
-
-    df = df.copy()
-    df[measure] = pd.to_numeric(df[measure], errors="coerce")
-    df = df.dropna(subset=[measure])
-    df = df[df[measure] > 0]
-    nano_to_micro = 1000
-    df[measure] = df[measure].apply(lambda x: x / nano_to_micro)
-
-    all_values = df[measure]
+def draw_distribution(output_path: str, all_values: np.ndarray, name: str):
     bins = np.histogram_bin_edges(all_values, bins=40)
 
     plt.figure(figsize=(10, 6))
 
-    if not all_values.empty:
+    if all_values.size:
         plt.hist(
             all_values,
             bins=bins,
@@ -76,7 +52,7 @@ def plot_measure_distribution(
     plt.grid(False)
 
     mean_val = all_values.mean()
-    std_val = all_values.std()
+    std_val = all_values.std(ddof=1)
     stats_text = f"Mean: {mean_val:.2f} μs\nStd.Dev: {std_val:.2f} μs"
     plt.text(
         0.98,
@@ -89,16 +65,42 @@ def plot_measure_distribution(
         bbox=dict(boxstyle="round", facecolor="white", alpha=0.8),
     )
 
-    filename = f"{name}-distribution-rtxi-test{extra_tag}.png"
-    output_path = os.path.join(graphs_dir, filename)
     plt.tight_layout()
     plt.savefig(output_path)
     plt.close()
 
-    print(f"Data ploted under {output_path}")
+
+def plot_measure_distribution(
+    df: pd.DataFrame, measure: str, name: str, graphs_dir: str, extra_tag: str = ""
+) -> FigureSpec:
+    """
+    Figure of the histogram of a measure, in μs, without its invalid values
+    """
+    values = pd.to_numeric(df[measure], errors="coerce").to_numpy(dtype=np.float64)
+    nano_to_micro = 1000
+    all_values = values[values > 0] / nano_to_micro
+
+    filename = f"{name}-distribution-rtxi-test{extra_tag}.png"
+    output_path = os.path.join(graphs_dir, filename)
+    return FigureSpec(draw_distribution, output_path, (all_values, name))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of figures rendered in parallel",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render the figures even when their data did not change",
+    )
+    args = parser.parse_args()
+
     graphs_dir = "graphs"
     directory = "rtxi-stress"
     directory_isolated = "rtxi-stress-isolated"
@@ -109,6 +111,14 @@ if __name__ == "__main__":
     dfs = read_hdf_as_dict(os.path.join(directory, hdf5_filename))
     dfs2 = read_hdf_as_dict(os.path.join(directory_isolated, hdf5_filename))
 
+    specs = []
     for key in dfs:
-        plot_measure_distribution(dfs[key], "value", key, graphs_dir)
-        plot_measure_distribution(dfs2[key], "value", key, graphs_dir, "-isolated")
+        specs.append(plot_measure_distribution(dfs[key], "value", key, graphs_dir))
+        specs.append(
+            plot_measure_distribution(dfs2[key], "value", key, graphs_dir, "-isolated")
+        )
+
+    cache = FigureCache(args.force)
+    for output_path in render(specs, args.jobs, cache=cache):
+        print(f"Data ploted under {output_path}")
+    print(f"Figures: {cache.report()}")
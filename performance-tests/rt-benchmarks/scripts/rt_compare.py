@@ -0,0 +1,371 @@
+"""
+A/B comparison of two merged RT Benchmarks datasets. Every (priority,
+stress) group is streamed once and reduced to summaries of consecutive
+blocks of samples: their count, sum, exceedances and a coarse version of
+the log-linear histogram of hdr_histogram. The bootstrap resamples whole
+blocks, which keeps the correlation between neighbouring samples, and
+computes all the resamples at once as products of the resampling weights
+with the block summaries.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from hdr_histogram import UNIT, bucket_bounds, bucket_index
+from rt_dataset import build_filter, group_keys, open_dataset
+
+STATISTICS = ("mean", "p99", "p99.9", "exceedance")
+QUANTILES = {"p99": 99, "p99.9": 99.9}
+
+BLOCK_SIZE = 65_536
+BATCH_SIZE = 262_144
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+# The block histograms join every 2^BOOTSTRAP_MERGE_BITS consecutive
+# hdr_histogram buckets: 256 per power of two, percentiles within 0.2%, well
+# below the spread of the resampled tails
+BOOTSTRAP_MERGE_BITS = 2
+# Buckets below this percentile of the whole group are kept as one, the
+# resampled p99 never falls that low
+TAIL_PERCENTILE = 90
+
+
+@dataclass
+class BlockSummaries:
+    """
+    Per block: non NaN samples, positive samples, their sum and the samples
+    over the threshold. The histogram of the positive samples is sparse,
+    one (block, bucket, count) per used bucket.
+    """
+
+    samples: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    count: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    total: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    exceeds: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    blocks: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    buckets: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    counts: np.ndarray = field(default_factory=lambda: np.zeros(0))
+
+    @property
+    def size(self) -> int:
+        return self.samples.size
+
+
+def block_bucket(values: np.ndarray) -> np.ndarray:
+    """
+    Bucket of every positive value in the block histograms. A power of two
+    holds a multiple of 2^BOOTSTRAP_MERGE_BITS hdr_histogram buckets, so the
+    merged buckets never straddle two of them.
+    """
+    return bucket_index(values / UNIT) >> BOOTSTRAP_MERGE_BITS
+
+
+def block_bucket_bounds(buckets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lower and upper bound (in μs) of every block histogram bucket
+    """
+    lower, _ = bucket_bounds(buckets << BOOTSTRAP_MERGE_BITS)
+    _, upper = bucket_bounds(((buckets + 1) << BOOTSTRAP_MERGE_BITS) - 1)
+    return lower, upper
+
+
+class BlockAccumulator:
+    """
+    Builds the BlockSummaries of one measure from its values given batch by
+    batch, blocks being runs of block_size rows
+    """
+
+    def __init__(self, threshold: float, block_size: int = BLOCK_SIZE):
+        self.threshold = threshold
+        self.block_size = block_size
+        self.parts: list[tuple[int, int, int, float, int]] = []
+        self.histograms: list[tuple[int, np.ndarray, np.ndarray]] = []
+
+    def update(self, values: np.ndarray, first_row: int):
+        # The batch is split where the blocks start, at most a few parts
+        starts = range(
+            (first_row // self.block_size + 1) * self.block_size,
+            first_row + values.size,
+            self.block_size,
+        )
+        first_block = first_row // self.block_size
+        splits = np.split(values, [start - first_row for start in starts])
+        for block, part in enumerate(splits, first_block):
+            positive = part[part > 0]
+            self.parts.append(
+                (
+                    block,
+                    part.size - int(np.count_nonzero(np.isnan(part))),
+                    positive.size,
+                    float(positive.sum()),
+                    int(np.count_nonzero(part > self.threshold)),
+                )
+            )
+            if positive.size:
+                buckets = block_bucket(positive)
+                low = buckets.min()
+                counts = np.bincount(buckets - low)
+                used = np.flatnonzero(counts)
+                self.histograms.append((block, used + low, counts[used]))
+
+    def summaries(self) -> BlockSummaries:
+        if not self.parts:
+            return BlockSummaries()
+
+        blocks, *columns = (np.array(column) for column in zip(*self.parts))
+        size = int(blocks.max()) + 1
+        columns = [
+            np.bincount(blocks, column, minlength=size).astype(np.float64)
+            for column in columns
+        ]
+
+        if not self.histograms:
+            return BlockSummaries(*columns)
+        return BlockSummaries(
+            *columns,
+            np.concatenate(
+                [np.full(used.size, block) for block, used, _ in self.histograms]
+            ),
+            np.concatenate([used for _, used, _ in self.histograms]),
+            np.concatenate([counts for _, _, counts in self.histograms]).astype(
+                np.float64
+            ),
+        )
+
+
+def summarize_group(
+    path: str,
+    key: tuple[int, bool],
+    measures: list[str],
+    thresholds: dict[str, float],
+    block_size: int = BLOCK_SIZE,
+) -> dict[str, BlockSummaries]:
+    """
+    Block summaries of every measure of one (priority, stress) group,
+    reading the dataset one batch at a time
+    """
+    priority, stress = key
+    scanner = open_dataset(path).scanner(
+        columns=measures,
+        filter=build_filter([priority], stress),
+        batch_size=BATCH_SIZE,
+    )
+    accumulators = {
+        measure: BlockAccumulator(thresholds.get(measure, np.inf), block_size)
+        for measure in measures
+    }
+    rows = 0
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        for measure, accumulator in accumulators.items():
+            values = batch.column(measure).to_numpy(zero_copy_only=False)
+            accumulator.update(values.astype(np.float64, copy=False), rows)
+        rows += batch.num_rows
+    return {
+        measure: accumulator.summaries()
+        for measure, accumulator in accumulators.items()
+    }
+
+
+def tail_histograms(summaries: BlockSummaries) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Dense (blocks, buckets) histogram of the tail of the group, every bucket
+    under its TAIL_PERCENTILE gathered in the first column, and the value
+    taken for every column
+    """
+    used, inverse = np.unique(summaries.buckets, return_inverse=True)
+    pooled = np.bincount(inverse, summaries.counts, minlength=used.size)
+    rank = TAIL_PERCENTILE / 100 * (pooled.sum() - 1)
+    cut = int(np.searchsorted(np.cumsum(pooled), rank, side="right"))
+
+    columns = np.maximum(inverse - cut + 1, 0)
+    histograms = np.zeros((summaries.size, used.size - cut + 1))
+    np.add.at(histograms, (summaries.blocks, columns), summaries.counts)
+
+    lower, upper = block_bucket_bounds(used[cut:])
+    values = np.concatenate([lower[:1], (lower + upper) / 2])
+    return histograms, values
+
+
+def resampled_statistics(
+    summaries: BlockSummaries, weights: np.ndarray
+) -> dict[str, np.ndarray]:
+    """
+    Every statistic of the data resampled with weights, a (resamples,
+    blocks) matrix of how many times each block is taken
+    """
+    samples = weights @ summaries.samples
+    count = weights @ summaries.count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        statistics = {
+            "mean": (weights @ summaries.total) / count,
+            "exceedance": (weights @ summaries.exceeds) / samples,
+        }
+
+    if summaries.counts.size == 0:
+        for name in QUANTILES:
+            statistics[name] = np.full(weights.shape[0], np.nan)
+        return statistics
+
+    histograms, values = tail_histograms(summaries)
+    cumulative = np.cumsum(weights @ histograms, axis=1)
+    for name, percentile in QUANTILES.items():
+        ranks = percentile / 100 * (count - 1)
+        columns = (cumulative <= ranks[:, None]).sum(axis=1)
+        statistics[name] = values[np.minimum(columns, values.size - 1)]
+    return statistics
+
+
+def bootstrap_weights(
+    blocks: int, resamples: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Times each block is drawn in every resample of blocks blocks with
+    replacement
+    """
+    return rng.multinomial(blocks, np.full(blocks, 1 / blocks), size=resamples).astype(
+        np.float64
+    )
+
+
+def compare_summaries(
+    a: BlockSummaries,
+    b: BlockSummaries,
+    resamples: int,
+    confidence: float,
+    rng: np.random.Generator,
+) -> list[dict]:
+    """
+    Difference b - a of every statistic, with its percentile bootstrap
+    confidence interval, resampling the blocks of a and b independently
+    """
+    estimates = [resampled_statistics(s, np.ones((1, s.size))) for s in (a, b)]
+    resampled = [
+        resampled_statistics(s, bootstrap_weights(s.size, resamples, rng))
+        for s in (a, b)
+    ]
+    tails = [(1 - confidence) / 2, (1 + confidence) / 2]
+
+    rows = []
+    for name in STATISTICS:
+        differences = resampled[1][name] - resampled[0][name]
+        finite = differences[np.isfinite(differences)]
+        low, high = np.quantile(finite, tails) if finite.size else (np.nan, np.nan)
+        rows.append(
+            {
+                "statistic": name,
+                "a": float(estimates[0][name][0]),
+                "b": float(estimates[1][name][0]),
+                "difference": float(estimates[1][name][0] - estimates[0][name][0]),
+                "low": float(low),
+                "high": float(high),
+            }
+        )
+    return rows
+
+
+def compare_group(
+    path_a: str,
+    path_b: str,
+    key: tuple[int, bool],
+    measures: list[str],
+    thresholds: dict[str, float],
+    block_size: int,
+    resamples: int,
+    confidence: float,
+    seed: int,
+) -> list[dict]:
+    summaries = [
+        summarize_group(path, key, measures, thresholds, block_size)
+        for path in (path_a, path_b)
+    ]
+    # Seeded by group, the result does not depend on the process it ran in
+    rng = np.random.default_rng([seed, key[0], int(key[1])])
+
+    rows = []
+    for measure in measures:
+        a, b = summaries[0][measure], summaries[1][measure]
+        if a.size == 0 or b.size == 0:
+            continue
+        for row in compare_summaries(a, b, resamples, confidence, rng):
+            rows.append(
+                {
+                    "priority": key[0],
+                    "stress": key[1],
+                    "measure": measure,
+                    "blocks_a": a.size,
+                    "blocks_b": b.size,
+                }
+                | row
+            )
+    return rows
+
+
+def compare_datasets(
+    path_a: str,
+    path_b: str,
+    measures: list[str],
+    thresholds: dict[str, float],
+    priorities: list[int] | None = None,
+    jobs: int = 1,
+    block_size: int = BLOCK_SIZE,
+    resamples: int = RESAMPLES,
+    confidence: float = CONFIDENCE,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Comparison of every (priority, stress) group found in both datasets,
+    one group per process
+    """
+    keys_a = set(group_keys(path_a, priorities))
+    keys_b = set(group_keys(path_b, priorities))
+    for key in sorted(keys_a ^ keys_b):
+        print(f"Group priority {key[0]}, stress {key[1]} is not in both datasets")
+
+    common = sorted(keys_a & keys_b)
+    if jobs > 1 and len(common) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(common))) as pool:
+            futures = [
+                pool.submit(
+                    compare_group,
+                    path_a,
+                    path_b,
+                    key,
+                    measures,
+                    thresholds,
+                    block_size,
+                    resamples,
+                    confidence,
+                    seed,
+                )
+                for key in common
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [
+            compare_group(
+                path_a,
+                path_b,
+                key,
+                measures,
+                thresholds,
+                block_size,
+                resamples,
+                confidence,
+                seed,
+            )
+            for key in common
+        ]
+    return [row for rows in results for row in rows]
+
+
+def write_comparison(comparison: pd.DataFrame, out_dir: str) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "compare.csv")
+    comparison.to_csv(path, index=False)
+    return path
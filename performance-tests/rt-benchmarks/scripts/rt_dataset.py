@@ -0,0 +1,110 @@
+"""
+Access to the merged RT Benchmarks data, either the single parquet file or
+the dataset partitioned by priority and stress written by merge-data.py
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+MEASURES = ["duration", "time_step", "latency", "jitter"]
+KEY_COLUMNS = ["priority", "stress"]
+
+Groups = dict[tuple[int, bool], pd.DataFrame]
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("priority", pa.int32()), ("stress", pa.bool_())]), flavor="hive"
+)
+
+
+def open_dataset(path: str) -> ds.Dataset:
+    if os.path.isdir(path):
+        return ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    return ds.dataset(path, format="parquet")
+
+
+def build_filter(
+    priorities: list[int] | None = None, stress: bool | None = None
+) -> ds.Expression | None:
+    expression = None
+    if priorities:
+        expression = ds.field("priority").isin(priorities)
+    if stress is not None:
+        stress_expression = ds.field("stress") == stress
+        expression = (
+            stress_expression if expression is None else expression & stress_expression
+        )
+    return expression
+
+
+def group_keys(
+    path: str, priorities: list[int] | None = None
+) -> list[tuple[int, bool]]:
+    """
+    (priority, stress) of every group of the data. The partitioned dataset
+    gives them from its directories, the single file from its key columns.
+    """
+    dataset = open_dataset(path)
+    keys = set()
+    if os.path.isdir(path):
+        for fragment in dataset.get_fragments(filter=build_filter(priorities)):
+            partition = ds.get_partition_keys(fragment.partition_expression)
+            keys.add((int(partition["priority"]), bool(partition["stress"])))
+    else:
+        scanner = dataset.scanner(
+            columns=KEY_COLUMNS, filter=build_filter(priorities), batch_size=1 << 20
+        )
+        for batch in scanner.to_batches():
+            priority = batch.column("priority").to_numpy().astype(np.int64)
+            stress = batch.column("stress").to_numpy(zero_copy_only=False)
+            for key in np.unique(priority * 2 + stress):
+                keys.add((int(key // 2), bool(key % 2)))
+    return sorted(keys)
+
+
+def read_table(
+    path: str,
+    columns: list[str] | None = None,
+    priorities: list[int] | None = None,
+    stress: bool | None = None,
+) -> pa.Table:
+    """
+    Reads only the given columns (all by default, plus priority and stress)
+    of the partitions that pass the filters. priority and stress keep their
+    int32 and bool types in both layouts.
+    """
+    dataset = open_dataset(path)
+    wanted = None if columns is None else list(dict.fromkeys(KEY_COLUMNS + columns))
+    return dataset.to_table(columns=wanted, filter=build_filter(priorities, stress))
+
+
+def read_frame(
+    path: str,
+    columns: list[str] | None = None,
+    priorities: list[int] | None = None,
+    stress: bool | None = None,
+) -> pd.DataFrame:
+    table = read_table(path, columns, priorities, stress)
+    return table.to_pandas()
+
+
+def group_frames(df: pd.DataFrame) -> Groups:
+    """
+    Splits the data by (priority, stress) in a single pass. Every group keeps
+    its rows ordered by time (when the time column is present) and a
+    positional index.
+    """
+    groups = {}
+    for (priority, stress), frame in df.groupby(KEY_COLUMNS, sort=True):
+        frame = frame.drop(columns=KEY_COLUMNS)
+        if "time" in frame and not frame["time"].is_monotonic_increasing:
+            frame = frame.sort_values("time", kind="stable")
+        groups[(int(priority), bool(stress))] = frame.reset_index(drop=True)
+    return groups
+
+
+def group_priorities(groups: Groups) -> list[int]:
+    return sorted({priority for priority, _ in groups})
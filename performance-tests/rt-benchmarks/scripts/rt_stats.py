@@ -0,0 +1,231 @@
+"""
+Single pass statistics of the merged RT Benchmarks data, computed batch by
+batch so memory does not depend on the size of the dataset
+"""
+
+import os
+import csv
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from hdr_histogram import LatencyHistogram, bucket_bounds
+from rt_dataset import KEY_COLUMNS, build_filter, open_dataset
+
+PERCENTILES = (50, 99, 99.9, 99.99)
+DISTRIBUTION_BINS = 40
+BATCH_SIZE = 262_144
+
+
+@dataclass
+class MeasureStats:
+    """
+    Accumulated statistics of one measure: the log-linear histogram of
+    hdr_histogram, the exact count of the values over every threshold and
+    the mean and sum of squared deviations of the positive values. samples
+    and exceeds count every value, the rest only the positive ones, as the
+    distribution plots do.
+    """
+
+    mean: float = 0.0
+    m2: float = 0.0
+    exceeds: dict[float, int] = field(default_factory=dict)
+    histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    @property
+    def samples(self) -> int:
+        return self.histogram.samples
+
+    @property
+    def count(self) -> int:
+        return self.histogram.count
+
+    @property
+    def minimum(self) -> float:
+        return self.histogram.minimum
+
+    @property
+    def maximum(self) -> float:
+        return self.histogram.maximum
+
+    def update(self, values: np.ndarray, thresholds: tuple = ()):
+        values = values[~np.isnan(values)]
+        for threshold in thresholds:
+            self.exceeds[threshold] = self.exceeds.get(threshold, 0) + int(
+                np.count_nonzero(values > threshold)
+            )
+
+        positive = values[values > 0]
+        if positive.size:
+            batch_mean = float(positive.mean())
+            batch_m2 = float(((positive - batch_mean) ** 2).sum())
+            self._combine(positive.size, batch_mean, batch_m2)
+        self.histogram.update(values)
+
+    def _combine(self, count, mean, m2):
+        # Chan et al. parallel update of mean and sum of squared deviations,
+        # before the histogram counts the new values
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta**2 * self.count * count / total
+
+    def merge(self, other: "MeasureStats") -> "MeasureStats":
+        merged = MeasureStats(
+            mean=self.mean,
+            m2=self.m2,
+            exceeds=dict(self.exceeds),
+            histogram=self.histogram,
+        )
+        for threshold, exceeds in other.exceeds.items():
+            merged.exceeds[threshold] = merged.exceeds.get(threshold, 0) + exceeds
+        if other.count:
+            merged._combine(other.count, other.mean, other.m2)
+        merged.histogram = self.histogram.merge(other.histogram)
+        return merged
+
+    @property
+    def std(self) -> float:
+        """
+        Sample standard deviation (ddof=1), as pandas computes it
+        """
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else np.nan
+
+    def percentiles(self, percentiles=PERCENTILES) -> np.ndarray:
+        return self.histogram.percentiles(percentiles)
+
+    def distribution(
+        self, bins: int = DISTRIBUTION_BINS
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Histogram with linear bins between the minimum and the maximum
+        """
+        if self.count == 0:
+            return np.array([]), np.array([], dtype=np.int64)
+
+        edges = np.linspace(self.minimum, self.maximum, bins + 1)
+        return edges, self.rebin(edges)
+
+    def rebin(self, edges: np.ndarray) -> np.ndarray:
+        """
+        Counts of the positive values within the given edges
+        """
+        counts = self.histogram.counts
+        used = np.flatnonzero(counts)
+        lower, upper = bucket_bounds(used)
+        centers = np.clip((lower + upper) / 2, self.minimum, self.maximum)
+        rebinned, _ = np.histogram(centers, bins=edges, weights=counts[used])
+        return rebinned.astype(np.int64)
+
+
+Stats = dict[tuple[int, bool], dict[str, MeasureStats]]
+
+
+def compute_stats(
+    path: str,
+    measures: list[str],
+    thresholds: dict[str, tuple] | None = None,
+    priorities: list[int] | None = None,
+) -> Stats:
+    """
+    Statistics of every measure per (priority, stress), reading the dataset
+    one batch at a time
+    """
+    thresholds = thresholds or {}
+    dataset = open_dataset(path)
+    scanner = dataset.scanner(
+        columns=KEY_COLUMNS + measures,
+        filter=build_filter(priorities),
+        batch_size=BATCH_SIZE,
+    )
+
+    stats: Stats = {}
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+
+        priority = batch.column("priority").to_numpy()
+        stress = batch.column("stress").to_numpy(zero_copy_only=False)
+        keys = priority.astype(np.int64) * 2 + stress
+
+        if keys[0] == keys[-1] and np.all(keys == keys[0]):
+            groups = [(keys[0], None)]
+        else:
+            groups = [(key, keys == key) for key in np.unique(keys)]
+
+        for key, mask in groups:
+            group_key = (int(key // 2), bool(key % 2))
+            group_stats = stats.setdefault(
+                group_key, {measure: MeasureStats() for measure in measures}
+            )
+            for measure in measures:
+                values = batch.column(measure).to_numpy(zero_copy_only=False)
+                if mask is not None:
+                    values = values[mask]
+                group_stats[measure].update(
+                    values.astype(np.float64, copy=False),
+                    thresholds.get(measure, ()),
+                )
+
+    return dict(sorted(stats.items()))
+
+
+def stats_priorities(stats: Stats) -> list[int]:
+    return sorted({priority for priority, _ in stats})
+
+
+def summary_rows(stats: Stats) -> list[dict]:
+    rows = []
+    for (priority, stress), measures in stats.items():
+        for measure, measure_stats in measures.items():
+            row = {
+                "priority": priority,
+                "stress": stress,
+                "measure": measure,
+                "samples": measure_stats.samples,
+                "count": measure_stats.count,
+                "mean": measure_stats.mean if measure_stats.count else np.nan,
+                "std": measure_stats.std,
+                "min": measure_stats.minimum if measure_stats.count else np.nan,
+                "max": measure_stats.maximum if measure_stats.count else np.nan,
+            }
+            for percentile, value in zip(PERCENTILES, measure_stats.percentiles()):
+                row[f"p{percentile:g}"] = float(value)
+            for threshold, exceeds in sorted(measure_stats.exceeds.items()):
+                row[f"exceeds_{threshold:g}"] = exceeds
+            rows.append(row)
+    return rows
+
+
+def write_summary(stats: Stats, out_dir: str) -> tuple[str, str]:
+    """
+    Writes the statistics as summary.csv and, with the distribution
+    histograms, as summary.json
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rows = summary_rows(stats)
+
+    csv_path = os.path.join(out_dir, "summary.csv")
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    json_rows = []
+    for row in rows:
+        measure_stats = stats[(row["priority"], row["stress"])][row["measure"]]
+        edges, counts = measure_stats.distribution()
+        json_row = {
+            key: (None if isinstance(value, float) and np.isnan(value) else value)
+            for key, value in row.items()
+        }
+        json_row["histogram"] = {"edges": edges.tolist(), "counts": counts.tolist()}
+        json_rows.append(json_row)
+
+    json_path = os.path.join(out_dir, "summary.json")
+    with open(json_path, "w") as f:
+        json.dump(json_rows, f, indent=2)
+
+    return csv_path, json_path